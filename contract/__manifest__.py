@@ -11,7 +11,7 @@
 
 {
     "name": "Recurring - Contracts Management",
-    "version": "14.0.2.14.1",
+    "version": "14.0.2.15.0",
     "category": "Contract Management",
     "license": "AGPL-3",
     "author": "Tecnativa, ACSONE SA/NV, Odoo Community Association (OCA)",
@@ -28,6 +28,10 @@
         "report/contract_views.xml",
         "data/contract_cron.xml",
         "data/contract_renew_cron.xml",
+        "data/contract_line_state_cron.xml",
+        "data/contract_line_schedule_cron.xml",
+        "data/contract_invoicing_job_cron.xml",
+        "data/ir_config_parameter.xml",
         "data/mail_template.xml",
         "data/template_mail_notification.xml",
         "data/mail_message_subtype.xml",
@@ -41,6 +45,10 @@
         "views/abstract_contract_line.xml",
         "views/contract.xml",
         "views/contract_line.xml",
+        "views/contract_line_schedule.xml",
+        "views/contract_billing_run.xml",
+        "views/contract_invoicing_job.xml",
+        "report/contract_forecast_views.xml",
         "views/contract_template.xml",
         "views/contract_template_line.xml",
         "views/res_partner_view.xml",
@@ -0,0 +1,7 @@
+from openupgradelib import openupgrade
+
+
+@openupgrade.migrate()
+def migrate(env, version):
+    # Fill the schedule of the existing lines in the background
+    env.ref("contract.contract_line_schedule_cron")._trigger()
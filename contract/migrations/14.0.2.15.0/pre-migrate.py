@@ -0,0 +1,61 @@
+from openupgradelib import openupgrade
+
+
+@openupgrade.migrate()
+def migrate(env, version):
+    # Fill the stored contract of the invoices in SQL instead of letting
+    # the ORM compute it for the whole invoice history
+    if openupgrade.column_exists(env.cr, "account_move", "contract_id"):
+        return
+    openupgrade.logged_query(
+        env.cr, "ALTER TABLE account_move ADD COLUMN contract_id INTEGER"
+    )
+    openupgrade.logged_query(
+        env.cr,
+        """
+        UPDATE account_move am
+        SET contract_id = sub.contract_id
+        FROM (
+            SELECT aml.move_id, MIN(cl.contract_id) AS contract_id
+            FROM account_move_line aml
+            JOIN contract_line cl ON cl.id = aml.contract_line_id
+            GROUP BY aml.move_id
+        ) sub
+        WHERE sub.move_id = am.id
+        """,
+    )
+    openupgrade.logged_query(
+        env.cr,
+        """
+        UPDATE account_move
+        SET contract_id = old_contract_id
+        WHERE old_contract_id IS NOT NULL
+        """,
+    )
+    # Same for all the contracts of the invoices, in the table created by
+    # the ORM for the many2many field
+    openupgrade.logged_query(
+        env.cr,
+        """
+        CREATE TABLE account_move_contract_contract_rel (
+            move_id INTEGER NOT NULL,
+            contract_id INTEGER NOT NULL,
+            UNIQUE (move_id, contract_id)
+        );
+        CREATE INDEX ON account_move_contract_contract_rel (move_id);
+        CREATE INDEX ON account_move_contract_contract_rel (contract_id)
+        """,
+    )
+    openupgrade.logged_query(
+        env.cr,
+        """
+        INSERT INTO account_move_contract_contract_rel (move_id, contract_id)
+        SELECT aml.move_id, cl.contract_id
+        FROM account_move_line aml
+        JOIN contract_line cl ON cl.id = aml.contract_line_id
+        UNION
+        SELECT id, old_contract_id
+        FROM account_move
+        WHERE old_contract_id IS NOT NULL
+        """,
+    )
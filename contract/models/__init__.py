@@ -5,8 +5,12 @@ from . import abstract_contract
 from . import abstract_contract_line
 from . import contract_template
 from . import contract
+from . import contract_billing_run
+from . import contract_cron_checkpoint
+from . import contract_invoicing_job
 from . import contract_template_line
 from . import contract_line
+from . import contract_line_schedule
 from . import contract_modification
 from . import account_move
 from . import res_partner
@@ -3,7 +3,7 @@
 # Copyright 2020 Tecnativa - Pedro M. Baeza
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
-from odoo import fields, models
+from odoo import api, fields, models
 
 
 class AccountMove(models.Model):
@@ -11,6 +11,39 @@ class AccountMove(models.Model):
 
     # We keep this field for migration purpose
     old_contract_id = fields.Many2one("contract.contract")
+    contract_id = fields.Many2one(
+        comodel_name="contract.contract",
+        string="Contract",
+        compute="_compute_contract_id",
+        store=True,
+        index=True,
+        readonly=True,
+    )
+    # All the contracts invoiced by the move, which may group several ones
+    contract_ids = fields.Many2many(
+        comodel_name="contract.contract",
+        relation="account_move_contract_contract_rel",
+        column1="move_id",
+        column2="contract_id",
+        string="Contracts",
+        compute="_compute_contract_ids",
+        store=True,
+        readonly=True,
+    )
+
+    @api.depends("old_contract_id", "line_ids.contract_line_id.contract_id")
+    def _compute_contract_id(self):
+        for move in self:
+            move.contract_id = (
+                move.old_contract_id or move.line_ids.contract_line_id.contract_id[:1]
+            )
+
+    @api.depends("old_contract_id", "line_ids.contract_line_id.contract_id")
+    def _compute_contract_ids(self):
+        for move in self:
+            move.contract_ids = (
+                move.old_contract_id | move.line_ids.contract_line_id.contract_id
+            )
 
 
 class AccountMoveLine(models.Model):
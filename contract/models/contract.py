@@ -6,16 +6,39 @@
 # Copyright 2018 ACSONE SA/NV
 # Copyright 2021 Tecnativa - Víctor Martínez
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+import itertools
 import logging
+import random
+import threading
+import time
+from collections import defaultdict
 
-from odoo import api, fields, models
+from dateutil.relativedelta import relativedelta
+from psycopg2 import errors as pg_errors
+
+from odoo import api, fields, models, tools
 from odoo.exceptions import UserError, ValidationError
 from odoo.osv import expression
+from odoo.service.model import MAX_TRIES_ON_CONCURRENCY_FAILURE
 from odoo.tests import Form
 from odoo.tools.translate import _
 
+from .contract_billing_run import BillingRunRecorder, no_measure
+from .contract_invoice_batch import InvoiceBatch, InvoiceBatchMove
+
 _logger = logging.getLogger(__name__)
 
+# Errors of the concurrent workers of the recurring cron (e.g. on the
+# sequences of the journals they share), worth retrying in a new transaction
+PG_CONCURRENCY_ERRORS = (
+    pg_errors.SerializationFailure,
+    pg_errors.DeadlockDetected,
+    pg_errors.LockNotAvailable,
+)
+# Number of buckets the commercial partners of a company are spread over by
+# the parallel recurring cron, whatever the number of its workers
+CRON_SHARD_BUCKETS = 16
+
 
 class ContractContract(models.Model):
     _name = "contract.contract"
@@ -165,8 +188,35 @@ class ContractContract(models.Model):
             self._modification_mail_send()
         else:
             res = super(ContractContract, self).write(vals)
+        if set(vals) & set(self._get_schedule_fields()):
+            # Line recurrence fields may be computed from the contract ones
+            self.mapped("contract_line_ids")._update_schedule()
+        elif set(vals) & set(self._get_schedule_price_fields()):
+            self.mapped("contract_line_ids")._reprice_schedule()
         return res
 
+    @api.model
+    def _get_schedule_fields(self):
+        """Fields of the contract on which the schedule of its lines
+        depends.
+        """
+        return [
+            "line_recurrence",
+            "date_start",
+            "date_end",
+            "recurring_next_date",
+            "recurring_rule_type",
+            "recurring_interval",
+            "recurring_invoicing_type",
+        ]
+
+    @api.model
+    def _get_schedule_price_fields(self):
+        """Fields of the contract on which the prices of the schedule of its
+        lines depend.
+        """
+        return ["pricelist_id", "partner_id"]
+
     @api.model
     def _set_start_contract_modification(self):
         subtype_id = self.env.ref("contract.mail_message_subtype_contract_modification")
@@ -226,24 +276,7 @@ class ContractContract(models.Model):
 
     def _get_related_invoices(self):
         self.ensure_one()
-
-        invoices = (
-            self.env["account.move.line"]
-            .search(
-                [
-                    (
-                        "contract_line_id",
-                        "in",
-                        self.contract_line_ids.ids,
-                    )
-                ]
-            )
-            .mapped("move_id")
-        )
-        # we are forced to always search for this for not losing possible <=v11
-        # generated invoices
-        invoices |= self.env["account.move"].search([("old_contract_id", "=", self.id)])
-        return invoices
+        return self.env["account.move"].search([("contract_ids", "=", self.id)])
 
     def _get_computed_currency(self):
         """Helper method for returning the theoretical computed currency."""
@@ -284,8 +317,23 @@ class ContractContract(models.Model):
                 rec.manual_currency_id = False
 
     def _compute_invoice_count(self):
+        # A move grouping several contracts counts for each of them
+        invoice_count = {}
+        contract_ids = self._origin.ids
+        if contract_ids:
+            self.env["account.move"].flush(["contract_ids"])
+            self.env.cr.execute(
+                """
+                SELECT contract_id, COUNT(*)
+                FROM account_move_contract_contract_rel
+                WHERE contract_id IN %s
+                GROUP BY contract_id
+                """,
+                (tuple(contract_ids),),
+            )
+            invoice_count = dict(self.env.cr.fetchall())
         for rec in self:
-            rec.invoice_count = len(rec._get_related_invoices())
+            rec.invoice_count = invoice_count.get(rec._origin.id, 0)
 
     def action_show_invoices(self):
         self.ensure_one()
@@ -409,10 +457,17 @@ class ContractContract(models.Model):
     def _prepare_invoice(self, date_invoice, journal=None):
         """Prepare in a Form the values for the generated invoice record.
 
+        When an ``InvoiceBatch`` is provided in the context through the
+        ``contract_invoice_batch`` key, the values are computed without Form
+        (see ``_prepare_invoice_batch``).
+
         :return: A tuple with the vals dictionary and the Form with the
           preloaded values for being used in lines.
         """
         self.ensure_one()
+        batch = self.env.context.get("contract_invoice_batch")
+        if batch is not None:
+            return self._prepare_invoice_batch(date_invoice, batch, journal=journal)
         if not journal:
             journal = (
                 self.journal_id
@@ -459,6 +514,119 @@ class ContractContract(models.Model):
         )
         return invoice_vals, move_form
 
+    @api.model
+    def _get_invoice_partner_values(self, partner, company, invoice_type):
+        """Values set by the partner onchange of account.move.
+
+        :return: dictionary with the payment term, fiscal position and bank
+          account ids to use for the given invoice partner.
+        """
+        partner = partner.with_company(company)
+        if invoice_type == "out_invoice":
+            payment_term = partner.property_payment_term_id
+            bank_partner = company.partner_id
+        else:
+            payment_term = partner.property_supplier_payment_term_id
+            bank_partner = partner.commercial_partner_id
+        fiscal_position = (
+            self.env["account.fiscal.position"]
+            .with_company(company)
+            .get_fiscal_position(
+                partner.id,
+                delivery_id=partner.address_get(["delivery"])["delivery"],
+            )
+        )
+        return {
+            "invoice_payment_term_id": payment_term.id,
+            "fiscal_position_id": fiscal_position.id,
+            "partner_bank_id": bank_partner.bank_ids[:1].id,
+        }
+
+    def _prepare_invoice_batch(self, date_invoice, batch, journal=None):
+        """Form-free counterpart of ``_prepare_invoice``.
+
+        Journal and partner dependent values are memoized in ``batch``, so
+        they are computed once for all the contracts sharing them.
+
+        :return: A tuple with the vals dictionary and an ``InvoiceBatchMove``
+          to be used in lines instead of the Form.
+        """
+        self.ensure_one()
+        company = self.company_id
+        if not journal:
+            journal = (
+                self.journal_id
+                if self.journal_id.type == self.contract_type
+                else batch.memoize(
+                    ("journal", company.id, self.contract_type),
+                    lambda: self.env["account.journal"].search(
+                        [
+                            ("type", "=", self.contract_type),
+                            ("company_id", "=", company.id),
+                        ],
+                        limit=1,
+                    ),
+                )
+            )
+        if not journal:
+            raise ValidationError(
+                _("Please define a %s journal for the company '%s'.")
+                % (self.contract_type, company.name or "")
+            )
+        invoice_type = "out_invoice"
+        if self.contract_type == "purchase":
+            invoice_type = "in_invoice"
+        partner = self.invoice_partner_id
+        invoice_vals = {
+            "move_type": invoice_type,
+            "partner_id": partner.id,
+            "journal_id": journal.id,
+            "currency_id": self.currency_id.id,
+            "invoice_date": date_invoice,
+        }
+        invoice_vals.update(
+            batch.memoize(
+                ("partner", company.id, invoice_type, partner.id),
+                lambda: self._get_invoice_partner_values(
+                    partner, company, invoice_type
+                ),
+            )
+        )
+        if self.payment_term_id:
+            invoice_vals["invoice_payment_term_id"] = self.payment_term_id.id
+        if self.fiscal_position_id:
+            invoice_vals["fiscal_position_id"] = self.fiscal_position_id.id
+        if invoice_type == "out_invoice" and self.user_id:
+            invoice_vals["invoice_user_id"] = self.user_id.id
+        invoice_vals.update(
+            {
+                "ref": self.code,
+                "date": date_invoice,
+                "invoice_origin": self.name,
+            }
+        )
+        move = InvoiceBatchMove(
+            batch=batch,
+            company=company,
+            move_type=invoice_type,
+            journal=journal,
+            fiscal_position=self.env["account.fiscal.position"].browse(
+                invoice_vals["fiscal_position_id"]
+            ),
+            partner=partner.commercial_partner_id,
+        )
+        return invoice_vals, move
+
+    def _use_batch_invoice_preparation(self):
+        """Tell if the invoice of the contract can be prepared without Form.
+
+        Extension modules relying on the Form received by
+        ``contract.line._prepare_invoice_line`` can override this method for
+        falling back to the Form path.
+        """
+        self.ensure_one()
+        return self.company_id.contract_batch_invoice_preparation
+
     def action_contract_send(self):
         self.ensure_one()
         template = self.env.ref("contract.email_contract_template", False)
@@ -503,37 +671,100 @@ class ContractContract(models.Model):
         :return: contract lines (contract.line recordset)
         """
         self.ensure_one()
+        return self.env["contract.line"].browse(
+            self._get_lines_to_invoice_by_contract({self.id: date_ref})[self.id]
+        )
 
-        def can_be_invoiced(contract_line):
-            return (
-                not contract_line.is_canceled
-                and contract_line.recurring_next_date
-                and contract_line.recurring_next_date <= date_ref
+    def _get_lines_to_invoice_by_contract(self, date_refs):
+        """
+        Multi-contract version of ``_get_lines_to_invoice``: the lines of all
+        the contracts are read at once and selected in a single pass.
+        :param date_refs: dict contract id -> date used as reference date to
+          find the lines to invoice of this contract
+        :return: dict contract id -> list of contract line ids
+        """
+        lines_by_contract = defaultdict(list)
+        lines = self.env["contract.line"].search(
+            [("contract_id", "in", list(date_refs))]
+        )
+        for line in lines.read(
+            [
+                "contract_id",
+                "display_type",
+                "note_invoicing_mode",
+                "is_recurring_note",
+                "is_canceled",
+                "recurring_next_date",
+            ],
+            load=False,
+        ):
+            lines_by_contract[line["contract_id"]].append(line)
+        return {
+            contract_id: self._select_lines_to_invoice(
+                lines_by_contract[contract_id], date_ref
             )
+            for contract_id, date_ref in date_refs.items()
+        }
 
-        lines2invoice = previous = self.env["contract.line"]
+    @api.model
+    def _select_lines_to_invoice(self, lines, date_ref):
+        """
+        Select the lines to invoice of a contract, with their sections and
+        notes.
+        :param lines: list of dictionaries with the values of the lines of the
+          contract, in their order, as read by
+          ``_get_lines_to_invoice_by_contract``
+        :param date_ref: date used as reference date to find lines to invoice
+        :return: list of contract line ids
+        """
+        lines2invoice = []
+        previous_invoiced = False
         current_section = current_note = False
-        for line in self.contract_line_ids:
-            if line.display_type == "line_section":
-                current_section = line
-            elif line.display_type == "line_note" and not line.is_recurring_note:
-                if line.note_invoicing_mode == "with_previous_line":
-                    if previous in lines2invoice:
-                        lines2invoice |= line
+        for line in lines:
+            invoiced = False
+            if line["display_type"] == "line_section":
+                current_section = line["id"]
+            elif line["display_type"] == "line_note" and not line["is_recurring_note"]:
+                if line["note_invoicing_mode"] == "with_previous_line":
+                    if previous_invoiced:
+                        lines2invoice.append(line["id"])
+                        invoiced = True
                     current_note = False
-                elif line.note_invoicing_mode == "with_next_line":
-                    current_note = line
-            elif line.is_recurring_note or not line.display_type:
-                if can_be_invoiced(line):
+                elif line["note_invoicing_mode"] == "with_next_line":
+                    current_note = line["id"]
+            elif line["is_recurring_note"] or not line["display_type"]:
+                if (
+                    not line["is_canceled"]
+                    and line["recurring_next_date"]
+                    and line["recurring_next_date"] <= date_ref
+                ):
                     if current_section:
-                        lines2invoice |= current_section
+                        lines2invoice.append(current_section)
                         current_section = False
                     if current_note:
-                        lines2invoice |= current_note
-                    lines2invoice |= line
+                        lines2invoice.append(current_note)
+                    lines2invoice.append(line["id"])
+                    invoiced = True
                     current_note = False
-            previous = line
-        return lines2invoice.sorted()
+            previous_invoiced = invoiced
+        return lines2invoice
+
+    def _get_date_refs(self, date_ref=False):
+        """
+        Reference date of the contracts in self to invoice: the given one or
+        else the next invoice date of the first contract having one.
+        :return: dict contract id -> date, without the contracts to skip
+        """
+        date_refs = {}
+        for contract in self:
+            if not date_ref:
+                date_ref = contract.recurring_next_date
+            if not date_ref:
+                # this use case is possible when recurring_create_invoice is
+                # called for a finished contract
+                continue
+            date_refs[contract.id] = date_ref
+        return date_refs
 
     def _prepare_recurring_invoices_values(self, date_ref=False):
         """
@@ -543,86 +774,422 @@ class ContractContract(models.Model):
         :return: list of dictionaries (invoices values)
         """
         invoices_values = []
+        batch_env = self.with_context(contract_invoice_batch=InvoiceBatch()).env
+        date_refs = self._get_date_refs(date_ref)
+        with self._measure_billing_run("lines", records=len(date_refs)):
+            lines_by_contract = self._get_lines_to_invoice_by_contract(date_refs)
+        invoiced_line_ids = []
         for contract in self:
-            if not date_ref:
-                date_ref = contract.recurring_next_date
-            if not date_ref:
-                # this use case is possible when recurring_create_invoice is
-                # called for a finished contract
+            if contract.id not in date_refs:
                 continue
-            contract_lines = contract._get_lines_to_invoice(date_ref)
+            date_ref = date_refs[contract.id]
+            contract_lines = self.env["contract.line"].browse(
+                lines_by_contract[contract.id]
+            )
             if not contract_lines:
                 continue
-            invoice_vals, move_form = contract._prepare_invoice(date_ref)
-            invoice_vals["invoice_line_ids"] = []
+            if contract._use_batch_invoice_preparation():
+                contract = contract.with_env(batch_env)
+                contract_lines = contract_lines.with_env(batch_env)
+            invoice_vals = contract._prepare_recurring_invoice_values(
+                date_ref, contract_lines
+            )
+            invoices_values.append(invoice_vals)
+            # Force the recomputation of journal items
+            invoice_vals.pop("line_ids", None)
+            invoiced_line_ids += contract_lines.ids
+        # Update the invoiced lines of all the contracts at once
+        invoiced_lines = self.env["contract.line"].browse(invoiced_line_ids)
+        with self._measure_billing_run("update_lines", records=len(invoiced_lines)):
+            invoiced_lines._update_recurring_next_date()
+        return invoices_values
+
+    def _prepare_recurring_invoice_values(self, date_ref, contract_lines):
+        """
+        Build the values of the invoice of the contract in self for the given
+        lines to invoice. Nothing is written.
+        :return: dictionary (invoice values)
+        """
+        self.ensure_one()
+        with self._measure_billing_run("prepare_invoice", records=1):
+            invoice_vals, move_form = self._prepare_invoice(date_ref)
+        invoice_vals["invoice_line_ids"] = []
+        with self._measure_billing_run(
+            "prepare_invoice_line", records=len(contract_lines)
+        ):
             for line in contract_lines:
                 invoice_line_vals = line._prepare_invoice_line(move_form=move_form)
                 if invoice_line_vals:
-                    # Allow extension modules to return an empty dictionary for
-                    # nullifying line. We should then cleanup certain values.
-                    del invoice_line_vals["company_id"]
-                    del invoice_line_vals["company_currency_id"]
+                    # Allow extension modules to return an empty dictionary
+                    # for nullifying line. We should then cleanup certain
+                    # values.
+                    invoice_line_vals.pop("company_id", None)
+                    invoice_line_vals.pop("company_currency_id", None)
                     invoice_vals["invoice_line_ids"].append((0, 0, invoice_line_vals))
-            invoices_values.append(invoice_vals)
-            # Force the recomputation of journal items
-            del invoice_vals["line_ids"]
-            contract_lines._update_recurring_next_date()
-        return invoices_values
+        return invoice_vals
+
+    @api.model
+    def _get_simulation_line_fields(self):
+        return [
+            "contract_id",
+            "display_type",
+            "note_invoicing_mode",
+            "is_recurring_note",
+            "is_canceled",
+            "recurring_next_date",
+            "last_date_invoiced",
+            "date_start",
+            "date_end",
+            "recurring_rule_type",
+            "recurring_interval",
+            "recurring_invoicing_type",
+            "recurring_invoicing_offset",
+        ]
+
+    @api.model
+    def _simulate_invoiced_line(self, line):
+        """Update in place the values of a line as ``_update_recurring_next_date``
+        does when it is invoiced, and as the line fields are then recomputed.
+        """
+        mixin = self.env["contract.recurrency.mixin"]
+        line["last_date_invoiced"] = mixin._get_invoiced_period(line)[1]
+        line["recurring_next_date"] = mixin.get_next_invoice_date(
+            mixin._get_next_period_date_start(
+                line["last_date_invoiced"], line["date_start"], line["date_end"]
+            ),
+            line["recurring_invoicing_type"],
+            line["recurring_invoicing_offset"],
+            line["recurring_rule_type"],
+            line["recurring_interval"],
+            max_date_end=line["date_end"],
+        )
+
+    @api.model
+    def _read_recurring_lines(self, contract_ids):
+        """
+        Read the lines of the given contracts for following their invoiced
+        dates in memory (see ``_iter_recurring_invoices_values``).
+        :return: dict contract id -> list of dictionaries (line values)
+        """
+        lines_by_contract = defaultdict(list)
+        for line in (
+            self.env["contract.line"]
+            .search([("contract_id", "in", contract_ids)])
+            .read(self._get_simulation_line_fields(), load=False)
+        ):
+            lines_by_contract[line["contract_id"]].append(line)
+        return lines_by_contract
+
+    def _iter_recurring_invoices_values(
+        self, lines, date_to, date_from=False, invoice_date=False
+    ):
+        """
+        Generate the successive invoices of the contract in self until
+        ``date_to``, as a daily cron would do. Nothing is written: the values
+        of the invoiced lines are updated in place and provided to
+        ``_prepare_invoice_line`` through the ``contract_simulation`` context
+        key.
+        :param lines: list of dictionaries with the values of the lines of
+          the contract, as returned by ``_read_recurring_lines``
+        :param date_from: first day of the cron; by default the lines are
+          invoiced at their next invoice date
+        :param invoice_date: date of all the invoices instead of the day of
+          the cron
+        :return: generator of tuples with the day of the cron, the invoice
+          values and the values of the invoiced lines
+        """
+        self.ensure_one()
+        date_ref = date_from and date_from - relativedelta(days=1)
+        while True:
+            next_dates = [
+                line["recurring_next_date"]
+                for line in lines
+                if (line["is_recurring_note"] or not line["display_type"])
+                and not line["is_canceled"]
+                and line["recurring_next_date"]
+            ]
+            if not next_dates:
+                return
+            # The cron invoices each line at most once per day
+            date_ref = (
+                max(min(next_dates), date_ref + relativedelta(days=1))
+                if date_ref
+                else min(next_dates)
+            )
+            if date_ref > date_to:
+                return
+            line_ids = set(self._select_lines_to_invoice(lines, date_ref))
+            invoiced_lines = [line for line in lines if line["id"] in line_ids]
+            simulation = {
+                line["id"]: (line["last_date_invoiced"], line["recurring_next_date"])
+                for line in invoiced_lines
+            }
+            invoice_vals = self.with_context(
+                contract_simulation=simulation
+            )._prepare_recurring_invoice_values(
+                invoice_date or date_ref,
+                self.env["contract.line"].browse(
+                    [line["id"] for line in invoiced_lines]
+                ),
+            )
+            invoice_vals.pop("line_ids", None)
+            for line in invoiced_lines:
+                if line["is_recurring_note"] or not line["display_type"]:
+                    self._simulate_invoiced_line(line)
+            yield date_ref, invoice_vals, invoiced_lines
+
+    def _simulate_recurring_invoices(self, date_to, date_from=None):
+        """
+        Compute the invoices the recurring cron would create for the contracts
+        in self when running every day from ``date_from`` (today by default)
+        to ``date_to``, without writing anything.
+
+        The contracts are handled by batches whose cache is released, so the
+        results can be consumed as they are produced with bounded memory.
+        :return: generator of dictionaries with the contract, partner,
+          currency, date, values and amounts of each invoice
+        """
+        if not date_from:
+            date_from = fields.Date.context_today(self)
+        batch_size = max(self._get_cron_batch_size() or len(self), 1)
+        for index in range(0, len(self), batch_size):
+            contracts = self.browse(self._ids[index : index + batch_size])
+            batch_env = contracts.with_context(
+                contract_invoice_batch=InvoiceBatch()
+            ).env
+            lines_by_contract = self._read_recurring_lines(contracts.ids)
+            for contract in contracts:
+                lines = lines_by_contract[contract.id]
+                if contract._use_batch_invoice_preparation():
+                    contract = contract.with_env(batch_env)
+                for (
+                    date_ref,
+                    invoice_vals,
+                    _lines,
+                ) in contract._iter_recurring_invoices_values(
+                    lines, date_to, date_from=date_from
+                ):
+                    yield dict(
+                        self._get_simulated_invoice_amounts(invoice_vals),
+                        contract_id=contract.id,
+                        partner_id=invoice_vals["partner_id"],
+                        currency_id=invoice_vals["currency_id"],
+                        date=date_ref,
+                        invoice_values=invoice_vals,
+                    )
+            # Free the records of all the models read for the chunk (lines,
+            # products, taxes...) and not only the contracts
+            self.env.cache.invalidate()
+
+    @api.model
+    def _get_simulated_invoice_amounts(self, invoice_vals):
+        """Untaxed, tax and total amounts of the invoice values."""
+        currency = self.env["res.currency"].browse(invoice_vals["currency_id"])
+        partner = self.env["res.partner"].browse(invoice_vals["partner_id"])
+        amount_untaxed = amount_total = 0.0
+        for _command, _id, line_vals in invoice_vals["invoice_line_ids"]:
+            if line_vals.get("display_type"):
+                continue
+            price_unit = line_vals["price_unit"] * (
+                1 - (line_vals.get("discount") or 0.0) / 100.0
+            )
+            tax_ids = line_vals.get("tax_ids") and line_vals["tax_ids"][0][2] or []
+            taxes = self.env["account.tax"].browse(tax_ids)
+            res = taxes.compute_all(
+                price_unit,
+                currency=currency,
+                quantity=line_vals["quantity"],
+                product=self.env["product.product"].browse(line_vals["product_id"]),
+                partner=partner,
+            )
+            amount_untaxed += res["total_excluded"]
+            amount_total += res["total_included"]
+        return {
+            "amount_untaxed": currency.round(amount_untaxed),
+            "amount_tax": currency.round(amount_total - amount_untaxed),
+            "amount_total": currency.round(amount_total),
+        }
+
+    def simulate_recurring_invoices(self, date_to, date_from=None):
+        """
+        Preview the recurring invoicing of the contracts in self up to
+        ``date_to`` without writing anything (see
+        ``_simulate_recurring_invoices``).
+        :return: dictionary with the totals (invoice count, untaxed, tax and
+          total amounts) by contract id under the ``contracts`` key and by
+          (partner id, currency id) under the ``partners`` key
+        """
+        totals = {"contracts": {}, "partners": {}}
+        for invoice in self._simulate_recurring_invoices(date_to, date_from=date_from):
+            for key, group in (
+                ("contracts", invoice["contract_id"]),
+                ("partners", (invoice["partner_id"], invoice["currency_id"])),
+            ):
+                group_totals = totals[key].setdefault(
+                    group,
+                    {
+                        "invoice_count": 0,
+                        "amount_untaxed": 0.0,
+                        "amount_tax": 0.0,
+                        "amount_total": 0.0,
+                    },
+                )
+                group_totals["invoice_count"] += 1
+                for amount in ("amount_untaxed", "amount_tax", "amount_total"):
+                    group_totals[amount] += invoice[amount]
+        return totals
 
     def recurring_create_invoice(self):
         """
         This method triggers the creation of the next invoices of the contracts
         even if their next invoicing date is in the future.
         """
-        invoices = self._recurring_create_invoice()
-        for invoice in invoices:
-            self.message_post(
-                body=_(
-                    "Contract manually invoiced: "
-                    '<a href="#" data-oe-model="%s" data-oe-id="%s">Invoice'
-                    "</a>"
+        return self._manually_create_invoice()
+
+    def _manually_create_invoice(self, date_ref=False):
+        """Create the next invoices of the contracts in self and post a
+        message on each contract linking to its invoice."""
+        invoices = self._recurring_create_invoice(date_ref)
+        for contract, contract_invoices in self._get_invoices_by_contract(
+            invoices
+        ).items():
+            for invoice in contract_invoices:
+                contract.message_post(
+                    body=_(
+                        "Contract manually invoiced: "
+                        '<a href="#" data-oe-model="%s" data-oe-id="%s">Invoice'
+                        "</a>"
+                    )
+                    % (invoice._name, invoice.id)
                 )
-                % (invoice._name, invoice.id)
-            )
         return invoices
 
+    @api.model
+    def _get_invoices_by_contract(self, invoices):
+        """Map the contracts in self to their invoices among ``invoices``.
+
+        :return: dict contract -> account.move recordset
+        """
+        invoice_ids = defaultdict(list)
+        for move in invoices:
+            for contract in move.contract_ids:
+                if contract.id in self._ids:
+                    invoice_ids[contract].append(move.id)
+        return {
+            contract: invoices.browse(move_ids)
+            for contract, move_ids in invoice_ids.items()
+        }
+
     @api.model
     def _invoice_followers(self, invoices):
         invoice_create_subtype = self.env.ref(
             "contract.mail_message_subtype_invoice_created"
         )
-        for item in self:
+        # Subscribe at once the invoices sharing the same followers
+        invoice_ids = defaultdict(list)
+        for item, moves in self._get_invoices_by_contract(invoices).items():
             partner_ids = item.message_follower_ids.filtered(
                 lambda x: invoice_create_subtype in x.subtype_ids
             ).mapped("partner_id")
             if partner_ids:
-                (invoices & item._get_related_invoices()).message_subscribe(
-                    partner_ids=partner_ids.ids
-                )
+                invoice_ids[tuple(sorted(partner_ids.ids))] += moves.ids
+        for partner_ids, move_ids in invoice_ids.items():
+            invoices.browse(move_ids).message_subscribe(partner_ids=list(partner_ids))
 
     @api.model
     def _add_contract_origin(self, invoices):
-        for item in self:
-            for move in invoices & item._get_related_invoices():
-                move.message_post(
-                    body=(
-                        _("%s by contract %s.")
-                        % (
-                            move._creation_message(),
-                            "<a href=# data-oe-model=contract.contract data-oe-id=%d>%s</a>"
-                            % (item.id, item.display_name),
-                        )
-                    )
+        bodies = {}
+        for item, moves in self._get_invoices_by_contract(invoices).items():
+            for move in moves:
+                bodies[move.id] = _("%s by contract %s.") % (
+                    move._creation_message(),
+                    "<a href=# data-oe-model=contract.contract data-oe-id=%d>%s</a>"
+                    % (item.id, item.display_name),
                 )
+        if bodies:
+            invoices.browse(list(bodies))._message_log_batch(
+                bodies,
+                subtype_id=self.env["ir.model.data"].xmlid_to_res_id("mail.mt_note"),
+            )
 
     def _recurring_create_invoice(self, date_ref=False):
-        invoices_values = self._prepare_recurring_invoices_values(date_ref)
-        moves = self.env["account.move"].create(invoices_values)
-        self._add_contract_origin(moves)
-        self._invoice_followers(moves)
+        """Create the invoices of the contracts in self due at ``date_ref``.
+
+        With the ``contract_catch_up`` context key (set by the recurring
+        cron), the contracts whose company has a catch-up mode get the
+        invoices of all their overdue periods at once (see
+        ``_prepare_catch_up_invoices_values``).
+        """
+        catch_up = self.browse()
+        if self.env.context.get("contract_catch_up"):
+            catch_up = self.filtered("company_id.contract_catch_up_mode")
+        invoices_values = (self - catch_up)._prepare_recurring_invoices_values(date_ref)
+        if catch_up:
+            invoices_values += catch_up._prepare_catch_up_invoices_values(date_ref)
+        with self._measure_billing_run("create", records=len(invoices_values)):
+            moves = self.env["account.move"].create(invoices_values)
+        with self._measure_billing_run("post_process", records=len(moves)):
+            self._add_contract_origin(moves)
+            self._invoice_followers(moves)
         self._compute_recurring_next_date()
         return moves
 
+    def _prepare_catch_up_invoices_values(self, date_ref=False):
+        """
+        Build the values of the invoices of all the periods of the contracts
+        in self due until ``date_ref`` (today by default), in one pass. Each
+        period gets its own invoice, or all the periods of a contract are
+        gathered in one invoice when the catch-up mode of its company is
+        ``consolidated``. All the invoices are dated ``date_ref``.
+        !!! The last invoiced date of the lines is updated here !!!
+        :return: list of dictionaries (invoices values)
+        """
+        if not date_ref:
+            date_ref = fields.Date.context_today(self)
+        invoices_values = []
+        batch_env = self.with_context(contract_invoice_batch=InvoiceBatch()).env
+        with self._measure_billing_run("lines", records=len(self)):
+            lines_by_contract = self._read_recurring_lines(self.ids)
+        invoiced_lines = {}
+        for contract in self:
+            lines = lines_by_contract[contract.id]
+            if contract._use_batch_invoice_preparation():
+                contract = contract.with_env(batch_env)
+            contract_invoices_values = []
+            for (
+                _date,
+                invoice_vals,
+                period_lines,
+            ) in contract._iter_recurring_invoices_values(
+                lines, date_ref, invoice_date=date_ref
+            ):
+                contract_invoices_values.append(invoice_vals)
+                invoiced_lines.update((line["id"], line) for line in period_lines)
+            if (
+                len(contract_invoices_values) > 1
+                and contract.company_id.contract_catch_up_mode == "consolidated"
+            ):
+                invoice_vals, _move_form = contract._prepare_invoice(date_ref)
+                invoice_vals.pop("line_ids", None)
+                invoice_vals["invoice_line_ids"] = [
+                    line_command
+                    for vals in contract_invoices_values
+                    for line_command in vals["invoice_line_ids"]
+                ]
+                contract_invoices_values = [invoice_vals]
+            invoices_values += contract_invoices_values
+        # Write the last invoiced dates reached in memory, grouped by date
+        line_ids = defaultdict(list)
+        for line in invoiced_lines.values():
+            if line["is_recurring_note"] or not line["display_type"]:
+                line_ids[line["last_date_invoiced"]].append(line["id"])
+        with self._measure_billing_run("update_lines", records=len(invoiced_lines)):
+            for last_date_invoiced, ids in line_ids.items():
+                self.env["contract.line"].browse(ids)._update_recurring_next_date(
+                    last_date_invoiced
+                )
+        return invoices_values
+
     @api.model
     def _get_recurring_create_func(self, create_type="invoice"):
         """
@@ -633,32 +1200,389 @@ class ContractContract(models.Model):
             return self.__class__._recurring_create_invoice
 
     @api.model
-    def _cron_recurring_create(self, date_ref=False, create_type="invoice"):
+    def _is_billing_run_instrumented(self):
+        """Whether the runs of the recurring cron are recorded as
+        ``contract.billing.run`` with the measures of their phases.
         """
-        The cron function in order to create recurrent documents
-        from contracts.
+        return tools.str2bool(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("contract.cron.instrumentation", default="False")
+        )
+
+    def _measure_billing_run(self, phase, records=0):
+        """Context manager measuring a phase of the recurring run for the
+        company of the contracts in self, when the run is instrumented.
+        """
+        recorder = self.env.context.get("contract_billing_run")
+        if recorder is None:
+            return no_measure()
+        company = self.mapped("company_id")
+        return recorder.measure(
+            self.env.cr, len(company) == 1 and company.id, phase, records
+        )
+
+    @api.model
+    def _get_cron_batch_size(self):
+        """Number of contracts processed (and committed) together by the
+        recurring cron. A value of 0 processes all of them at once.
+        """
+        return int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("contract.cron.batch_size", default=0)
+        )
+
+    @api.model
+    def _get_cron_auto_commit(self):
+        """Whether the crons commit after each batch: not in tests, nor when
+        the ``contract_cron_no_commit`` context key is set, like in a run
+        rolled back once done.
+        """
+        return not (
+            self.env.context.get("contract_cron_no_commit")
+            or getattr(threading.currentThread(), "testing", False)
+        )
+
+    @api.model
+    def _get_cron_workers(self):
+        """Number of worker crons the shards of the recurring cron are
+        dispatched to, each one running in its own transaction. A value of 1
+        (default) processes all the contracts in the recurring cron itself.
+        """
+        return int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("contract.cron.workers", default=1)
+        )
+
+    @api.model
+    def _get_cron_checkpoint_key(self, create_type, shard=False):
+        if shard:
+            return "contract.cron.%s.%s.checkpoint" % (create_type, shard)
+        return "contract.cron.%s.checkpoint" % create_type
+
+    @api.model
+    def _get_cron_checkpoint(self, date_ref, create_type, shard=False):
+        """Return the id of the last contract processed by an interrupted
+        run of the recurring cron for the same reference date, 0 if none.
+        """
+        return self.env["contract.cron.checkpoint"]._get_checkpoint(
+            self._get_cron_checkpoint_key(create_type, shard=shard), date_ref
+        )
+
+    @api.model
+    def _set_cron_checkpoint(self, date_ref, create_type, last_id, shard=False):
+        self.env["contract.cron.checkpoint"]._set_checkpoint(
+            self._get_cron_checkpoint_key(create_type, shard=shard),
+            date_ref,
+            last_id,
+        )
+
+    def _log_recurring_create_error(self, create_type, error):
+        self.ensure_one()
+        _logger.exception(
+            "Error while generating the recurring %s of contract %s [id: %s]",
+            create_type,
+            self.name,
+            self.id,
+        )
+        self.message_post(
+            body=_("Error while generating the recurring %s: %s")
+            % (create_type, error),
+        )
+
+    def _cron_recurring_create_batch(self, date_ref, create_type):
+        """Generate the recurring documents of the contracts in self.
+
+        Contracts are processed by company, so assignation emails get correct
+        context. When the generation of a company fails, its contracts are
+        processed one by one and the failing ones are logged and skipped.
+
+        :return: list of the ids of the generated documents.
         """
         _recurring_create_func = self._get_recurring_create_func(
             create_type=create_type
         )
-        if not date_ref:
-            date_ref = fields.Date.context_today(self)
-        domain = self._get_contracts_to_invoice_domain(date_ref)
-        domain = expression.AND(
+        document_ids = []
+        for company in self.mapped("company_id"):
+            contracts_to_invoice = (
+                self.filtered(
+                    lambda c: c.company_id == company
+                    and (not c.date_end or c.recurring_next_date <= c.date_end)
+                )
+                .with_company(company)
+                .with_context(contract_catch_up=True)
+            )
+            try:
+                with self.env.cr.savepoint():
+                    documents = _recurring_create_func(contracts_to_invoice, date_ref)
+                document_ids += documents.ids
+            except PG_CONCURRENCY_ERRORS:
+                raise
+            except Exception:
+                for contract in contracts_to_invoice:
+                    try:
+                        with self.env.cr.savepoint():
+                            documents = _recurring_create_func(contract, date_ref)
+                        document_ids += documents.ids
+                    except PG_CONCURRENCY_ERRORS:
+                        raise
+                    except Exception as error:
+                        contract._log_recurring_create_error(create_type, error)
+        return document_ids
+
+    def _cron_recurring_create_batch_retry(self, date_ref, create_type, auto_commit):
+        """Run ``_cron_recurring_create_batch``, retrying it when it fails on
+        a concurrency error with the other workers of the cron, like a
+        serialization failure on the sequence of a journal they share.
+
+        When ``auto_commit``, the batch runs in a transaction of its own,
+        which is rolled back before retrying so the retry sees the changes
+        of the other workers.
+
+        :return: list of the ids of the generated documents.
+        """
+        for tries in itertools.count(1):
+            try:
+                with self.env.cr.savepoint():
+                    return self._cron_recurring_create_batch(date_ref, create_type)
+            except PG_CONCURRENCY_ERRORS as error:
+                if tries >= MAX_TRIES_ON_CONCURRENCY_FAILURE:
+                    raise
+                wait = random.uniform(0.0, 2**tries)
+                _logger.info(
+                    "Contract recurring %s: %s, retry %d/%d of the batch in %.2fs",
+                    create_type,
+                    error.__class__.__name__,
+                    tries,
+                    MAX_TRIES_ON_CONCURRENCY_FAILURE - 1,
+                    wait,
+                )
+                if auto_commit:
+                    self.env.cr.rollback()
+                self.invalidate_cache()
+                time.sleep(wait)
+
+    def _cron_recurring_create_shard(self, date_ref, create_type, shard=False):
+        """Generate the recurring documents of the contracts in self.
+
+        Contracts are processed in batches of ``contract.cron.batch_size``
+        contracts, committing after each of them and recording the last
+        processed contract, so an interrupted run resumes where it stopped.
+
+        :return: dictionary with the shard name, the number of contracts, the
+          ids of the generated documents and the duration of the shard.
+        """
+        start = time.time()
+        last_id = self._get_cron_checkpoint(date_ref, create_type, shard=shard)
+        contracts = self.filtered(lambda c: c.id > last_id).sorted("id")
+        batch_size = max(self._get_cron_batch_size() or len(contracts), 1)
+        auto_commit = self._get_cron_auto_commit()
+        document_ids = []
+        for index in range(0, len(contracts), batch_size):
+            batch = contracts[index : index + batch_size]
+            document_ids += batch._cron_recurring_create_batch_retry(
+                date_ref, create_type, auto_commit
+            )
+            self._set_cron_checkpoint(date_ref, create_type, batch[-1].id, shard=shard)
+            if auto_commit:
+                self.env.cr.commit()  # pylint: disable=invalid-commit
+        self._set_cron_checkpoint(date_ref, create_type, False, shard=shard)
+        result = {
+            "shard": shard,
+            "contracts": len(contracts),
+            "document_ids": document_ids,
+            "duration": time.time() - start,
+        }
+        _logger.info(
+            "Contract recurring %s shard %s: %d contracts, %d documents in %.2fs",
+            create_type,
+            shard or "-",
+            result["contracts"],
+            len(document_ids),
+            result["duration"],
+        )
+        return result
+
+    def _get_cron_shards(self):
+        """Partition the contracts by company, then by bucket of their
+        commercial partner, so all the contracts of a partner are always
+        processed by the same shard. The shards don't depend on the number of
+        workers, so the checkpoints of an interrupted run remain valid when
+        it changes.
+
+        :return: list of (shard name, contract ids) sorted by shard name.
+        """
+        shards = defaultdict(list)
+        for contract in self:
+            bucket = contract.commercial_partner_id.id % CRON_SHARD_BUCKETS
+            shards["%s-%s" % (contract.company_id.id, bucket)].append(contract.id)
+        return sorted(shards.items())
+
+    @api.model
+    def _get_cron_worker_crons(self, workers):
+        """Return the ``workers`` worker crons of the recurring cron, creating
+        the missing ones from the first one.
+        """
+        cron_model = self.env["ir.cron"].sudo().with_context(active_test=False)
+        first_cron = self.env.ref("contract.contract_cron_worker").sudo()
+        crons = cron_model
+        for worker in range(workers):
+            code = "model._cron_recurring_create_worker(%d)" % worker
+            cron = cron_model.search([("code", "=", code)], limit=1)
+            if not cron:
+                cron = first_cron.copy(
+                    {
+                        "name": _("Contract Recurring Documents Worker %s") % worker,
+                        "code": code,
+                    }
+                )
+            crons |= cron
+        return crons
+
+    def _cron_recurring_create_dispatch(self, date_ref, create_type, workers):
+        """Dispatch the shards of the contracts in self to ``workers`` worker
+        crons, which are run by the cron workers of the server in parallel,
+        each one in its own transaction.
+
+        The shards are assigned to the workers in turn and recorded as the
+        checkpoints of the run, each worker cron processing the shards
+        recorded for it.
+
+        :return: the triggered worker crons
+        """
+        shards = [shard for shard, _ids in self._get_cron_shards()]
+        self.env["contract.cron.checkpoint"]._set_pending_shards(
+            date_ref,
             [
-                domain,
+                (
+                    self._get_cron_checkpoint_key(create_type, shard=shard),
+                    create_type,
+                    shard,
+                    index % workers,
+                )
+                for index, shard in enumerate(shards)
+            ],
+        )
+        crons = self._get_cron_worker_crons(min(workers, len(shards)))
+        for cron in crons:
+            cron._trigger()
+        _logger.info(
+            "Contract recurring %s: %d contracts in %d shards dispatched to %d "
+            "workers",
+            create_type,
+            len(self),
+            len(shards),
+            len(crons),
+        )
+        return crons
+
+    def _cron_recurring_create_shards(self, date_ref, create_type, shards=None):
+        """Process the shards of the contracts in self one after the other.
+
+        :param shards: names of the shards to process, all by default
+        :return: list of the shard results
+        """
+        contract_ids = dict(self._get_cron_shards())
+        if shards is None:
+            shards = sorted(contract_ids)
+        return [
+            self.browse(contract_ids.get(shard, []))._cron_recurring_create_shard(
+                date_ref, create_type, shard=shard
+            )
+            for shard in shards
+        ]
+
+    @api.model
+    def _get_cron_recurring_create_domain(self, date_ref, create_type):
+        return expression.AND(
+            [
+                self._get_contracts_to_invoice_domain(date_ref),
                 [("generation_type", "=", create_type)],
             ]
         )
-        contracts = self.search(domain)
-        companies = set(contracts.mapped("company_id"))
-        # Invoice by companies, so assignation emails get correct context
-        for company in companies:
-            contracts_to_invoice = contracts.filtered(
-                lambda c: c.company_id == company
-                and (not c.date_end or c.recurring_next_date <= c.date_end)
-            ).with_company(company)
-            _recurring_create_func(contracts_to_invoice, date_ref)
+
+    @api.model
+    def _cron_recurring_create_run(self, date_ref, create_type, shards=False):
+        """Generate the recurring documents of the contracts due at
+        ``date_ref``, recording the run when instrumented.
+
+        :param shards: names of the shards to process, True for all of them,
+          False to process the contracts without sharding
+        :return: list of the shard results
+        """
+        recorder = None
+        if self._is_billing_run_instrumented():
+            recorder = BillingRunRecorder()
+            self = self.with_context(contract_billing_run=recorder)
+        start = time.time()
+        with self._measure_billing_run("search"):
+            contracts = self.search(
+                self._get_cron_recurring_create_domain(date_ref, create_type),
+                order="id",
+            )
+        if shards is False:
+            results = [contracts._cron_recurring_create_shard(date_ref, create_type)]
+        else:
+            results = contracts._cron_recurring_create_shards(
+                date_ref, create_type, shards=None if shards is True else shards
+            )
+        if recorder is not None:
+            self.env["contract.billing.run"]._create_from_recorder(
+                recorder,
+                {
+                    "date_ref": date_ref,
+                    "create_type": create_type,
+                    "duration": time.time() - start,
+                    "contract_count": sum(result["contracts"] for result in results),
+                    "document_count": sum(
+                        len(result["document_ids"]) for result in results
+                    ),
+                },
+            )
+        return results
+
+    @api.model
+    def _cron_recurring_create_worker(self, worker):
+        """Process the shards dispatched to the worker cron of index
+        ``worker`` by ``_cron_recurring_create_dispatch``, as well as the
+        ones it left unfinished.
+        """
+        pending = defaultdict(list)
+        for create_type, date_ref, shard in self.env[
+            "contract.cron.checkpoint"
+        ]._get_pending_shards(worker):
+            pending[(create_type, date_ref)].append(shard)
+        for (create_type, date_ref), shards in pending.items():
+            self._cron_recurring_create_run(date_ref, create_type, shards=shards)
+        return True
+
+    @api.model
+    def _cron_recurring_create(self, date_ref=False, create_type="invoice"):
+        """
+        The cron function in order to create recurrent documents
+        from contracts.
+        When ``contract.cron.workers`` is greater than 1, the contracts are
+        split in shards dispatched to as many worker crons, which run in
+        parallel. Without commits, as in a dry run, the shards are processed
+        here one after the other, as the worker crons couldn't see the data
+        of the current transaction.
+        """
+        if not date_ref:
+            date_ref = fields.Date.context_today(self)
+        date_ref = fields.Date.to_date(date_ref)
+        workers = self._get_cron_workers()
+        if workers <= 1:
+            self._cron_recurring_create_run(date_ref, create_type)
+        elif self.env.context.get("contract_cron_no_commit"):
+            self._cron_recurring_create_run(date_ref, create_type, shards=True)
+        else:
+            contracts = self.search(
+                self._get_cron_recurring_create_domain(date_ref, create_type),
+                order="id",
+            )
+            contracts._cron_recurring_create_dispatch(date_ref, create_type, workers)
         return True
 
     @api.model
@@ -0,0 +1,121 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from odoo import api, fields, models
+
+BILLING_RUN_PHASES = [
+    ("search", "Search"),
+    ("lines", "Lines to invoice"),
+    ("prepare_invoice", "Invoice preparation"),
+    ("prepare_invoice_line", "Invoice line preparation"),
+    ("update_lines", "Contract lines update"),
+    ("create", "Invoice creation"),
+    ("post_process", "Followers and messages"),
+]
+
+
+@contextmanager
+def no_measure():
+    yield
+
+
+class BillingRunRecorder(object):
+    """Accumulate the measures of the phases of a recurring run by company.
+
+    It is shared through the ``contract_billing_run`` context key by all the
+    batches (and threads) of the run.
+    """
+
+    def __init__(self):
+        # (company id, phase) -> [duration, query count, record count]
+        self.measures = defaultdict(lambda: [0.0, 0, 0])
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, cr, company_id, phase, records=0):
+        start = time.perf_counter()
+        query_count = cr.sql_log_count
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            queries = cr.sql_log_count - query_count
+            with self._lock:
+                measure = self.measures[(company_id, phase)]
+                measure[0] += duration
+                measure[1] += queries
+                measure[2] += records
+
+
+class ContractBillingRun(models.Model):
+    _name = "contract.billing.run"
+    _description = "Contract Billing Run"
+    _order = "date desc, id desc"
+
+    date = fields.Datetime(required=True, readonly=True, default=fields.Datetime.now)
+    date_ref = fields.Date(string="Reference Date", readonly=True)
+    create_type = fields.Char(string="Generation Type", readonly=True)
+    duration = fields.Float(readonly=True, help="Wall time of the run, in seconds.")
+    contract_count = fields.Integer(readonly=True)
+    document_count = fields.Integer(readonly=True)
+    line_ids = fields.One2many(
+        comodel_name="contract.billing.run.line",
+        inverse_name="run_id",
+        string="Phases",
+        readonly=True,
+    )
+
+    def name_get(self):
+        return [
+            (run.id, "%s (%s)" % (fields.Datetime.to_string(run.date), run.create_type))
+            for run in self
+        ]
+
+    @api.model
+    def _create_from_recorder(self, recorder, vals):
+        vals = dict(
+            vals,
+            line_ids=[
+                (
+                    0,
+                    0,
+                    {
+                        "company_id": company_id,
+                        "phase": phase,
+                        "duration": duration,
+                        "query_count": query_count,
+                        "record_count": record_count,
+                    },
+                )
+                for (company_id, phase), (
+                    duration,
+                    query_count,
+                    record_count,
+                ) in recorder.measures.items()
+            ],
+        )
+        return self.sudo().create(vals)
+
+
+class ContractBillingRunLine(models.Model):
+    _name = "contract.billing.run.line"
+    _description = "Contract Billing Run Phase"
+    _order = "run_id desc, company_id, id"
+
+    run_id = fields.Many2one(
+        comodel_name="contract.billing.run",
+        string="Run",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+    date = fields.Datetime(related="run_id.date", store=True)
+    company_id = fields.Many2one(comodel_name="res.company", string="Company")
+    phase = fields.Selection(selection=BILLING_RUN_PHASES, required=True)
+    duration = fields.Float(help="Wall time of the phase, in seconds.")
+    query_count = fields.Integer()
+    record_count = fields.Integer()
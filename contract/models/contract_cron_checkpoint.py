@@ -0,0 +1,122 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo import api, fields, models
+
+
+class ContractCronCheckpoint(models.Model):
+    """Last contract processed by a run of the recurring cron, by key.
+
+    It is written after every batch of the cron with a plain SQL upsert, so
+    neither the ORM caches nor the registry caches are invalidated. In a
+    parallel run, the checkpoints of the shards are created when they are
+    dispatched, and removed once processed by their worker cron.
+    """
+
+    _name = "contract.cron.checkpoint"
+    _description = "Contract Cron Checkpoint"
+    _log_access = False
+
+    name = fields.Char(string="Key", required=True, readonly=True)
+    date_ref = fields.Date(string="Reference Date", readonly=True)
+    last_id = fields.Integer(string="Last Contract ID", readonly=True)
+    create_type = fields.Char(string="Generation Type", readonly=True)
+    shard = fields.Char(readonly=True)
+    worker = fields.Integer(
+        readonly=True,
+        help="Index of the worker cron the shard is dispatched to, in a "
+        "parallel run of the recurring cron.",
+    )
+
+    _sql_constraints = [
+        ("name_uniq", "unique (name)", "The key of the checkpoint must be unique."),
+    ]
+
+    @api.model
+    def _get_checkpoint(self, key, date_ref):
+        """Return the last id recorded for ``key`` and ``date_ref``, 0 if
+        none.
+        """
+        self.env.cr.execute(
+            "SELECT last_id FROM contract_cron_checkpoint "
+            "WHERE name = %s AND date_ref = %s",
+            (key, date_ref),
+        )
+        row = self.env.cr.fetchone()
+        return row[0] if row else 0
+
+    @api.model
+    def _set_checkpoint(self, key, date_ref, last_id):
+        """Record ``last_id`` for ``key`` and ``date_ref``, or clear the
+        checkpoint of ``key`` when ``last_id`` is falsy.
+        """
+        if not last_id:
+            self.env.cr.execute(
+                "DELETE FROM contract_cron_checkpoint WHERE name = %s", (key,)
+            )
+            return
+        self.env.cr.execute(
+            """
+            INSERT INTO contract_cron_checkpoint (name, date_ref, last_id)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (name)
+            DO UPDATE SET date_ref = EXCLUDED.date_ref, last_id = EXCLUDED.last_id
+            """,
+            (key, date_ref, last_id),
+        )
+
+    @api.model
+    def _set_pending_shards(self, date_ref, shards):
+        """Record the shards dispatched to the worker crons. The checkpoint of
+        a shard interrupted for the same reference date is kept.
+
+        :param shards: list of (key, generation type, shard, worker index)
+        """
+        if not shards:
+            return
+        keys, create_types, shard_names, workers = zip(*shards)
+        self.env.cr.execute(
+            """
+            INSERT INTO contract_cron_checkpoint (
+                name, date_ref, last_id, create_type, shard, worker
+            )
+            SELECT v.name, %(date_ref)s, 0, v.create_type, v.shard, v.worker
+            FROM UNNEST(
+                %(keys)s::varchar[], %(create_types)s::varchar[],
+                %(shards)s::varchar[], %(workers)s::integer[]
+            ) AS v(name, create_type, shard, worker)
+            ON CONFLICT (name)
+            DO UPDATE SET
+                last_id = CASE
+                    WHEN contract_cron_checkpoint.date_ref = EXCLUDED.date_ref
+                    THEN contract_cron_checkpoint.last_id
+                    ELSE 0
+                END,
+                date_ref = EXCLUDED.date_ref,
+                create_type = EXCLUDED.create_type,
+                shard = EXCLUDED.shard,
+                worker = EXCLUDED.worker
+            """,
+            {
+                "date_ref": date_ref,
+                "keys": list(keys),
+                "create_types": list(create_types),
+                "shards": list(shard_names),
+                "workers": list(workers),
+            },
+        )
+
+    @api.model
+    def _get_pending_shards(self, worker):
+        """:return: list of (generation type, reference date, shard) still to
+        process by the worker cron of index ``worker``
+        """
+        self.env.cr.execute(
+            """
+            SELECT create_type, date_ref, shard
+            FROM contract_cron_checkpoint
+            WHERE worker = %s
+            ORDER BY name
+            """,
+            (worker,),
+        )
+        return self.env.cr.fetchall()
@@ -0,0 +1,35 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from collections import namedtuple
+
+# Header values of an invoice prepared in batch mode. It replaces the
+# account.move Form received by contract.line._prepare_invoice_line, so the
+# line values can be computed without any onchange.
+InvoiceBatchMove = namedtuple(
+    "InvoiceBatchMove",
+    [
+        "batch",  # InvoiceBatch shared by all the invoices of the run
+        "company",  # res.company of the invoice
+        "move_type",  # out_invoice or in_invoice
+        "journal",  # account.journal of the invoice
+        "fiscal_position",  # account.fiscal.position applied on the invoice
+        "partner",  # commercial partner of the invoice
+    ],
+)
+
+
+class InvoiceBatch(object):
+    """Memoize the values shared by all the invoices prepared in one run.
+
+    Journals, partner dependent values (payment term, fiscal position, bank)
+    and product accounts and taxes only depend on a handful of keys, so they
+    are computed once per key instead of once per contract or per line.
+    """
+
+    def __init__(self):
+        self._cache = {}
+
+    def memoize(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
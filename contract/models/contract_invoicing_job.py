@@ -0,0 +1,199 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import logging
+from collections import defaultdict
+
+from odoo import _, api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+
+class ContractInvoicingJob(models.Model):
+    """Background invoicing of the contracts selected in the manual invoicing
+    wizard, by chunks of ``contract.cron.batch_size`` contracts.
+
+    The chunks are processed by the ``contract_invoicing_job_cron`` cron, or
+    by any other mean overriding ``_dispatch`` (e.g. ``contract_queue_job``).
+    """
+
+    _name = "contract.invoicing.job"
+    _description = "Contract Invoicing Job"
+    _order = "id desc"
+
+    invoice_date = fields.Date(required=True, readonly=True)
+    contract_type = fields.Selection(
+        selection=[("sale", "Customer"), ("purchase", "Supplier")],
+        required=True,
+        readonly=True,
+    )
+    company_ids = fields.Many2many(
+        comodel_name="res.company",
+        string="Companies",
+        readonly=True,
+        help="Companies allowed when the job was created.",
+    )
+    state = fields.Selection(
+        selection=[
+            ("pending", "Pending"),
+            ("running", "Running"),
+            ("done", "Done"),
+        ],
+        default="pending",
+        required=True,
+        readonly=True,
+    )
+    dispatched_by_cron = fields.Boolean(default=True, readonly=True)
+    total_count = fields.Integer(readonly=True)
+    done_count = fields.Integer(readonly=True)
+    failed_count = fields.Integer(readonly=True)
+    progress = fields.Float(compute="_compute_progress")
+    last_contract_id = fields.Integer(
+        readonly=True, help="Last processed contract, where the job resumes."
+    )
+    invoice_ids = fields.Many2many(
+        comodel_name="account.move", string="Invoices", readonly=True
+    )
+    failed_contract_ids = fields.Many2many(
+        comodel_name="contract.contract",
+        string="Failed Contracts",
+        readonly=True,
+    )
+
+    @api.depends("total_count", "done_count", "failed_count")
+    def _compute_progress(self):
+        for job in self:
+            job.progress = (
+                100.0 * (job.done_count + job.failed_count) / job.total_count
+                if job.total_count
+                else 100.0
+            )
+
+    def name_get(self):
+        return [
+            (
+                job.id,
+                _("Invoicing of %s") % fields.Date.to_string(job.invoice_date),
+            )
+            for job in self
+        ]
+
+    def _get_contract_domain(self):
+        self.ensure_one()
+        return self.env["contract.contract"]._get_contracts_to_invoice_domain(
+            self.invoice_date
+        ) + [
+            ("contract_type", "=", self.contract_type),
+            ("id", ">", self.last_contract_id),
+        ]
+
+    def _get_contract_env(self):
+        """Environment of the user who created the job, with the companies
+        allowed at that time."""
+        self.ensure_one()
+        return (
+            self.env["contract.contract"]
+            .with_user(self.create_uid)
+            .with_context(allowed_company_ids=self.company_ids.ids)
+            .env
+        )
+
+    def _process_chunk(self):
+        """Invoice the next chunk of contracts of the job.
+
+        The contracts are invoiced by company and next invoice date, like
+        ``contract.contract.recurring_create_invoice`` does one by one. When a
+        group fails, its contracts are invoiced one by one and the failing
+        ones are logged and skipped.
+
+        :return: whether there are contracts left to invoice.
+        """
+        self.ensure_one()
+        contract_model = self.env["contract.contract"].with_env(
+            self._get_contract_env()
+        )
+        contracts = contract_model.search(
+            self._get_contract_domain(),
+            order="id",
+            limit=contract_model._get_cron_batch_size() or None,
+        )
+        if not contracts:
+            self.state = "done"
+            return False
+        contract_ids_by_group = defaultdict(list)
+        for contract in contracts:
+            contract_ids_by_group[
+                (contract.company_id, contract.recurring_next_date)
+            ].append(contract.id)
+        invoices = self.env["account.move"]
+        failed_contracts = self.env["contract.contract"]
+        for (company, date_ref), contract_ids in contract_ids_by_group.items():
+            group = contracts.browse(contract_ids).with_company(company)
+            try:
+                with self.env.cr.savepoint():
+                    invoices |= group._manually_create_invoice(date_ref)
+            except Exception:
+                for contract in group:
+                    try:
+                        with self.env.cr.savepoint():
+                            invoices |= contract._manually_create_invoice(date_ref)
+                    except Exception as error:
+                        contract._log_recurring_create_error("invoice", error)
+                        failed_contracts |= contract
+        self.write(
+            {
+                "state": "running",
+                "last_contract_id": contracts[-1].id,
+                "done_count": self.done_count + len(contracts - failed_contracts),
+                "failed_count": self.failed_count + len(failed_contracts),
+                "invoice_ids": [(4, invoice.id) for invoice in invoices],
+                "failed_contract_ids": [
+                    (4, contract.id) for contract in failed_contracts
+                ],
+            }
+        )
+        return True
+
+    def _dispatch(self):
+        """Start the processing of the jobs in the background."""
+        self.env.ref("contract.contract_invoicing_job_cron")._trigger()
+
+    @api.model
+    def cron_process_invoicing_jobs(self):
+        jobs = self.search(
+            [
+                ("state", "in", ("pending", "running")),
+                ("dispatched_by_cron", "=", True),
+            ],
+            order="id",
+        )
+        for job in jobs:
+            while job._process_chunk():
+                _logger.info(
+                    "Contract invoicing job %s: %d/%d contracts processed",
+                    job.id,
+                    job.done_count + job.failed_count,
+                    job.total_count,
+                )
+                if self.env["contract.contract"]._get_cron_auto_commit():
+                    self.env.cr.commit()  # pylint: disable=invalid-commit
+        return True
+
+    def action_show_invoices(self):
+        self.ensure_one()
+        return {
+            "type": "ir.actions.act_window",
+            "name": _("Invoices"),
+            "res_model": "account.move",
+            "domain": [("id", "in", self.invoice_ids.ids)],
+            "view_mode": "tree,form",
+        }
+
+    def action_show_failed_contracts(self):
+        self.ensure_one()
+        return {
+            "type": "ir.actions.act_window",
+            "name": _("Failed Contracts"),
+            "res_model": "contract.contract",
+            "domain": [("id", "in", self.failed_contract_ids.ids)],
+            "view_mode": "tree,form",
+        }
@@ -3,14 +3,17 @@
 # Copyright 2020 Tecnativa - Pedro M. Baeza
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
+from collections import defaultdict
 from datetime import timedelta
 
 from dateutil.relativedelta import relativedelta
 
-from odoo import _, api, fields, models
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import ValidationError
 
+from .contract_invoice_batch import InvoiceBatchMove
 from .contract_line_constraints import get_allowed
+from .contract_line_markers import render_markers
 
 
 class ContractLine(models.Model):
@@ -109,7 +112,7 @@ class ContractLine(models.Model):
             ("canceled", "Canceled"),
         ],
         compute="_compute_state",
-        search="_search_state",
+        store=True,
     )
     active = fields.Boolean(
         string="Active",
@@ -118,6 +121,397 @@ class ContractLine(models.Model):
         readonly=True,
         default=True,
     )
+    schedule_ids = fields.One2many(
+        comodel_name="contract.line.schedule",
+        inverse_name="contract_line_id",
+        string="Schedule",
+    )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records._update_schedule()
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        if not self.env.context.get("contract_schedule_skip"):
+            if set(vals) & set(self._get_schedule_fields()):
+                self._update_schedule()
+            elif set(vals) & set(self._get_schedule_price_fields()):
+                self._reprice_schedule()
+        return res
+
+    @api.model
+    def _get_schedule_fields(self):
+        """Fields of the line on which the periods of its schedule depend."""
+        return [
+            "date_start",
+            "date_end",
+            "last_date_invoiced",
+            "recurring_next_date",
+            "recurring_rule_type",
+            "recurring_interval",
+            "recurring_invoicing_type",
+            "is_canceled",
+            "display_type",
+            "is_recurring_note",
+        ]
+
+    @api.model
+    def _get_schedule_price_fields(self):
+        """Fields of the line on which only the amounts of its schedule
+        depend.
+        """
+        return [
+            "product_id",
+            "quantity",
+            "uom_id",
+            "automatic_price",
+            "specific_price",
+            "discount",
+        ]
+
+    @api.model
+    def _get_schedule_horizon(self):
+        """Number of months from today for which the periods of the lines
+        are materialized in their schedule. A value of 0 disables the
+        schedule.
+        """
+        return int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("contract.schedule.horizon", default=0)
+        )
+
+    def _get_schedule_periods(self, date_to):
+        """Compute the next periods of the lines in self invoiced until
+        ``date_to``. The first period of each line follows its next invoice
+        date, the next ones are computed for all the lines at once.
+
+        :return: dictionary line id -> list of tuples (date start, date end,
+          invoice date).
+        """
+        periods_by_line = {}
+        lines = []
+        for line in self:
+            periods_by_line[line.id] = []
+            if line.is_canceled or (line.display_type and not line.is_recurring_note):
+                continue
+            date_start = line.next_period_date_start
+            invoice_date = line.recurring_next_date
+            if not (date_start and invoice_date) or invoice_date > date_to:
+                continue
+            date_end = line.get_next_period_date_end(
+                date_start,
+                line.recurring_rule_type,
+                line.recurring_interval,
+                max_date_end=line.date_end,
+                next_invoice_date=invoice_date,
+                recurring_invoicing_type=line.recurring_invoicing_type,
+                recurring_invoicing_offset=line.recurring_invoicing_offset,
+            )
+            if date_end:
+                periods_by_line[line.id].append((date_start, date_end, invoice_date))
+                lines.append(line)
+        if lines:
+            next_periods = self.get_next_periods_bulk(
+                [
+                    periods_by_line[line.id][0][1] + relativedelta(days=1)
+                    for line in lines
+                ],
+                [line.recurring_rule_type for line in lines],
+                [line.recurring_interval for line in lines],
+                [line.recurring_invoicing_type for line in lines],
+                [line.recurring_invoicing_offset for line in lines],
+                [line.date_end for line in lines],
+                date_to,
+            )
+            for line, periods in zip(lines, next_periods):
+                periods_by_line[line.id] += periods
+        return periods_by_line
+
+    def _get_schedule_amounts(self):
+        """Quantity and subtotal of the periods of the schedule of the line.
+        They are the same for all its periods, so they are computed once per
+        line instead of once per period.
+        """
+        self.ensure_one()
+        quantity = self.quantity if not self.display_type else 0.0
+        price_subtotal = quantity * self.price_unit * (1 - self.discount / 100)
+        return quantity, self.contract_id.currency_id.round(price_subtotal)
+
+    def _invalidate_schedule_cache(self):
+        self.env["contract.line.schedule"].invalidate_cache()
+        self.invalidate_cache(["schedule_ids"], self.ids)
+
+    @api.model
+    def _insert_schedule(self, rows):
+        """Insert the schedule periods of ``rows`` in a single query.
+
+        :param rows: list of tuples (line id, sequence, date start, date end,
+          invoice date, quantity, subtotal)
+        """
+        if not rows:
+            return
+        self.flush(["contract_id", "company_id"])
+        columns = list(zip(*rows))
+        self.env.cr.execute(
+            """
+            INSERT INTO contract_line_schedule (
+                contract_line_id, contract_id, company_id, sequence, date_start,
+                date_end, invoice_date, quantity, price_subtotal, create_uid,
+                create_date, write_uid, write_date
+            )
+            SELECT l.id, l.contract_id, l.company_id, v.sequence, v.date_start,
+                v.date_end, v.invoice_date, v.quantity, v.price_subtotal,
+                %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s,
+                NOW() AT TIME ZONE 'UTC'
+            FROM UNNEST(
+                %(line_ids)s::integer[], %(sequences)s::integer[],
+                %(dates_start)s::date[], %(dates_end)s::date[],
+                %(invoice_dates)s::date[], %(quantities)s::float8[],
+                %(subtotals)s::float8[]
+            ) AS v(
+                line_id, sequence, date_start, date_end, invoice_date, quantity,
+                price_subtotal
+            )
+            JOIN contract_line l ON l.id = v.line_id
+            """,
+            {
+                "uid": self.env.uid,
+                "line_ids": list(columns[0]),
+                "sequences": list(columns[1]),
+                "dates_start": list(columns[2]),
+                "dates_end": list(columns[3]),
+                "invoice_dates": list(columns[4]),
+                "quantities": list(columns[5]),
+                "subtotals": list(columns[6]),
+            },
+        )
+
+    def _update_schedule(self):
+        """Rebuild the schedule of the lines in self."""
+        if not self.ids:
+            return
+        self.env["contract.line.schedule"].flush(["contract_line_id"])
+        self.env.cr.execute(
+            "DELETE FROM contract_line_schedule WHERE contract_line_id IN %s",
+            (tuple(self.ids),),
+        )
+        horizon = self._get_schedule_horizon()
+        if horizon:
+            date_to = fields.Date.context_today(self) + relativedelta(months=horizon)
+            periods_by_line = self._get_schedule_periods(date_to)
+            rows = []
+            for line in self.filtered(lambda x: periods_by_line[x.id]):
+                amounts = line._get_schedule_amounts()
+                rows += [
+                    (line.id, sequence) + period + amounts
+                    for sequence, period in enumerate(periods_by_line[line.id], 1)
+                ]
+            self._insert_schedule(rows)
+        self._invalidate_schedule_cache()
+
+    def _reprice_schedule(self):
+        """Update the quantity and subtotal of the periods of the schedule of
+        the lines in self, in a single query.
+        """
+        if not self.ids or not self._get_schedule_horizon():
+            return
+        amounts = [(line.id,) + line._get_schedule_amounts() for line in self]
+        self._update_schedule_amounts(amounts)
+
+    @api.model
+    def _update_schedule_amounts(self, amounts):
+        """:param amounts: list of tuples (line id, quantity, subtotal)"""
+        if not amounts:
+            return
+        self.env["contract.line.schedule"].flush(
+            ["contract_line_id", "quantity", "price_subtotal"]
+        )
+        columns = list(zip(*amounts))
+        self.env.cr.execute(
+            """
+            UPDATE contract_line_schedule s
+            SET quantity = v.quantity,
+                price_subtotal = v.price_subtotal,
+                write_uid = %(uid)s,
+                write_date = NOW() AT TIME ZONE 'UTC'
+            FROM UNNEST(
+                %(line_ids)s::integer[], %(quantities)s::float8[],
+                %(subtotals)s::float8[]
+            ) AS v(line_id, quantity, price_subtotal)
+            WHERE s.contract_line_id = v.line_id
+            """,
+            {
+                "uid": self.env.uid,
+                "line_ids": list(columns[0]),
+                "quantities": list(columns[1]),
+                "subtotals": list(columns[2]),
+            },
+        )
+        self.browse(columns[0])._invalidate_schedule_cache()
+
+    def _extend_schedule(self, date_to):
+        """Add to the schedule of the lines in self the periods invoiced until
+        ``date_to`` after their last scheduled period, with the quantity and
+        subtotal of this period. The schedule of the lines having none is
+        built.
+        """
+        if not self.ids:
+            return
+        self.flush(
+            [
+                "recurring_rule_type",
+                "recurring_interval",
+                "recurring_invoicing_type",
+                "date_end",
+            ]
+        )
+        self.env["contract.line.schedule"].flush()
+        self.env.cr.execute(
+            """
+            SELECT DISTINCT ON (s.contract_line_id)
+                s.contract_line_id, s.sequence, s.date_end, s.quantity,
+                s.price_subtotal, l.recurring_rule_type, l.recurring_interval,
+                l.recurring_invoicing_type, l.date_end
+            FROM contract_line_schedule s
+            JOIN contract_line l ON l.id = s.contract_line_id
+            WHERE s.contract_line_id IN %s
+            ORDER BY s.contract_line_id, s.sequence DESC
+            """,
+            (tuple(self.ids),),
+        )
+        last_periods = self.env.cr.fetchall()
+        scheduled_ids = {row[0] for row in last_periods}
+        self.browse(
+            [line_id for line_id in self.ids if line_id not in scheduled_ids]
+        )._update_schedule()
+        # The schedule of a line is complete once its last day is scheduled
+        last_periods = [row for row in last_periods if not row[8] or row[2] < row[8]]
+        if not last_periods:
+            return
+        get_offset = self._get_default_recurring_invoicing_offset
+        next_periods = self.get_next_periods_bulk(
+            [row[2] + relativedelta(days=1) for row in last_periods],
+            [row[5] for row in last_periods],
+            [row[6] for row in last_periods],
+            [row[7] for row in last_periods],
+            [get_offset(row[7], row[5]) for row in last_periods],
+            [row[8] for row in last_periods],
+            date_to,
+        )
+        rows = []
+        for row, periods in zip(last_periods, next_periods):
+            rows += [
+                (row[0], row[1] + index) + period + (row[3], row[4])
+                for index, period in enumerate(periods, 1)
+            ]
+        self._insert_schedule(rows)
+        self._invalidate_schedule_cache()
+
+    def _refresh_schedule_prices(self):
+        """Reprice the schedule of the lines in self priced from a pricelist
+        whose subtotal changed, e.g. after a change of the pricelist rules.
+        """
+        lines = self.filtered("automatic_price")
+        if not lines:
+            return
+        self.env["contract.line.schedule"].flush()
+        self.env.cr.execute(
+            """
+            SELECT DISTINCT ON (contract_line_id) contract_line_id, price_subtotal
+            FROM contract_line_schedule
+            WHERE contract_line_id IN %s
+            ORDER BY contract_line_id, sequence DESC
+            """,
+            (tuple(lines.ids),),
+        )
+        scheduled_subtotals = dict(self.env.cr.fetchall())
+        amounts = []
+        for line in lines.filtered(lambda x: x.id in scheduled_subtotals):
+            quantity, price_subtotal = line._get_schedule_amounts()
+            if line.contract_id.currency_id.compare_amounts(
+                price_subtotal, scheduled_subtotals[line.id]
+            ):
+                amounts.append((line.id, quantity, price_subtotal))
+        self._update_schedule_amounts(amounts)
+
+    def _drop_invoiced_schedule(self):
+        """Remove the periods invoiced since the schedule of the lines in self
+        was built, and renumber the next ones. This is done on invoicing
+        instead of rebuilding the schedule, which is completed again by
+        ``cron_update_schedule``.
+        """
+        if not self.ids or not self._get_schedule_horizon():
+            return
+        self.flush(["last_date_invoiced"])
+        self.env["contract.line.schedule"].flush(["contract_line_id", "date_end"])
+        self.env.cr.execute(
+            """
+            WITH invoiced AS (
+                DELETE FROM contract_line_schedule s
+                USING contract_line l
+                WHERE l.id = s.contract_line_id
+                    AND l.id IN %(ids)s
+                    AND s.date_end <= l.last_date_invoiced
+                RETURNING s.contract_line_id
+            )
+            UPDATE contract_line_schedule s
+            SET sequence = s.sequence - invoiced.count
+            FROM (
+                SELECT contract_line_id, COUNT(*) AS count
+                FROM invoiced
+                GROUP BY contract_line_id
+            ) AS invoiced, contract_line l
+            WHERE s.contract_line_id = invoiced.contract_line_id
+                AND l.id = s.contract_line_id
+                AND s.date_end > l.last_date_invoiced
+            """,
+            {"ids": tuple(self.ids)},
+        )
+        self._invalidate_schedule_cache()
+
+    @api.model
+    def _get_schedule_domain(self):
+        return [
+            ("is_canceled", "=", False),
+            ("recurring_next_date", "!=", False),
+            "|",
+            ("display_type", "=", False),
+            ("is_recurring_note", "=", True),
+        ]
+
+    @api.model
+    def cron_update_schedule(self):
+        """Complete the schedule of the lines until the horizon from today, by
+        batches of ``contract.cron.batch_size`` lines committed one by one.
+
+        Only the periods entering the horizon are added to the schedules, the
+        ones of the lines existing before the schedule was enabled are built,
+        and the lines priced from a pricelist are repriced when their price
+        changed.
+        """
+        horizon = self._get_schedule_horizon()
+        if not horizon:
+            return
+        date_to = fields.Date.context_today(self) + relativedelta(months=horizon)
+        lines = self.search(
+            self._get_schedule_domain() + [("recurring_next_date", "<=", date_to)],
+            order="id",
+        )
+        batch_size = max(
+            self.env["contract.contract"]._get_cron_batch_size() or len(lines), 1
+        )
+        auto_commit = self.env["contract.contract"]._get_cron_auto_commit()
+        for index in range(0, len(lines), batch_size):
+            batch = lines[index : index + batch_size]
+            batch._extend_schedule(date_to)
+            batch._refresh_schedule_prices()
+            if auto_commit:
+                self.env.cr.commit()  # pylint: disable=invalid-commit
+            batch.invalidate_cache()
 
     def _compute_display_name(self):
         for rec in self:
@@ -163,7 +557,16 @@ class ContractLine(models.Model):
             else:
                 rec.termination_notice_date = False
 
-    @api.depends("is_canceled", "date_start", "date_end", "is_auto_renew")
+    @api.depends(
+        "display_type",
+        "is_canceled",
+        "date_start",
+        "date_end",
+        "is_auto_renew",
+        "termination_notice_date",
+        "manual_renew_needed",
+        "successor_contract_line_id",
+    )
     def _compute_state(self):
         today = fields.Date.context_today(self)
         for rec in self:
@@ -206,121 +609,61 @@ class ContractLine(models.Model):
                     rec.state = "closed"
 
     @api.model
-    def _get_state_domain(self, state):
-        today = fields.Date.context_today(self)
-        if state == "upcoming":
-            return [
-                "&",
-                ("display_type", "=", False),
-                "&",
-                ("date_start", ">", today),
-                ("is_canceled", "=", False),
-            ]
-        if state == "in-progress":
-            return [
-                "&",
-                ("display_type", "=", False),
-                "&",
-                "&",
-                "&",
-                ("date_start", "<=", today),
-                ("is_canceled", "=", False),
-                "|",
-                ("date_end", ">=", today),
-                ("date_end", "=", False),
-                "|",
-                ("is_auto_renew", "=", True),
-                "&",
-                ("is_auto_renew", "=", False),
-                "|",
-                ("termination_notice_date", "=", False),
-                ("termination_notice_date", ">", today),
-            ]
-        if state == "to-renew":
-            return [
-                "&",
-                ("display_type", "=", False),
-                "&",
-                "&",
-                ("is_canceled", "=", False),
-                ("date_end", "<", today),
-                "|",
-                "&",
-                ("manual_renew_needed", "=", True),
-                ("successor_contract_line_id", "=", False),
-                ("is_auto_renew", "=", True),
-            ]
-        if state == "upcoming-close":
-            return [
-                "&",
-                ("display_type", "=", False),
-                "&",
-                "&",
-                "&",
-                "&",
-                "&",
-                ("date_start", "<=", today),
-                ("is_auto_renew", "=", False),
-                ("manual_renew_needed", "=", False),
-                ("is_canceled", "=", False),
-                ("termination_notice_date", "<", today),
-                ("date_end", ">=", today),
-            ]
-        if state == "closed":
-            return [
-                "&",
-                ("display_type", "=", False),
-                "&",
-                "&",
-                "&",
-                ("is_canceled", "=", False),
-                ("date_end", "<", today),
-                ("is_auto_renew", "=", False),
-                "|",
-                "&",
-                ("manual_renew_needed", "=", True),
-                ("successor_contract_line_id", "!=", False),
-                ("manual_renew_needed", "=", False),
-            ]
-        if state == "canceled":
-            return ["&", ("display_type", "=", False), ("is_canceled", "=", True)]
-        if not state:
-            return [("display_type", "!=", False)]
+    def _get_state_refresh_domain(self, date_from, date_to):
+        """Domain of the lines whose state may have changed between the two
+        dates, as one of their date boundaries has been crossed.
+        """
+        return [
+            ("display_type", "=", False),
+            "|",
+            "|",
+            "&",
+            ("date_start", ">", date_from),
+            ("date_start", "<=", date_to),
+            "&",
+            ("date_end", ">=", date_from),
+            ("date_end", "<", date_to),
+            "&",
+            ("termination_notice_date", ">=", date_from),
+            ("termination_notice_date", "<", date_to),
+        ]
 
     @api.model
-    def _search_state(self, operator, value):
-        states = [
-            "upcoming",
-            "in-progress",
-            "to-renew",
-            "upcoming-close",
-            "closed",
-            "canceled",
-            False,
-        ]
-        if operator == "=":
-            return self._get_state_domain(value)
-        if operator == "!=":
-            domain = []
-            for state in states:
-                if state != value:
-                    if domain:
-                        domain.insert(0, "|")
-                    domain.extend(self._get_state_domain(state))
-            return domain
-        if operator == "in":
-            domain = []
-            for state in value:
-                if domain:
-                    domain.insert(0, "|")
-                domain.extend(self._get_state_domain(state))
-            return domain
-
-        if operator == "not in":
-            if set(value) == set(states):
-                return [("id", "=", False)]
-            return self._search_state(
-                "in", [state for state in states if state not in value]
+    def cron_refresh_contract_line_state(self):
+        """Recompute the stored state of the lines depending on today date.
+
+        Only the lines with a date boundary crossed since the previous run
+        are recomputed, or all of them on the first run.
+        """
+        param_obj = self.env["ir.config_parameter"].sudo()
+        today = fields.Date.context_today(self)
+        last_date = param_obj.get_param("contract.line.state.date")
+        domain = [("display_type", "=", False)]
+        if last_date:
+            domain = self._get_state_refresh_domain(
+                fields.Date.to_date(last_date), today
+            )
+        lines = self.with_context(active_test=False).search(domain)
+        self.env.add_to_compute(self._fields["state"], lines)
+        lines.recompute(["state"])
+        param_obj.set_param("contract.line.state.date", fields.Date.to_string(today))
+
+    def init(self):
+        tools.create_index(
+            self._cr,
+            "contract_line_state_contract_id_index",
+            self._table,
+            ["state", "contract_id"],
+        )
+        # Partial index for the lines to renew, see
+        # _contract_line_to_renew_domain
+        if not tools.index_exists(self._cr, "contract_line_auto_renew_index"):
+            self._cr.execute(
+                """
+                CREATE INDEX contract_line_auto_renew_index
+                ON contract_line (is_canceled, termination_notice_date)
+                WHERE is_auto_renew = true
+                """
             )
 
     @api.depends(
@@ -334,6 +677,10 @@ class ContractLine(models.Model):
         "contract_id.is_terminated",
     )
     def _compute_allowed(self):
+        # Prefetch the relations read by get_allowed for the whole batch
+        self.mapped("predecessor_contract_line_id.successor_contract_line_id")
+        self.mapped("contract_id.is_terminated")
+        today = fields.Date.today()
         for rec in self:
             rec.update(
                 {
@@ -355,6 +702,7 @@ class ContractLine(models.Model):
                     rec.successor_contract_line_id,
                     rec.predecessor_contract_line_id,
                     rec.is_canceled,
+                    today=today,
                 )
                 if allowed:
                     rec.update(
@@ -573,13 +921,14 @@ class ContractLine(models.Model):
 
     def _prepare_invoice_line(self, move_form):
         self.ensure_one()
-        dates = self._get_period_to_invoice(
-            self.last_date_invoiced, self.recurring_next_date
-        )
-        line_form = move_form.invoice_line_ids.new()
-        line_form.display_type = self.display_type
-        line_form.product_id = self.product_id
-        invoice_line_vals = line_form._values_to_save(all_fields=True)
+        dates = self._get_period_to_invoice(*self._get_invoice_dates())
+        if isinstance(move_form, InvoiceBatchMove):
+            invoice_line_vals = self._prepare_invoice_line_batch(move_form)
+        else:
+            line_form = move_form.invoice_line_ids.new()
+            line_form.display_type = self.display_type
+            line_form.product_id = self.product_id
+            invoice_line_vals = line_form._values_to_save(all_fields=True)
         name = self._insert_markers(dates[0], dates[1])
         invoice_line_vals.update(
             {
@@ -599,6 +948,80 @@ class ContractLine(models.Model):
         )
         return invoice_line_vals
 
+    def _get_invoice_dates(self):
+        """Last invoiced date and next invoice date of the line.
+
+        In a simulation (see ``contract.contract._simulate_recurring_invoices``)
+        they are taken from the ``contract_simulation`` context key, a dict
+        line id -> (last_date_invoiced, recurring_next_date).
+        """
+        self.ensure_one()
+        simulation = self.env.context.get("contract_simulation")
+        if simulation and self.id in simulation:
+            return simulation[self.id]
+        return self.last_date_invoiced, self.recurring_next_date
+
+    def _prepare_invoice_line_batch(self, move):
+        """Values set by the product onchange of the invoice line, computed
+        without Form and memoized per company, journal, fiscal position and
+        product in the batch of ``move``.
+        """
+        self.ensure_one()
+        vals = {
+            "display_type": self.display_type,
+            "product_id": self.product_id.id,
+        }
+        if self.display_type:
+            vals["tax_ids"] = [(6, 0, [])]
+            return vals
+        account_id, tax_ids = move.batch.memoize(
+            (
+                "line",
+                move.company.id,
+                move.move_type,
+                move.journal.id,
+                move.fiscal_position.id,
+                self.product_id.id,
+            ),
+            lambda: self._get_invoice_line_account_and_taxes(move),
+        )
+        vals.update({"account_id": account_id, "tax_ids": [(6, 0, tax_ids)]})
+        return vals
+
+    def _get_invoice_line_account_and_taxes(self, move):
+        """Mimic account.move.line _get_computed_account and
+        _get_computed_taxes for the product of the line.
+
+        :return: A tuple with the account id and the list of tax ids.
+        """
+        self.ensure_one()
+        company = move.company
+        fiscal_position = move.fiscal_position
+        product = self.product_id.with_company(company)
+        is_sale = move.move_type == "out_invoice"
+        account = self.env["account.account"]
+        if product:
+            accounts = product.product_tmpl_id.get_product_accounts(
+                fiscal_pos=fiscal_position
+            )
+            account = accounts["income"] if is_sale else accounts["expense"]
+        account = account or move.journal.default_account_id
+        product_taxes = product.taxes_id if is_sale else product.supplier_taxes_id
+        if product_taxes:
+            taxes = product_taxes.filtered(lambda t: t.company_id == company)
+        else:
+            taxes = account.tax_ids
+        if not taxes:
+            taxes = (
+                company.account_sale_tax_id
+                if is_sale
+                else company.account_purchase_tax_id
+            )
+        taxes = taxes.filtered(lambda t: t.company_id == company)
+        if taxes and fiscal_position:
+            taxes = fiscal_position.map_tax(taxes, partner=move.partner)
+        return account.id, taxes.ids
+
     def _get_period_to_invoice(
         self, last_date_invoiced, recurring_next_date, stop_at_date_end=True
     ):
@@ -607,19 +1030,18 @@ class ContractLine(models.Model):
         self.ensure_one()
         if not recurring_next_date:
             return False, False, False
-        first_date_invoiced = (
-            last_date_invoiced + relativedelta(days=1)
-            if last_date_invoiced
-            else self.date_start
-        )
-        last_date_invoiced = self.get_next_period_date_end(
-            first_date_invoiced,
-            self.recurring_rule_type,
-            self.recurring_interval,
-            max_date_end=(self.date_end if stop_at_date_end else False),
-            next_invoice_date=recurring_next_date,
-            recurring_invoicing_type=self.recurring_invoicing_type,
-            recurring_invoicing_offset=self.recurring_invoicing_offset,
+        first_date_invoiced, last_date_invoiced = self._get_invoiced_period(
+            {
+                "last_date_invoiced": last_date_invoiced,
+                "recurring_next_date": recurring_next_date,
+                "date_start": self.date_start,
+                "date_end": self.date_end,
+                "recurring_rule_type": self.recurring_rule_type,
+                "recurring_interval": self.recurring_interval,
+                "recurring_invoicing_type": self.recurring_invoicing_type,
+                "recurring_invoicing_offset": self.recurring_invoicing_offset,
+            },
+            stop_at_date_end=stop_at_date_end,
         )
         return first_date_invoiced, last_date_invoiced, recurring_next_date
 
@@ -640,34 +1062,60 @@ class ContractLine(models.Model):
         }
         return months[month_name]
 
+    @api.model
+    @tools.ormcache("lang_code")
+    def _get_marker_lang(self, lang_code):
+        """:return: tuple with the date format and the code of the language"""
+        lang = self.env["res.lang"].search([("code", "=", lang_code)])
+        return lang.date_format or "%m/%d/%Y", lang.code
+
+    @api.model
+    @tools.ormcache("lang_code", "month")
+    def _get_marker_month_name(self, lang_code, month):
+        return self.with_context(lang=lang_code)._translate_marker_month_name(month)
+
     def _insert_markers(self, first_date_invoiced, last_date_invoiced):
         self.ensure_one()
-        lang_obj = self.env["res.lang"]
-        lang = lang_obj.search([("code", "=", self.contract_id.partner_id.lang)])
-        date_format = lang.date_format or "%m/%d/%Y"
-        name = self.name
-        name = name.replace("#START#", first_date_invoiced.strftime(date_format))
-        name = name.replace("#END#", last_date_invoiced.strftime(date_format))
-        name = name.replace("#INVOICEMONTHNUMBER#", first_date_invoiced.strftime("%m"))
-        name = name.replace("#INVOICEYEAR#", first_date_invoiced.strftime("%Y"))
-        name = name.replace(
-            "#INVOICEMONTHNAME#",
-            self.with_context(lang=lang.code)._translate_marker_month_name(
-                first_date_invoiced.strftime("%m")
-            ),
-        )
-        return name
+        if "#" not in self.name:
+            return self.name
+        date_format, lang_code = self._get_marker_lang(self.contract_id.partner_id.lang)
+
+        def marker_value(marker):
+            if marker == "#START#":
+                return first_date_invoiced.strftime(date_format)
+            if marker == "#END#":
+                return last_date_invoiced.strftime(date_format)
+            if marker == "#INVOICEMONTHNUMBER#":
+                return first_date_invoiced.strftime("%m")
+            if marker == "#INVOICEYEAR#":
+                return first_date_invoiced.strftime("%Y")
+            return self._get_marker_month_name(
+                lang_code, first_date_invoiced.strftime("%m")
+            )
 
-    def _update_recurring_next_date(self):
+        return render_markers(self.name, marker_value)
+
+    def _update_recurring_next_date(self, last_date_invoiced=False):
+        """Mark the lines in self as invoiced up to ``last_date_invoiced``,
+        the end of their next period by default.
+
+        :param last_date_invoiced: date reached by invoicing several periods
+          at once, like when catching up
+        """
         # FIXME: Change method name according to real updated field
         # e.g.: _update_last_date_invoiced()
+        # Lines invoiced up to the same date are written (and thus checked
+        # and recomputed) together
+        line_ids = defaultdict(list)
         for rec in self:
-            last_date_invoiced = rec.next_period_date_end
-            rec.write(
+            line_ids[last_date_invoiced or rec.next_period_date_end].append(rec.id)
+        for last_date_invoiced, ids in line_ids.items():
+            self.browse(ids).with_context(contract_schedule_skip=True).write(
                 {
                     "last_date_invoiced": last_date_invoiced,
                 }
             )
+        self._drop_invoiced_schedule()
 
     def _delay(self, delay_delta):
         """
@@ -713,6 +1161,33 @@ class ContractLine(models.Model):
         self.ensure_one()
         return {"date_end": date_end}
 
+    def _write_grouped(self, values_by_record):
+        """Write values on records, one write per distinct values.
+
+        :param values_by_record: iterable of (record, values) pairs
+        """
+        groups = []
+        for record, values in values_by_record:
+            for group_values, group_records in groups:
+                if group_values == values:
+                    group_records.append(record)
+                    break
+            else:
+                groups.append((values, [record]))
+        for values, records in groups:
+            records[0].browse([record.id for record in records]).write(values)
+
+    def _post_messages_by_contract(self, messages):
+        """Post one message per contract gathering the messages of its lines.
+
+        :param messages: iterable of (contract line, message) pairs
+        """
+        messages_by_contract = defaultdict(list)
+        for rec, msg in messages:
+            messages_by_contract[rec.contract_id].append(msg)
+        for contract, contract_messages in messages_by_contract.items():
+            contract.message_post(body="<br/>".join(contract_messages))
+
     def stop(self, date_end, manual_renew_needed=False, post_message=True):
         """
         Put date_end on contract line
@@ -722,47 +1197,76 @@ class ContractLine(models.Model):
         """
         if not all(self.mapped("is_stop_allowed")):
             raise ValidationError(_("Stop not allowed for this line"))
-        for rec in self:
-            if date_end < rec.date_start:
-                rec.cancel()
-            else:
-                if not rec.date_end or rec.date_end > date_end:
-                    old_date_end = rec.date_end
-                    rec.write(
-                        rec._prepare_value_for_stop(date_end, manual_renew_needed)
-                    )
-                    if not rec.contract_id.line_recurrence:
-                        # FIXME: This should not happen. As recurring_next_date
-                        # is computed on contract from lines ones, the only
-                        # write({"date_end"}) on lines should be sufficent
-                        # The set_recurrence_field() on date_end should be
-                        # suppressed.
-                        rec.contract_id.write(
-                            rec._prepare_value_for_contract_stop(date_end)
-                        )
-                    if post_message:
-                        msg = _(
+        to_cancel = self.filtered(lambda l: date_end < l.date_start)
+        to_stop = (self - to_cancel).filtered(
+            lambda l: not l.date_end or l.date_end > date_end
+        )
+        to_keep = self - to_cancel - to_stop
+        to_cancel.cancel()
+        messages = []
+        if post_message:
+            for rec in to_stop:
+                messages.append(
+                    (
+                        rec,
+                        _(
                             """Contract line for <strong>{product}</strong>
                             stopped: <br/>
                             - <strong>End</strong>: {old_end} -- {new_end}
                             """.format(
                                 product=rec.name,
-                                old_end=old_date_end,
-                                new_end=rec.date_end,
+                                old_end=rec.date_end,
+                                new_end=date_end,
                             )
-                        )
-                        rec.contract_id.message_post(body=msg)
-                else:
-                    rec.write(
-                        {
-                            "is_auto_renew": False,
-                            "manual_renew_needed": manual_renew_needed,
-                        }
+                        ),
                     )
+                )
+        self._write_grouped(
+            (rec, rec._prepare_value_for_stop(date_end, manual_renew_needed))
+            for rec in to_stop
+        )
+        # FIXME: This should not happen. As recurring_next_date
+        # is computed on contract from lines ones, the only
+        # write({"date_end"}) on lines should be sufficent
+        # The set_recurrence_field() on date_end should be
+        # suppressed.
+        self._write_grouped(
+            (rec.contract_id, rec._prepare_value_for_contract_stop(date_end))
+            for rec in to_stop
+            if not rec.contract_id.line_recurrence
+        )
+        self._post_messages_by_contract(messages)
+        if to_keep:
+            to_keep.write(
+                {
+                    "is_auto_renew": False,
+                    "manual_renew_needed": manual_renew_needed,
+                }
+            )
         return True
 
+    def _read_values_for_plan_successor(self):
+        """Read at once the values copied from the lines in self to their
+        successors.
+
+        :return: dict line id -> values
+        """
+        values = {}
+        for line_vals in self.read():
+            line_id = line_vals.pop("id")
+            line_vals.pop("last_date_invoiced", None)
+            # The schedule of the successor is computed on its creation
+            line_vals.pop("schedule_ids", None)
+            values[line_id] = line_vals
+        return values
+
     def _prepare_value_for_plan_successor(
-        self, date_start, date_end, is_auto_renew, recurring_next_date=False
+        self,
+        date_start,
+        date_end,
+        is_auto_renew,
+        recurring_next_date=False,
+        read_values=None,
     ):
         self.ensure_one()
         if not recurring_next_date:
@@ -774,10 +1278,9 @@ class ContractLine(models.Model):
                 self.recurring_interval,
                 max_date_end=date_end,
             )
-        new_vals = self.read()[0]
-        new_vals.pop("id", None)
-        new_vals.pop("last_date_invoiced", None)
-        values = self._convert_to_write(new_vals)
+        if read_values is None:
+            read_values = self._read_values_for_plan_successor()[self.id]
+        values = self._convert_to_write(read_values)
         values["date_start"] = date_start
         values["date_end"] = date_end
         values["recurring_next_date"] = recurring_next_date
@@ -785,6 +1288,34 @@ class ContractLine(models.Model):
         values["predecessor_contract_line_id"] = self.id
         return values
 
+    def _set_successor_contract_lines(self, successors):
+        """Link each line in self to its successor, in the same order, with
+        one query, then recompute and check what depends on the link as a
+        write would.
+        """
+        self.flush(["successor_contract_line_id"])
+        self.env.cr.execute(
+            """
+            UPDATE contract_line l
+            SET successor_contract_line_id = v.successor_id,
+                write_uid = %(uid)s,
+                write_date = NOW() AT TIME ZONE 'UTC'
+            FROM UNNEST(%(line_ids)s::integer[], %(successor_ids)s::integer[])
+                AS v(line_id, successor_id)
+            WHERE l.id = v.line_id
+            """,
+            {
+                "uid": self.env.uid,
+                "line_ids": self.ids,
+                "successor_ids": successors.ids,
+            },
+        )
+        self.invalidate_cache(
+            ["successor_contract_line_id", "write_uid", "write_date"], self.ids
+        )
+        self.modified(["successor_contract_line_id"])
+        self._validate_fields(["successor_contract_line_id"])
+
     def plan_successor(
         self,
         date_start,
@@ -802,32 +1333,44 @@ class ContractLine(models.Model):
         successor_contract_line
         :return: successor_contract_line
         """
-        contract_line = self.env["contract.line"]
-        for rec in self:
-            if not rec.is_plan_successor_allowed:
-                raise ValidationError(_("Plan successor not allowed for this line"))
-            rec.is_auto_renew = False
-            new_line = self.create(
+        if not all(self.mapped("is_plan_successor_allowed")):
+            raise ValidationError(_("Plan successor not allowed for this line"))
+        if not self:
+            return self.env["contract.line"]
+        read_values = self._read_values_for_plan_successor()
+        self.write({"is_auto_renew": False})
+        contract_line = self.create(
+            [
                 rec._prepare_value_for_plan_successor(
-                    date_start, date_end, is_auto_renew, recurring_next_date
+                    date_start,
+                    date_end,
+                    is_auto_renew,
+                    recurring_next_date,
+                    read_values=read_values[rec.id],
                 )
-            )
-            rec.successor_contract_line_id = new_line
-            contract_line |= new_line
-            if post_message:
-                msg = _(
-                    """Contract line for <strong>{product}</strong>
-                    planned a successor: <br/>
-                    - <strong>Start</strong>: {new_date_start}
-                    <br/>
-                    - <strong>End</strong>: {new_date_end}
-                    """.format(
-                        product=rec.name,
-                        new_date_start=new_line.date_start,
-                        new_date_end=new_line.date_end,
-                    )
+                for rec in self
+            ]
+        )
+        self._set_successor_contract_lines(contract_line)
+        if post_message:
+            self._post_messages_by_contract(
+                (
+                    rec,
+                    _(
+                        """Contract line for <strong>{product}</strong>
+                        planned a successor: <br/>
+                        - <strong>Start</strong>: {new_date_start}
+                        <br/>
+                        - <strong>End</strong>: {new_date_end}
+                        """.format(
+                            product=rec.name,
+                            new_date_start=new_line.date_start,
+                            new_date_end=new_line.date_end,
+                        )
+                    ),
                 )
-                rec.contract_id.message_post(body=msg)
+                for rec, new_line in zip(self, contract_line)
+            )
         return contract_line
 
     def stop_plan_successor(self, date_start, date_end, is_auto_renew):
@@ -865,6 +1408,9 @@ class ContractLine(models.Model):
         if not all(self.mapped("is_stop_plan_successor_allowed")):
             raise ValidationError(_("Stop/Plan successor not allowed for this line"))
         contract_line = self.env["contract.line"]
+        to_stop = self.env["contract.line"]
+        # lines to stop and to continue later, by successor dates
+        to_suspend = defaultdict(lambda: self.env["contract.line"])
         for rec in self:
             if rec.date_start >= date_start:
                 if rec.date_start < date_end:
@@ -873,76 +1419,67 @@ class ContractLine(models.Model):
                     delay = (date_end - date_start) + timedelta(days=1)
                 rec._delay(delay)
                 contract_line |= rec
+            elif rec.date_end and rec.date_end < date_start:
+                to_stop |= rec
             else:
-                if rec.date_end and rec.date_end < date_start:
-                    rec.stop(date_start, post_message=False)
-                elif (
-                    rec.date_end
-                    and rec.date_end > date_start
-                    and rec.date_end < date_end
-                ):
-                    new_date_start = date_end + relativedelta(days=1)
+                new_date_start = date_end + relativedelta(days=1)
+                if rec.date_end and rec.date_end < date_end:
                     new_date_end = (
                         date_end + (rec.date_end - date_start) + relativedelta(days=1)
                     )
-                    rec.stop(
-                        date_start - relativedelta(days=1),
-                        manual_renew_needed=True,
-                        post_message=False,
-                    )
-                    contract_line |= rec.plan_successor(
-                        new_date_start,
-                        new_date_end,
-                        is_auto_renew,
-                        post_message=False,
+                elif rec.date_end:
+                    new_date_end = (
+                        rec.date_end + (date_end - date_start) + relativedelta(days=1)
                     )
                 else:
-                    new_date_start = date_end + relativedelta(days=1)
-                    if rec.date_end:
-                        new_date_end = (
-                            rec.date_end
-                            + (date_end - date_start)
-                            + relativedelta(days=1)
-                        )
-                    else:
-                        new_date_end = rec.date_end
-
-                    rec.stop(
-                        date_start - relativedelta(days=1),
-                        manual_renew_needed=True,
-                        post_message=False,
-                    )
-                    contract_line |= rec.plan_successor(
-                        new_date_start,
-                        new_date_end,
-                        is_auto_renew,
-                        post_message=False,
+                    new_date_end = rec.date_end
+                to_suspend[(new_date_start, new_date_end)] |= rec
+        to_stop.stop(date_start, post_message=False)
+        if to_suspend:
+            self.browse(
+                [line.id for lines in to_suspend.values() for line in lines]
+            ).stop(
+                date_start - relativedelta(days=1),
+                manual_renew_needed=True,
+                post_message=False,
+            )
+        for (new_date_start, new_date_end), lines in to_suspend.items():
+            contract_line |= lines.plan_successor(
+                new_date_start,
+                new_date_end,
+                is_auto_renew,
+                post_message=False,
+            )
+        self._post_messages_by_contract(
+            (
+                rec,
+                _(
+                    """Contract line for <strong>{product}</strong>
+                    suspended: <br/>
+                    - <strong>Suspension Start</strong>: {new_date_start}
+                    <br/>
+                    - <strong>Suspension End</strong>: {new_date_end}
+                    """.format(
+                        product=rec.name,
+                        new_date_start=date_start,
+                        new_date_end=date_end,
                     )
-            msg = _(
-                """Contract line for <strong>{product}</strong>
-                suspended: <br/>
-                - <strong>Suspension Start</strong>: {new_date_start}
-                <br/>
-                - <strong>Suspension End</strong>: {new_date_end}
-                """.format(
-                    product=rec.name,
-                    new_date_start=date_start,
-                    new_date_end=date_end,
-                )
+                ),
             )
-            rec.contract_id.message_post(body=msg)
+            for rec in self
+        )
         return contract_line
 
     def cancel(self):
         if not all(self.mapped("is_cancel_allowed")):
             raise ValidationError(_("Cancel not allowed for this line"))
-        for contract in self.mapped("contract_id"):
-            lines = self.filtered(lambda l, c=contract: l.contract_id == c)
+        names_by_contract = defaultdict(list)
+        for rec in self:
+            names_by_contract[rec.contract_id].append(rec.name)
+        for contract, names in names_by_contract.items():
             msg = _(
                 """Contract line canceled: %s"""
-                % "<br/>- ".join(
-                    ["<strong>%s</strong>" % name for name in lines.mapped("name")]
-                )
+                % "<br/>- ".join(["<strong>%s</strong>" % name for name in names])
             )
             contract.message_post(body=msg)
         self.mapped("predecessor_contract_line_id").write(
@@ -1066,34 +1603,48 @@ class ContractLine(models.Model):
         return new_line
 
     def _renew_extend_line(self, date_end):
-        self.ensure_one()
-        self.date_end = date_end
+        self.write({"date_end": date_end})
         return self
 
+    def _prepare_renew_message(self, date_start, date_end):
+        self.ensure_one()
+        return _(
+            """Contract line for <strong>{product}</strong>
+            renewed: <br/>
+            - <strong>Start</strong>: {new_date_start}
+            <br/>
+            - <strong>End</strong>: {new_date_end}
+            """.format(
+                product=self.name,
+                new_date_start=date_start,
+                new_date_end=date_end,
+            )
+        )
+
     def renew(self):
+        """Renew the lines in self.
+
+        Lines extended to the same end date are written together and a
+        single message is posted per contract.
+        """
         res = self.env["contract.line"]
+        to_extend = defaultdict(list)
+        messages = defaultdict(list)
         for rec in self:
             company = rec.contract_id.company_id
             date_end = rec._get_renewal_new_date_end()
             date_start = rec.date_end + relativedelta(days=1)
+            messages[rec.contract_id].append(
+                rec._prepare_renew_message(date_start, date_end)
+            )
             if company.create_new_line_at_contract_line_renew:
-                new_line = rec._renew_create_line(date_end)
+                res |= rec._renew_create_line(date_end)
             else:
-                new_line = rec._renew_extend_line(date_end)
-            res |= new_line
-            msg = _(
-                """Contract line for <strong>{product}</strong>
-                renewed: <br/>
-                - <strong>Start</strong>: {new_date_start}
-                <br/>
-                - <strong>End</strong>: {new_date_end}
-                """.format(
-                    product=rec.name,
-                    new_date_start=date_start,
-                    new_date_end=date_end,
-                )
-            )
-            rec.contract_id.message_post(body=msg)
+                to_extend[date_end].append(rec.id)
+        for date_end, line_ids in to_extend.items():
+            res |= self.browse(line_ids)._renew_extend_line(date_end)
+        for contract, contract_messages in messages.items():
+            contract.message_post(body="<br/>".join(contract_messages))
         return res
 
     @api.model
@@ -1107,9 +1658,19 @@ class ContractLine(models.Model):
 
     @api.model
     def cron_renew_contract_line(self):
+        """Renew the lines to renew by batches of ``contract.cron.batch_size``
+        lines, committing after each of them.
+        """
         domain = self._contract_line_to_renew_domain()
-        to_renew = self.search(domain)
-        to_renew.renew()
+        to_renew = self.search(domain, order="id")
+        batch_size = max(
+            self.env["contract.contract"]._get_cron_batch_size() or len(to_renew), 1
+        )
+        auto_commit = self.env["contract.contract"]._get_cron_auto_commit()
+        for index in range(0, len(to_renew), batch_size):
+            to_renew[index : index + batch_size].renew()
+            if auto_commit:
+                self.env.cr.commit()  # pylint: disable=invalid-commit
 
     @api.model
     def fields_view_get(
@@ -375,8 +375,40 @@ for c in CRITERIA_ALLOWED_DICT:
     _add(criteria_allowed_dict, c, CRITERIA_ALLOWED_DICT[c])
 
 
-def compute_when(date_start, date_end):
-    today = Date.today()
+WHEN_INDEX = {"BEFORE": 0, "IN": 1, "AFTER": 2}
+
+
+def pack_criteria(
+    when,
+    has_date_end,
+    has_last_date_invoiced,
+    is_auto_renew,
+    has_successor,
+    predecessor_has_successor,
+    canceled,
+):
+    """Pack criteria values in an integer: one bit per boolean criteria
+    followed by the index of ``when``."""
+    return (
+        WHEN_INDEX[when] << 6
+        | bool(has_date_end) << 5
+        | bool(has_last_date_invoiced) << 4
+        | bool(is_auto_renew) << 3
+        | bool(has_successor) << 2
+        | bool(predecessor_has_successor) << 1
+        | bool(canceled)
+    )
+
+
+# Allowed actions (or False) indexed by packed criteria
+ALLOWED_BY_PACKED_CRITERIA = [False] * (len(WHEN_INDEX) << 6)
+
+for c in criteria_allowed_dict:
+    ALLOWED_BY_PACKED_CRITERIA[pack_criteria(*c)] = criteria_allowed_dict[c]
+
+
+def compute_when(date_start, date_end, today=None):
+    today = today or Date.today()
     if today < date_start:
         return "BEFORE"
     if date_end and today > date_end:
@@ -414,16 +446,16 @@ def get_allowed(
     successor_contract_line_id,
     predecessor_contract_line_id,
     is_canceled,
+    today=None,
 ):
-    criteria = compute_criteria(
-        date_start,
-        date_end,
-        has_last_date_invoiced,
-        is_auto_renew,
-        successor_contract_line_id,
-        predecessor_contract_line_id,
-        is_canceled,
-    )
-    if criteria in criteria_allowed_dict:
-        return criteria_allowed_dict[criteria]
-    return False
+    return ALLOWED_BY_PACKED_CRITERIA[
+        pack_criteria(
+            compute_when(date_start, date_end, today),
+            date_end,
+            has_last_date_invoiced,
+            is_auto_renew,
+            successor_contract_line_id,
+            predecessor_contract_line_id.successor_contract_line_id,
+            is_canceled,
+        )
+    ]
@@ -0,0 +1,38 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import functools
+
+# Markers replaced in the description of the invoiced lines, in the order
+# they have always been replaced
+MARKERS = (
+    "#START#",
+    "#END#",
+    "#INVOICEMONTHNUMBER#",
+    "#INVOICEYEAR#",
+    "#INVOICEMONTHNAME#",
+)
+# Postgres text values can't contain NUL characters
+SEPARATOR = "\x00"
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_markers(name):
+    """Split a line description in literal parts (even indexes) and markers
+    (odd indexes)."""
+    for marker in MARKERS:
+        name = name.replace(marker, SEPARATOR + marker + SEPARATOR)
+    return tuple(name.split(SEPARATOR))
+
+
+def render_markers(name, marker_value):
+    """Replace the markers of a line description.
+
+    :param marker_value: function returning the value of a marker, only called
+      for the markers used in the description
+    """
+    if "#" not in name:
+        return name
+    return "".join(
+        marker_value(part) if index % 2 else part
+        for index, part in enumerate(compile_markers(name))
+    )
@@ -0,0 +1,43 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo import fields, models, tools
+
+
+class ContractLineSchedule(models.Model):
+    _name = "contract.line.schedule"
+    _description = "Contract Line Schedule"
+    _order = "invoice_date, contract_line_id, sequence"
+
+    contract_line_id = fields.Many2one(
+        comodel_name="contract.line",
+        string="Contract Line",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+    contract_id = fields.Many2one(
+        related="contract_line_id.contract_id",
+        store=True,
+        index=True,
+    )
+    company_id = fields.Many2one(
+        related="contract_line_id.company_id",
+        store=True,
+    )
+    sequence = fields.Integer(
+        string="Period",
+        help="Number of the period, starting with the next one to invoice.",
+    )
+    date_start = fields.Date(string="Period Start", required=True)
+    date_end = fields.Date(string="Period End", required=True)
+    invoice_date = fields.Date(string="Invoice Date", required=True)
+    quantity = fields.Float(digits="Product Unit of Measure")
+    price_subtotal = fields.Float(digits="Account", string="Sub Total")
+
+    def init(self):
+        tools.create_index(
+            self._cr,
+            "contract_line_schedule_invoice_date_line_index",
+            self._table,
+            ["invoice_date", "contract_line_id"],
+        )
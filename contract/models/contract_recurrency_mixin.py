@@ -2,10 +2,29 @@
 # Copyright 2020 Tecnativa - Pedro M. Baeza
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
+import logging
+
 from dateutil.relativedelta import relativedelta
 
 from odoo import api, fields, models
 
+_logger = logging.getLogger(__name__)
+
+try:
+    import numpy
+except ImportError:
+    _logger.debug("Cannot import numpy, bulk recurrence dates will be slower.")
+    numpy = None
+
+# Number of months of one period for the month based rule types
+MONTHS_BY_RULE_TYPE = {
+    "monthly": 1,
+    "monthlylastday": 1,
+    "quarterly": 3,
+    "semesterly": 6,
+    "yearly": 12,
+}
+
 
 class ContractRecurrencyBasicMixin(models.AbstractModel):
     _name = "contract.recurrency.basic.mixin"
@@ -108,17 +127,9 @@ class ContractRecurrencyMixin(models.AbstractModel):
     @api.depends("last_date_invoiced", "date_start", "date_end")
     def _compute_next_period_date_start(self):
         for rec in self:
-            if rec.last_date_invoiced:
-                next_period_date_start = rec.last_date_invoiced + relativedelta(days=1)
-            else:
-                next_period_date_start = rec.date_start
-            if (
-                rec.date_end
-                and next_period_date_start
-                and next_period_date_start > rec.date_end
-            ):
-                next_period_date_start = False
-            rec.next_period_date_start = next_period_date_start
+            rec.next_period_date_start = self._get_next_period_date_start(
+                rec.last_date_invoiced, rec.date_start, rec.date_end
+            )
 
     @api.depends(
         "next_period_date_start",
@@ -141,6 +152,41 @@ class ContractRecurrencyMixin(models.AbstractModel):
                 recurring_invoicing_offset=rec.recurring_invoicing_offset,
             )
 
+    @api.model
+    def _get_next_period_date_start(self, last_date_invoiced, date_start, date_end):
+        if last_date_invoiced:
+            next_period_date_start = last_date_invoiced + relativedelta(days=1)
+        else:
+            next_period_date_start = date_start
+        if date_end and next_period_date_start and next_period_date_start > date_end:
+            next_period_date_start = False
+        return next_period_date_start
+
+    @api.model
+    def _get_invoiced_period(self, values, stop_at_date_end=True):
+        """First and last dates of the period invoiced at the next invoice
+        date of a recurrence.
+
+        :param values: dictionary with the values of the recurrence fields
+          (dates, rule type, interval, invoicing type and offset)
+        :return: tuple (first date invoiced, last date invoiced)
+        """
+        first_date_invoiced = (
+            values["last_date_invoiced"] + relativedelta(days=1)
+            if values["last_date_invoiced"]
+            else values["date_start"]
+        )
+        last_date_invoiced = self.get_next_period_date_end(
+            first_date_invoiced,
+            values["recurring_rule_type"],
+            values["recurring_interval"],
+            max_date_end=(values["date_end"] if stop_at_date_end else False),
+            next_invoice_date=values["recurring_next_date"],
+            recurring_invoicing_type=values["recurring_invoicing_type"],
+            recurring_invoicing_offset=values["recurring_invoicing_offset"],
+        )
+        return first_date_invoiced, last_date_invoiced
+
     @api.model
     def get_relative_delta(self, recurring_rule_type, interval):
         """Return a relativedelta for one period.
@@ -239,3 +285,160 @@ class ContractRecurrencyMixin(models.AbstractModel):
                 days=recurring_invoicing_offset
             )
         return recurring_next_date
+
+    @api.model
+    def get_next_periods_bulk(
+        self,
+        next_period_date_start,
+        recurring_rule_type,
+        recurring_interval,
+        recurring_invoicing_type,
+        recurring_invoicing_offset,
+        max_date_end,
+        date_to,
+    ):
+        """Compute the next periods of many recurrences at once.
+
+        Each argument but ``date_to`` is a sequence with one item per
+        recurrence, with the same meaning as in ``get_next_invoice_date``.
+        The results are the same as chaining ``get_next_period_date_end`` and
+        ``get_next_invoice_date`` period after period, but computed with
+        NumPy date arithmetic when it is available.
+
+        :param date_to: last invoice date of the periods to compute
+        :return: list with, for each recurrence, the list of its next periods
+          invoiced until ``date_to``, as tuples (date start, date end, invoice
+          date).
+        """
+        args = (
+            next_period_date_start,
+            recurring_rule_type,
+            recurring_interval,
+            recurring_invoicing_type,
+            recurring_invoicing_offset,
+            max_date_end,
+            date_to,
+        )
+        if numpy is None:
+            return self._get_next_periods_scalar(*args)
+        return self._get_next_periods_numpy(*args)
+
+    @api.model
+    def _get_next_periods_scalar(
+        self,
+        next_period_date_start,
+        recurring_rule_type,
+        recurring_interval,
+        recurring_invoicing_type,
+        recurring_invoicing_offset,
+        max_date_end,
+        date_to,
+    ):
+        res = []
+        for date_start, rule_type, interval, invoicing_type, offset, date_end in zip(
+            next_period_date_start,
+            recurring_rule_type,
+            recurring_interval,
+            recurring_invoicing_type,
+            recurring_invoicing_offset,
+            max_date_end,
+        ):
+            periods = []
+            while date_start:
+                period_date_end = self.get_next_period_date_end(
+                    date_start, rule_type, interval, max_date_end=date_end
+                )
+                if not period_date_end:
+                    break
+                invoice_date = (
+                    date_start if invoicing_type == "pre-paid" else period_date_end
+                ) + relativedelta(days=offset)
+                if invoice_date > date_to:
+                    break
+                periods.append((date_start, period_date_end, invoice_date))
+                date_start = period_date_end + relativedelta(days=1)
+            res.append(periods)
+        return res
+
+    @api.model
+    def _add_months_numpy(self, dates, months, last_day):
+        """Add ``months`` to ``dates`` as relativedelta does: the day is
+        kept and clipped to the length of the resulting month, or set to 1
+        where ``last_day`` (relativedelta(months=months, day=1)).
+        """
+        month_start = dates.astype("datetime64[M]")
+        day = (dates - month_start.astype("datetime64[D]")).astype("int64")
+        new_month = month_start + months
+        new_month_start = new_month.astype("datetime64[D]")
+        month_length = (
+            (new_month + 1).astype("datetime64[D]") - new_month_start
+        ).astype("int64")
+        day = numpy.where(last_day, 0, numpy.minimum(day, month_length - 1))
+        return new_month_start + day.astype("timedelta64[D]")
+
+    @api.model
+    def _get_next_periods_numpy(
+        self,
+        next_period_date_start,
+        recurring_rule_type,
+        recurring_interval,
+        recurring_invoicing_type,
+        recurring_invoicing_offset,
+        max_date_end,
+        date_to,
+    ):
+        def to_datetime64(dates):
+            return numpy.array([date or "NaT" for date in dates], dtype="datetime64[D]")
+
+        one_day = numpy.timedelta64(1, "D")
+        date_start = to_datetime64(next_period_date_start)
+        date_end = to_datetime64(max_date_end)
+        has_date_end = ~numpy.isnat(date_end)
+        rule_type = numpy.array(recurring_rule_type, dtype=object)
+        interval = numpy.array(recurring_interval, dtype="int64")
+        months = interval * numpy.array(
+            [MONTHS_BY_RULE_TYPE.get(rule, 0) for rule in recurring_rule_type],
+            dtype="int64",
+        )
+        days = numpy.where(rule_type == "weekly", 7, 1) * interval
+        is_month_based = months != 0
+        last_day = rule_type == "monthlylastday"
+        pre_paid = numpy.array(recurring_invoicing_type, dtype=object) == "pre-paid"
+        offset = numpy.array(recurring_invoicing_offset, dtype="int64").astype(
+            "timedelta64[D]"
+        )
+        date_to = numpy.datetime64(date_to, "D")
+        not_a_time = numpy.datetime64("NaT")
+        period_starts, period_ends, invoice_dates = [], [], []
+        active = ~numpy.isnat(date_start)
+        while True:
+            active &= ~(has_date_end & (date_start > date_end))
+            next_date_start = numpy.where(
+                is_month_based,
+                self._add_months_numpy(date_start, months, last_day),
+                date_start + days.astype("timedelta64[D]"),
+            )
+            period_date_end = next_date_start - one_day
+            period_date_end = numpy.where(
+                has_date_end & (period_date_end > date_end), date_end, period_date_end
+            )
+            invoice_date = numpy.where(pre_paid, date_start, period_date_end) + offset
+            # Invoice dates only increase: the recurrences invoiced after
+            # date_to are complete
+            active &= invoice_date <= date_to
+            if not active.any():
+                break
+            period_starts.append(numpy.where(active, date_start, not_a_time))
+            period_ends.append(numpy.where(active, period_date_end, not_a_time))
+            invoice_dates.append(numpy.where(active, invoice_date, not_a_time))
+            date_start = period_date_end + one_day
+        if not invoice_dates:
+            return [[] for __ in range(len(date_start))]
+        return [
+            [period for period in zip(*periods) if period[2] is not None]
+            for periods in zip(
+                numpy.column_stack(period_starts).tolist(),
+                numpy.column_stack(period_ends).tolist(),
+                numpy.column_stack(invoice_dates).tolist(),
+            )
+        ]
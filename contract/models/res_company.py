@@ -15,3 +15,21 @@ class ResCompany(models.Model):
         "behavior is to extend the end date of the contract by a new "
         "subscription period",
     )
+    contract_batch_invoice_preparation = fields.Boolean(
+        string="Batch Contract Invoice Preparation",
+        help="If checked, the invoices generated from contracts are prepared "
+        "in batch without emulating the invoice form, sharing journals, "
+        "accounts, taxes and payment terms among all the contracts of the "
+        "run. Uncheck it if an extension module needs the invoice form.",
+    )
+    contract_catch_up_mode = fields.Selection(
+        selection=[
+            ("period", "One invoice per period"),
+            ("consolidated", "One consolidated invoice"),
+        ],
+        string="Contract Catch-up Mode",
+        help="If set, the recurring cron invoices at once all the overdue "
+        "periods of the contracts, either with one invoice per period or with "
+        "one invoice per contract gathering all of them. Otherwise, one "
+        "period is invoiced per contract and run.",
+    )
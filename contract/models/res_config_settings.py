@@ -17,3 +17,11 @@ class ResConfigSettings(models.TransientModel):
         "behavior is to extend the end date of the contract by a new "
         "subscription period",
     )
+    contract_batch_invoice_preparation = fields.Boolean(
+        related="company_id.contract_batch_invoice_preparation",
+        readonly=False,
+    )
+    contract_catch_up_mode = fields.Selection(
+        related="company_id.contract_catch_up_mode",
+        readonly=False,
+    )
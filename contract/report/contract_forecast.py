@@ -0,0 +1,78 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo import fields, models, tools
+
+
+class ContractForecast(models.Model):
+    _name = "contract.forecast"
+    _description = "Contract Revenue Forecast"
+    _auto = False
+    _order = "date, contract_id"
+
+    date = fields.Date(string="Invoice Date", readonly=True)
+    date_start = fields.Date(string="Period Start", readonly=True)
+    date_end = fields.Date(string="Period End", readonly=True)
+    contract_line_id = fields.Many2one(
+        comodel_name="contract.line", string="Contract Line", readonly=True
+    )
+    contract_id = fields.Many2one(
+        comodel_name="contract.contract", string="Contract", readonly=True
+    )
+    contract_type = fields.Selection(
+        selection=[("sale", "Customer"), ("purchase", "Supplier")],
+        readonly=True,
+    )
+    partner_id = fields.Many2one(
+        comodel_name="res.partner", string="Partner", readonly=True
+    )
+    commercial_partner_id = fields.Many2one(
+        comodel_name="res.partner", string="Commercial Entity", readonly=True
+    )
+    product_id = fields.Many2one(
+        comodel_name="product.product", string="Product", readonly=True
+    )
+    company_id = fields.Many2one(
+        comodel_name="res.company", string="Company", readonly=True
+    )
+    quantity = fields.Float(digits="Product Unit of Measure", readonly=True)
+    price_subtotal = fields.Float(digits="Account", string="Amount", readonly=True)
+
+    def _select(self):
+        return """
+            SELECT
+                s.id AS id,
+                s.invoice_date AS date,
+                s.date_start AS date_start,
+                s.date_end AS date_end,
+                s.contract_line_id AS contract_line_id,
+                c.id AS contract_id,
+                c.contract_type AS contract_type,
+                c.partner_id AS partner_id,
+                c.commercial_partner_id AS commercial_partner_id,
+                l.product_id AS product_id,
+                s.company_id AS company_id,
+                s.quantity AS quantity,
+                s.price_subtotal AS price_subtotal
+        """
+
+    def _from(self):
+        return """
+            FROM contract_line_schedule s
+            JOIN contract_line l ON l.id = s.contract_line_id
+            JOIN contract_contract c ON c.id = l.contract_id
+        """
+
+    def _where(self):
+        return """
+            WHERE c.active
+                AND c.is_terminated IS NOT TRUE
+                AND l.is_canceled IS NOT TRUE
+                AND l.display_type IS NULL
+        """
+
+    def init(self):
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        self.env.cr.execute(
+            "CREATE OR REPLACE VIEW %s AS (%s %s %s)"
+            % (self._table, self._select(), self._from(), self._where())
+        )
@@ -3,16 +3,27 @@
 # Copyright 2021 Tecnativa - Víctor Martínez
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
+import itertools
+import threading
 from collections import namedtuple
 from datetime import timedelta
+from unittest.mock import patch
 
 from dateutil.relativedelta import relativedelta
 from freezegun import freeze_time
+from psycopg2 import errors as pg_errors
 
 from odoo import fields
 from odoo.exceptions import UserError, ValidationError
 from odoo.tests import Form, common, tagged
 
+from ..models.contract_line_constraints import (
+    ALLOWED_BY_PACKED_CRITERIA,
+    Criteria,
+    criteria_allowed_dict,
+    pack_criteria,
+)
+
 
 def to_date(date):
     return fields.Date.to_date(date)
@@ -288,6 +299,127 @@ class TestContract(TestContractBase):
         self.assertAlmostEqual(self.inv_line.price_subtotal, 50.0)
         self.assertEqual(self.contract.user_id, self.invoice_monthly.user_id)
 
+    def test_contract_batch_invoice_preparation(self):
+        contract_batch = self.contract.copy()
+        self.contract.recurring_create_invoice()
+        invoice_form = self.contract._get_related_invoices()
+        self.contract.company_id.contract_batch_invoice_preparation = True
+        contract_batch.recurring_create_invoice()
+        invoice_batch = contract_batch._get_related_invoices()
+        self.assertEqual(len(invoice_batch), 1)
+        for field in (
+            "move_type",
+            "partner_id",
+            "journal_id",
+            "currency_id",
+            "invoice_date",
+            "invoice_payment_term_id",
+            "fiscal_position_id",
+            "invoice_user_id",
+            "amount_untaxed",
+            "amount_total",
+        ):
+            self.assertEqual(invoice_batch[field], invoice_form[field])
+        line_form = invoice_form.invoice_line_ids
+        line_batch = invoice_batch.invoice_line_ids
+        self.assertEqual(line_batch.account_id, line_form.account_id)
+        self.assertEqual(line_batch.tax_ids, line_form.tax_ids)
+        self.assertEqual(line_batch.name, line_form.name)
+        self.assertAlmostEqual(line_batch.price_subtotal, line_form.price_subtotal)
+
+    def test_insert_markers(self):
+        self.acct_line.name = (
+            "#INVOICEMONTHNAME# #INVOICEMONTHNUMBER#/#INVOICEYEAR#: #START# - #END#"
+        )
+        name = self.acct_line._insert_markers(
+            to_date("2018-02-01"), to_date("2018-02-28")
+        )
+        self.assertEqual(name, "February 02/2018: 02/01/2018 - 02/28/2018")
+        self.acct_line.name = "No marker"
+        name = self.acct_line._insert_markers(
+            to_date("2018-02-01"), to_date("2018-02-28")
+        )
+        self.assertEqual(name, "No marker")
+
+    @freeze_time("2018-01-15")
+    def test_contract_line_schedule(self):
+        # The periods invoiced within 2 months from today are scheduled
+        self.env["ir.config_parameter"].sudo().set_param("contract.schedule.horizon", 2)
+        self.acct_line.recurring_next_date = "2018-01-15"
+        schedule = self.acct_line.schedule_ids
+        self.assertEqual(schedule.mapped("sequence"), [1, 2, 3])
+        self.assertEqual(schedule[0].date_start, to_date("2018-01-01"))
+        self.assertEqual(schedule[0].date_end, to_date("2018-02-14"))
+        self.assertEqual(schedule[0].invoice_date, to_date("2018-01-15"))
+        self.assertEqual(schedule[1].date_start, to_date("2018-02-15"))
+        self.assertEqual(schedule[1].date_end, to_date("2018-03-14"))
+        self.assertEqual(schedule[1].invoice_date, to_date("2018-02-15"))
+        self.contract.recurring_create_invoice()
+        schedule = self.acct_line.schedule_ids
+        self.assertEqual(schedule.mapped("sequence"), [1, 2])
+        self.assertEqual(schedule[0].date_start, to_date("2018-02-15"))
+        with freeze_time("2018-02-15"):
+            self.env["contract.line"].cron_update_schedule()
+        # Only the period entering the horizon is added
+        self.assertEqual(self.acct_line.schedule_ids[:2], schedule)
+        schedule = self.acct_line.schedule_ids
+        self.assertEqual(schedule.mapped("sequence"), [1, 2, 3])
+        self.assertEqual(schedule[2].date_start, to_date("2018-04-15"))
+        self.assertEqual(schedule[2].price_subtotal, schedule[0].price_subtotal)
+        self.assertEqual(schedule[0].date_start, self.acct_line.next_period_date_start)
+        self.assertEqual(schedule[0].date_end, self.acct_line.next_period_date_end)
+        self.assertEqual(schedule[0].invoice_date, self.acct_line.recurring_next_date)
+        self.acct_line.date_end = "2018-03-31"
+        self.assertEqual(len(self.acct_line.schedule_ids), 2)
+        self.assertEqual(
+            self.acct_line.schedule_ids[-1].date_end, to_date("2018-03-31")
+        )
+
+    @freeze_time("2018-01-15")
+    def test_contract_line_schedule_backfill(self):
+        self.env["ir.config_parameter"].sudo().set_param("contract.schedule.horizon", 2)
+        self.env["contract.line.schedule"].search([]).unlink()
+        self.env["contract.line"].cron_update_schedule()
+        self.assertEqual(self.acct_line.schedule_ids.mapped("sequence"), [1, 2, 3])
+
+    @freeze_time("2018-01-15")
+    def test_contract_forecast(self):
+        self.env["ir.config_parameter"].sudo().set_param("contract.schedule.horizon", 2)
+        self.acct_line.recurring_next_date = "2018-01-15"
+        self.env["contract.line.schedule"].flush()
+        forecast = self.env["contract.forecast"].search(
+            [("contract_line_id", "=", self.acct_line.id)]
+        )
+        self.assertEqual(len(forecast), 3)
+        self.assertEqual(forecast[0].date, to_date("2018-01-15"))
+        self.assertEqual(forecast[0].partner_id, self.contract.partner_id)
+        self.assertEqual(forecast[0].product_id, self.acct_line.product_id)
+        self.assertAlmostEqual(sum(forecast.mapped("price_subtotal")), 150.0)
+        res = self.env["contract.forecast"].read_group(
+            [("contract_id", "=", self.contract.id)],
+            ["price_subtotal"],
+            ["date:month"],
+        )
+        self.assertEqual(len(res), 3)
+        schedule = self.acct_line.schedule_ids
+        self.acct_line.discount = 0
+        # The periods are repriced, not rebuilt
+        self.assertEqual(self.acct_line.schedule_ids, schedule)
+        self.env["contract.line.schedule"].flush()
+        forecast = self.env["contract.forecast"].search(
+            [("contract_line_id", "=", self.acct_line.id)]
+        )
+        self.assertAlmostEqual(sum(forecast.mapped("price_subtotal")), 300.0)
+        # The prices obtained from the pricelist are refreshed by the cron
+        self.acct_line.automatic_price = True
+        self.product_1.list_price = 40
+        self.env["contract.line"].cron_update_schedule()
+        self.env["contract.line.schedule"].flush()
+        forecast = self.env["contract.forecast"].search(
+            [("contract_line_id", "=", self.acct_line.id)]
+        )
+        self.assertAlmostEqual(sum(forecast.mapped("price_subtotal")), 120.0)
+
     def test_contract_level_recurrence(self):
         self.contract3.recurring_create_invoice()
         self.contract3.flush()
@@ -1288,6 +1420,44 @@ class TestContract(TestContractBase):
         self.assertEqual(new_line.date_end, new_date_end)
         self.assertTrue(self.acct_line.manual_renew_needed)
 
+    def test_stop_plan_successor_contract_lines(self):
+        """Several lines are suspended at once with the same result"""
+        suspension_start = self.today + relativedelta(months=3)
+        suspension_end = self.today + relativedelta(months=5)
+        self.acct_line.write(
+            {
+                "date_start": self.today,
+                "recurring_next_date": self.today,
+                "date_end": self.today + relativedelta(months=4),
+            }
+        )
+        line_1 = self.acct_line.copy()
+        line_2 = self.acct_line.copy({"date_end": self.today + relativedelta(months=7)})
+        lines = self.acct_line | line_1 | line_2
+        messages = self.contract.message_ids
+        new_lines = lines.stop_plan_successor(suspension_start, suspension_end, True)
+        self.assertEqual(len(new_lines), 3)
+        self.assertEqual(new_lines.mapped("predecessor_contract_line_id"), lines)
+        for line in lines:
+            self.assertEqual(line.date_end, suspension_start - relativedelta(days=1))
+            self.assertTrue(line.manual_renew_needed)
+            self.assertEqual(
+                line.successor_contract_line_id.predecessor_contract_line_id, line
+            )
+            self.assertFalse(line.successor_contract_line_id.last_date_invoiced)
+        self.assertEqual(
+            line_1.successor_contract_line_id.date_end,
+            self.acct_line.successor_contract_line_id.date_end,
+        )
+        self.assertEqual(
+            line_2.successor_contract_line_id.date_end,
+            self.today
+            + relativedelta(months=7)
+            + (suspension_end - suspension_start)
+            + relativedelta(days=1),
+        )
+        self.assertEqual(len(self.contract.message_ids - messages), 1)
+
     def test_stop_plan_successor_contract_line_3(self):
         """
         * contract line start before the suspension period and end after it
@@ -1700,6 +1870,15 @@ class TestContract(TestContractBase):
         with self.assertRaises(ValidationError):
             self.acct_line.write({"date_end": False, "is_auto_renew": True})
 
+    def test_allowed_by_packed_criteria(self):
+        for values in itertools.product(
+            ["BEFORE", "IN", "AFTER"], *[[True, False]] * 6
+        ):
+            self.assertEqual(
+                ALLOWED_BY_PACKED_CRITERIA[pack_criteria(*values)],
+                criteria_allowed_dict.get(Criteria(*values), False),
+            )
+
     def test_check_has_successor_is_auto_renew(self):
         with self.assertRaises(ValidationError):
             self.acct_line.plan_successor(
@@ -1761,6 +1940,23 @@ class TestContract(TestContractBase):
         self.assertEqual(self.acct_line.date_start, date_start)
         self.assertEqual(self.acct_line.date_end, date_end + relativedelta(months=12))
 
+    def test_cron_renew_contract_line_batches(self):
+        self.contract.company_id.create_new_line_at_contract_line_renew = False
+        self.env["ir.config_parameter"].sudo().set_param("contract.cron.batch_size", 1)
+        self.acct_line.write({"date_end": self.today, "is_auto_renew": True})
+        line_1 = self.acct_line.copy({"date_end": self.today})
+        line_2 = self.acct_line.copy({"date_end": self.today + relativedelta(months=2)})
+        date_end = self.acct_line._get_renewal_new_date_end()
+        messages = self.contract.message_ids
+        self.acct_line.cron_renew_contract_line()
+        self.assertEqual(self.acct_line.date_end, date_end)
+        self.assertEqual(line_1.date_end, date_end)
+        self.assertEqual(line_2.date_end, self.today + relativedelta(months=2))
+        self.assertEqual(len(self.contract.message_ids - messages), 2)
+        messages = self.contract.message_ids
+        (self.acct_line | line_1).renew()
+        self.assertEqual(len(self.contract.message_ids - messages), 1)
+
     def test_cron_recurring_create_invoice(self):
         self.acct_line.date_start = "2018-01-01"
         self.acct_line.recurring_invoicing_type = "post-paid"
@@ -1777,6 +1973,290 @@ class TestContract(TestContractBase):
             len(invoice_lines),
         )
 
+    def test_cron_recurring_create_invoice_batches(self):
+        self.env["ir.config_parameter"].sudo().set_param("contract.cron.batch_size", 3)
+        contracts = self.contract
+        for _i in range(7):
+            contracts |= self.contract.copy()
+        self.env["contract.contract"].cron_recurring_create_invoice()
+        invoice_lines = self.env["account.move.line"].search(
+            [("contract_line_id", "in", contracts.mapped("contract_line_ids").ids)]
+        )
+        self.assertEqual(len(contracts.mapped("contract_line_ids")), len(invoice_lines))
+        self.assertFalse(
+            self.env["contract.contract"]._get_cron_checkpoint(self.today, "invoice")
+        )
+
+    def test_cron_recurring_create_invoice_parallel(self):
+        self.env["ir.config_parameter"].sudo().set_param("contract.cron.workers", 3)
+        contracts = self.contract
+        for partner in (self.partner, self.partner_2) * 3:
+            contracts |= self.contract.copy({"partner_id": partner.id})
+        contract_lines = contracts.mapped("contract_line_ids")
+        line_model = self.env["account.move.line"]
+        checkpoint_model = self.env["contract.cron.checkpoint"]
+        self.env["contract.contract"].cron_recurring_create_invoice()
+        # The shards are dispatched to the worker crons
+        self.assertFalse(
+            line_model.search([("contract_line_id", "in", contract_lines.ids)])
+        )
+        checkpoints = checkpoint_model.search([("worker", "!=", False)])
+        self.assertLessEqual(
+            {shard for shard, _ids in contracts._get_cron_shards()},
+            set(checkpoints.mapped("shard")),
+        )
+        self.assertLessEqual(set(checkpoints.mapped("worker")), {0, 1, 2})
+        self._run_cron_workers(3)
+        invoice_lines = line_model.search(
+            [("contract_line_id", "in", contract_lines.ids)]
+        )
+        self.assertEqual(len(contract_lines), len(invoice_lines))
+        self.assertFalse(checkpoints.exists())
+
+    def test_cron_recurring_create_invoice_parallel_dry_run(self):
+        self.env["ir.config_parameter"].sudo().set_param("contract.cron.workers", 3)
+        self.env["contract.contract"].with_context(
+            contract_cron_no_commit=True
+        ).cron_recurring_create_invoice()
+        # Without commits, the shards are processed by the cron itself
+        self.assertTrue(self.contract._get_related_invoices())
+        self.assertFalse(self.env["contract.cron.checkpoint"].search([]))
+
+    def test_cron_recurring_create_invoice_instrumentation(self):
+        run_model = self.env["contract.billing.run"]
+        config = self.env["ir.config_parameter"].sudo()
+        config.set_param("contract.cron.instrumentation", "True")
+        self.env["contract.contract"].cron_recurring_create_invoice()
+        run = run_model.search([])
+        self.assertEqual(len(run), 1)
+        self.assertEqual(run.create_type, "invoice")
+        invoice_count = len(self.contract._get_related_invoices())
+        self.assertTrue(invoice_count)
+        self.assertTrue(run.document_count >= invoice_count)
+        phases = {
+            line.phase: line
+            for line in run.line_ids
+            if line.company_id == self.contract.company_id
+        }
+        self.assertTrue({"lines", "prepare_invoice", "create"} <= set(phases))
+        self.assertTrue(phases["create"].record_count >= invoice_count)
+        self.assertTrue(phases["create"].query_count)
+        config.set_param("contract.cron.instrumentation", "False")
+        self.env["contract.contract"].cron_recurring_create_invoice()
+        self.assertEqual(run_model.search([]), run)
+
+    def test_cron_recurring_create_invoice_catch_up(self):
+        self.acct_line.date_start = "2018-01-01"
+        self.acct_line.recurring_invoicing_type = "post-paid"
+        self.acct_line.date_end = "2018-03-15"
+        self.contract.company_id.contract_catch_up_mode = "period"
+        self.env["contract.contract"].cron_recurring_create_invoice()
+        invoices = self.contract._get_related_invoices()
+        self.assertEqual(len(invoices), 3)
+        self.assertEqual(set(invoices.mapped("invoice_date")), {self.today})
+        # One invoice per period, with its own description
+        self.assertEqual(len(set(invoices.mapped("invoice_line_ids.name"))), 3)
+        self.assertEqual(self.acct_line.last_date_invoiced, to_date("2018-03-15"))
+        self.assertFalse(self.contract.recurring_next_date)
+        self.contract.company_id.contract_catch_up_mode = "consolidated"
+        contract = self.contract.copy()
+        contract.contract_line_ids.last_date_invoiced = False
+        self.env["contract.contract"].cron_recurring_create_invoice()
+        invoice = contract._get_related_invoices()
+        self.assertEqual(len(invoice), 1)
+        self.assertEqual(len(invoice.invoice_line_ids), 3)
+        self.assertEqual(
+            contract.contract_line_ids.last_date_invoiced, to_date("2018-03-15")
+        )
+
+    @freeze_time("2018-04-20")
+    def test_cron_recurring_create_invoice_catch_up_schedule(self):
+        self.env["ir.config_parameter"].sudo().set_param("contract.schedule.horizon", 2)
+        self.acct_line.recurring_invoicing_type = "post-paid"
+        self.acct_line._update_schedule()
+        schedule = self.acct_line.schedule_ids
+        self.contract.company_id.contract_catch_up_mode = "period"
+        self.env["contract.contract"].cron_recurring_create_invoice()
+        self.assertEqual(len(self.contract._get_related_invoices()), 3)
+        # The invoiced periods are dropped from the schedule, the others kept
+        self.assertTrue(self.acct_line.schedule_ids)
+        self.assertLess(self.acct_line.schedule_ids, schedule)
+        self.assertEqual(
+            self.acct_line.schedule_ids[0].date_start,
+            self.acct_line.next_period_date_start,
+        )
+
+    def test_get_cron_shards(self):
+        contracts = self.contract
+        for partner in (self.partner, self.partner_2) * 3:
+            contracts |= self.contract.copy({"partner_id": partner.id})
+        shards = contracts._get_cron_shards()
+        self.assertEqual(
+            [(shard, set(ids)) for shard, ids in shards],
+            [
+                (shard, set(ids))
+                for shard, ids in contracts.sorted(lambda c: -c.id)._get_cron_shards()
+            ],
+        )
+        self.assertEqual(sum(len(ids) for _shard, ids in shards), len(contracts))
+        # All the contracts of a partner are in the same shard
+        for partner in contracts.commercial_partner_id:
+            self.assertEqual(
+                len(
+                    [
+                        shard
+                        for shard, ids in shards
+                        if partner
+                        in self.env["contract.contract"]
+                        .browse(ids)
+                        .commercial_partner_id
+                    ]
+                ),
+                1,
+            )
+
+    def _run_cron_workers(self, workers):
+        # Run the triggered worker crons as the cron workers of the server
+        # would, but in the transaction of the test to see its data
+        crons = self.env["contract.contract"]._get_cron_worker_crons(workers)
+        triggered = (
+            self.env["ir.cron.trigger"].search([("cron_id", "in", crons.ids)]).cron_id
+        )
+        self.assertTrue(triggered)
+        for cron in triggered:
+            cron.method_direct_trigger()
+
+    def test_cron_recurring_create_invoice_workers(self):
+        self.env["ir.config_parameter"].sudo().set_param("contract.cron.workers", 2)
+        contracts = self.contract | self.contract.copy(
+            {"partner_id": self.partner_2.id}
+        )
+        ContractContract = type(self.env["contract.contract"])
+        create_batch = ContractContract._cron_recurring_create_batch
+        failed = []
+
+        def _cron_recurring_create_batch(contracts, date_ref, create_type):
+            document_ids = create_batch(contracts, date_ref, create_type)
+            if not failed:
+                # A concurrent worker posted in the same journal
+                failed.append(contracts)
+                raise pg_errors.SerializationFailure("concurrent update")
+            return document_ids
+
+        self.env["contract.contract"].cron_recurring_create_invoice()
+        with patch.object(
+            ContractContract,
+            "_cron_recurring_create_batch",
+            _cron_recurring_create_batch,
+        ), patch("odoo.addons.contract.models.contract.time.sleep"):
+            self._run_cron_workers(2)
+        self.assertTrue(failed)
+        contracts.invalidate_cache()
+        for contract in contracts:
+            # The failing batch is retried and invoiced only once
+            self.assertEqual(len(contract._get_related_invoices()), 1)
+        self.assertFalse(
+            any(
+                "SerializationFailure" in body
+                for body in contracts.mapped("message_ids.body")
+            )
+        )
+
+    def test_cron_auto_commit(self):
+        contract_model = self.env["contract.contract"]
+        testing = threading.currentThread().testing
+        threading.currentThread().testing = False
+        try:
+            self.assertTrue(contract_model._get_cron_auto_commit())
+            self.assertFalse(
+                contract_model.with_context(
+                    contract_cron_no_commit=True
+                )._get_cron_auto_commit()
+            )
+        finally:
+            threading.currentThread().testing = testing
+
+    def test_cron_recurring_create_invoice_resume(self):
+        contract_done = self.contract.copy()
+        contract_todo = self.contract.copy()
+        self.env["contract.contract"]._set_cron_checkpoint(
+            self.today, "invoice", contract_done.id
+        )
+        self.env["contract.contract"].cron_recurring_create_invoice()
+        self.assertFalse(contract_done._get_related_invoices())
+        self.assertTrue(contract_todo._get_related_invoices())
+
+    def test_cron_recurring_create_invoice_isolate_errors(self):
+        contract_error = self.contract.copy()
+        contract_ok = self.contract.copy()
+        ContractContract = type(self.env["contract.contract"])
+        prepare_invoice = ContractContract._prepare_invoice
+
+        def _prepare_invoice(contract, date_invoice, journal=None):
+            if contract == contract_error:
+                raise UserError("Failure")
+            return prepare_invoice(contract, date_invoice, journal=journal)
+
+        with patch.object(ContractContract, "_prepare_invoice", _prepare_invoice):
+            self.env["contract.contract"].cron_recurring_create_invoice()
+        self.assertTrue(contract_ok._get_related_invoices())
+        self.assertFalse(contract_error._get_related_invoices())
+        self.assertIn("Failure", contract_error.message_ids[0].body)
+
+    def test_get_next_periods_bulk(self):
+        mixin = self.env["contract.recurrency.mixin"]
+        cases = []
+        for rule_type in (
+            "daily",
+            "weekly",
+            "monthly",
+            "monthlylastday",
+            "quarterly",
+            "semesterly",
+            "yearly",
+        ):
+            for invoicing_type in ("pre-paid", "post-paid"):
+                for date_start, date_end in (
+                    (to_date("2018-01-31"), False),
+                    (to_date("2020-02-29"), to_date("2021-03-15")),
+                    (to_date("2018-05-15"), to_date("2018-05-10")),
+                ):
+                    offset = mixin._get_default_recurring_invoicing_offset(
+                        invoicing_type, rule_type
+                    )
+                    cases.append(
+                        (date_start, rule_type, 2, invoicing_type, offset, date_end)
+                    )
+        cases.append((False, "monthly", 1, "pre-paid", 0, False))
+        date_to = to_date("2022-12-31")
+        args = [list(arg) for arg in zip(*cases)] + [date_to]
+        scalar = mixin._get_next_periods_scalar(*args)
+        self.assertEqual(mixin.get_next_periods_bulk(*args), scalar)
+        self.assertTrue(all(p[2] <= date_to for periods in scalar for p in periods))
+        self.assertEqual(
+            mixin.get_next_periods_bulk(*args[:-1], to_date("2017-12-31")),
+            [[]] * len(cases),
+        )
+        for (
+            date_start,
+            rule_type,
+            interval,
+            inv_type,
+            offset,
+            date_end,
+        ), periods in zip(cases, scalar):
+            recurring_next_date = mixin.get_next_invoice_date(
+                date_start, inv_type, offset, rule_type, interval, date_end
+            )
+            self.assertEqual(periods[0][2] if periods else False, recurring_next_date)
+            if periods:
+                self.assertEqual(
+                    periods[0][1],
+                    mixin.get_next_period_date_end(
+                        date_start, rule_type, interval, max_date_end=date_end
+                    ),
+                )
+
     def test_get_period_to_invoice_monthlylastday_postpaid(self):
         self.acct_line.date_start = "2018-01-05"
         self.acct_line.recurring_invoicing_type = "post-paid"
@@ -2089,7 +2569,7 @@ class TestContract(TestContractBase):
         self.assertEqual(set(lines.mapped("state")), set(states))
         lines = self.env["contract.line"].search([("state", "in", [])])
         self.assertFalse(lines.mapped("state"))
-        with self.assertRaises(TypeError):
+        with self.assertRaises(ValueError):
             self.env["contract.line"].search([("state", "in", "upcoming")])
         lines = self.env["contract.line"].search([("state", "not in", [])])
         self.assertEqual(set(lines.mapped("state")), set(states))
@@ -2099,6 +2579,35 @@ class TestContract(TestContractBase):
         lines = self.env["contract.line"].search([("state", "not in", state2)])
         self.assertEqual(set(lines.mapped("state")), set(states) - set(state2))
 
+    def test_cron_refresh_contract_line_state(self):
+        line = self.acct_line.copy(
+            {
+                "date_start": self.today + relativedelta(days=1),
+                "recurring_next_date": self.today + relativedelta(days=1),
+                "date_end": self.today + relativedelta(days=2),
+                "termination_notice_rule_type": "daily",
+                "termination_notice_interval": 0,
+            }
+        )
+        other_line = self.acct_line.copy(
+            {
+                "date_start": self.today + relativedelta(months=1),
+                "recurring_next_date": self.today + relativedelta(months=1),
+                "date_end": self.today + relativedelta(months=2),
+            }
+        )
+        self.assertEqual(line.state, "upcoming")
+        self.env["contract.line"].cron_refresh_contract_line_state()
+        with freeze_time(self.today + relativedelta(days=1)):
+            self.env["contract.line"].cron_refresh_contract_line_state()
+            self.assertEqual(line.state, "in-progress")
+            self.assertEqual(other_line.state, "upcoming")
+        with freeze_time(self.today + relativedelta(days=3)):
+            self.env["contract.line"].cron_refresh_contract_line_state()
+            self.assertEqual(line.state, "closed")
+            lines = self.env["contract.line"].search([("state", "=", "closed")])
+            self.assertIn(line, lines)
+
     def test_check_auto_renew_contract_line_with_successor(self):
         """
         A contract line with a successor can't be set to auto-renew
@@ -2245,6 +2754,64 @@ class TestContract(TestContractBase):
         self.contract._compute_invoice_count()
         self.assertEqual(self.contract.invoice_count, 3)
 
+    def test_contract_count_invoice_grouped(self):
+        invoice = self.contract.recurring_create_invoice()
+        self.contract2.recurring_create_invoice()
+        self.contract2.recurring_create_invoice()
+        self.assertEqual(invoice.contract_id, self.contract)
+        contracts = self.contract | self.contract2
+        contracts._compute_invoice_count()
+        self.assertEqual(contracts.mapped("invoice_count"), [1, 2])
+
+    def test_contract_count_invoice_multi_contract(self):
+        invoice = self.contract.recurring_create_invoice()
+        contract3_line = self.contract3.contract_line_ids.filtered(
+            lambda x: not x.display_type
+        )[:1]
+        invoice.write(
+            {
+                "invoice_line_ids": [
+                    (
+                        0,
+                        0,
+                        {
+                            "name": "Line of contract 3",
+                            "product_id": self.product_1.id,
+                            "quantity": 1,
+                            "price_unit": 10,
+                            "contract_line_id": contract3_line.id,
+                        },
+                    )
+                ]
+            }
+        )
+        contracts = self.contract | self.contract3
+        self.assertEqual(invoice.contract_ids, contracts)
+        contracts._compute_invoice_count()
+        self.assertEqual(contracts.mapped("invoice_count"), [1, 1])
+        self.assertEqual(self.contract3._get_related_invoices(), invoice)
+        self.assertEqual(
+            contracts._get_invoices_by_contract(invoice),
+            {self.contract: invoice, self.contract3: invoice},
+        )
+
+    def test_recurring_create_invoice_origin_and_followers(self):
+        partner2 = self.partner.copy()
+        subtype = self.env.ref("contract.mail_message_subtype_invoice_created")
+        (self.contract | self.contract2).message_subscribe(
+            partner_ids=partner2.ids, subtype_ids=subtype.ids
+        )
+        contracts = self.contract | self.contract2
+        invoices = contracts._recurring_create_invoice()
+        invoices_by_contract = contracts._get_invoices_by_contract(invoices)
+        self.assertEqual(set(invoices_by_contract), set(contracts))
+        for contract, moves in invoices_by_contract.items():
+            self.assertEqual(moves.contract_id, contract)
+            self.assertIn(partner2, moves.message_partner_ids)
+            self.assertTrue(
+                moves.message_ids.filtered(lambda m: "by contract" in m.body)
+            )
+
     def test_contract_count_invoice_2(self):
         invoices = self.env["account.move"]
         invoices |= self.contract.recurring_create_invoice()
@@ -2274,6 +2841,61 @@ class TestContract(TestContractBase):
         )
         self.assertFalse(section.create_invoice_visibility)
 
+    def test_get_lines_to_invoice_by_contract(self):
+        line_model = self.env["contract.line"]
+        self.contract.contract_line_ids.write({"sequence": 10})
+        date_ref = self.acct_line.recurring_next_date
+
+        def create_line(sequence, **vals):
+            return line_model.create(
+                dict(
+                    vals,
+                    contract_id=self.contract.id,
+                    name="Line %s" % sequence,
+                    sequence=sequence,
+                )
+            )
+
+        section = create_line(5, display_type="line_section")
+        note_previous = create_line(20, display_type="line_note")
+        note_next = create_line(
+            30, display_type="line_note", note_invoicing_mode="with_next_line"
+        )
+        not_invoiced = self.acct_line.copy(
+            {"sequence": 40, "recurring_next_date": date_ref + relativedelta(days=1)}
+        )
+        note_skipped = create_line(50, display_type="line_note")
+        lines = self.contract._get_lines_to_invoice_by_contract(
+            {self.contract.id: date_ref, self.contract2.id: date_ref}
+        )
+        self.assertEqual(
+            lines[self.contract.id],
+            (section | self.acct_line | note_previous).ids,
+        )
+        self.assertNotIn(note_next.id, lines[self.contract.id])
+        self.assertNotIn(not_invoiced.id, lines[self.contract.id])
+        self.assertNotIn(note_skipped.id, lines[self.contract.id])
+        self.assertEqual(
+            lines[self.contract2.id],
+            self.contract2._get_lines_to_invoice(date_ref).ids,
+        )
+
+    def test_update_recurring_next_date_grouped(self):
+        line_1 = self.acct_line.copy()
+        line_2 = self.acct_line.copy({"recurring_rule_type": "yearly"})
+        lines = self.acct_line | line_1 | line_2
+        expected = {line: line.next_period_date_end for line in lines}
+        with patch.object(
+            type(self.acct_line),
+            "write",
+            autospec=True,
+            side_effect=type(self.acct_line).write,
+        ) as write:
+            lines._update_recurring_next_date()
+        self.assertEqual(write.call_count, 2)
+        for line in lines:
+            self.assertEqual(line.last_date_invoiced, expected[line])
+
     def test_invoice_contract_without_lines(self):
         self.contract.contract_line_ids.cancel()
         self.contract.contract_line_ids.unlink()
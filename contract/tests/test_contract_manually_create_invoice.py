@@ -4,6 +4,8 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
 
+from dateutil.relativedelta import relativedelta
+
 from odoo.exceptions import UserError
 from odoo.tests import tagged
 
@@ -70,3 +72,79 @@ class TestContractManuallyCreateInvoice(TestContractBase):
         except Exception as e:
             # The re-raised UserError message is the modified one.
             self.assertTrue(str(e).startswith("Failed to process the contract"))
+
+    def test_contract_manually_create_invoice_simulation(self):
+        contracts = self.contract
+        for _i in range(3):
+            contracts |= self.contract.copy()
+        lines = contracts.mapped("contract_line_ids")
+        last_dates_invoiced = lines.mapped("last_date_invoiced")
+        wizard = self.env["contract.manually.create.invoice"].create(
+            {
+                "invoice_date": self.today,
+                "simulation_date_to": self.today + relativedelta(days=10),
+            }
+        )
+        wizard.action_simulate()
+        simulation_lines = wizard.simulation_line_ids.filtered(
+            lambda x: x.contract_id in contracts
+        )
+        self.assertEqual(simulation_lines.contract_id, contracts)
+        # January, February and half of March, one day after the other
+        self.assertEqual(set(simulation_lines.mapped("invoice_count")), {3})
+        self.assertEqual(lines.mapped("last_date_invoiced"), last_dates_invoiced)
+        self.assertFalse(
+            self.env["account.move"].search([("contract_id", "in", contracts.ids)])
+        )
+        action = wizard.action_show_simulation()
+        self.assertEqual(action["context"]["group_by"], ["partner_id"])
+
+    def test_simulate_recurring_invoices(self):
+        totals = self.contract.simulate_recurring_invoices(self.today)
+        invoices = list(self.contract._simulate_recurring_invoices(self.today))
+        self.assertEqual(len(invoices), 1)
+        self.contract.recurring_create_invoice()
+        invoice = self.contract._get_related_invoices()
+        self.assertEqual(
+            [
+                line[2]["quantity"]
+                for line in invoices[0]["invoice_values"]["invoice_line_ids"]
+                if not line[2].get("display_type")
+            ],
+            invoice.invoice_line_ids.filtered(lambda x: not x.display_type).mapped(
+                "quantity"
+            ),
+        )
+        self.assertAlmostEqual(invoices[0]["amount_total"], invoice.amount_total)
+        self.assertEqual(totals["contracts"][self.contract.id]["invoice_count"], 1)
+        self.assertAlmostEqual(
+            totals["partners"][(invoice.partner_id.id, invoice.currency_id.id)][
+                "amount_untaxed"
+            ],
+            invoice.amount_untaxed,
+        )
+
+    def test_contract_manually_create_invoice_job(self):
+        self.env["ir.config_parameter"].sudo().set_param("contract.cron.batch_size", 3)
+        contracts = self.contract
+        for _i in range(6):
+            contracts |= self.contract.copy()
+        wizard = self.env["contract.manually.create.invoice"].create(
+            {"invoice_date": self.today}
+        )
+        total_count = wizard.contract_to_invoice_count
+        self.assertTrue(total_count > 3)
+        action = wizard.create_invoice()
+        self.assertEqual(action["res_model"], "contract.invoicing.job")
+        job = self.env["contract.invoicing.job"].browse(action["res_id"])
+        self.assertEqual(job.state, "pending")
+        self.assertEqual(job.total_count, total_count)
+        self.assertFalse(contracts._get_related_invoices())
+        self.env["contract.invoicing.job"].cron_process_invoicing_jobs()
+        self.assertEqual(job.state, "done")
+        self.assertEqual(job.done_count, total_count)
+        self.assertEqual(job.progress, 100.0)
+        self.assertEqual(
+            job.invoice_ids.filtered(lambda m: m.contract_id in contracts).contract_id,
+            contracts,
+        )
@@ -18,7 +18,7 @@ class ContractManuallyCreateInvoice(models.TransientModel):
 
     invoice_date = fields.Date(string="Invoice Date", required=True)
     contract_to_invoice_count = fields.Integer(
-        compute="_compute_contract_to_invoice_ids"
+        compute="_compute_contract_to_invoice_count"
     )
     contract_to_invoice_ids = fields.Many2many(
         comodel_name="contract.contract",
@@ -29,20 +29,40 @@ class ContractManuallyCreateInvoice(models.TransientModel):
         default="sale",
         required=True,
     )
+    simulation_date_to = fields.Date(
+        string="Simulate Until",
+        help="Preview without creating them the invoices the recurring cron "
+        "would create every day from the invoice date until this date.",
+    )
+    simulation_line_ids = fields.One2many(
+        comodel_name="contract.manually.create.invoice.simulation",
+        inverse_name="wizard_id",
+        string="Simulated Invoices",
+        readonly=True,
+    )
 
-    @api.depends("invoice_date")
-    def _compute_contract_to_invoice_ids(self):
+    def _get_contract_to_invoice_domain(self):
+        self.ensure_one()
         if not self.invoice_date:
             # trick to show no invoice when no date has been entered yet
-            contract_to_invoice_domain = [("id", "=", False)]
-        else:
-            contract_to_invoice_domain = self.env[
+            return [("id", "=", False)]
+        return self.env["contract.contract"]._get_contracts_to_invoice_domain(
+            self.invoice_date
+        ) + [("contract_type", "=", self.contract_type)]
+
+    @api.depends("invoice_date", "contract_type")
+    def _compute_contract_to_invoice_count(self):
+        for wizard in self:
+            wizard.contract_to_invoice_count = self.env[
                 "contract.contract"
-            ]._get_contracts_to_invoice_domain(self.invoice_date)
-        self.contract_to_invoice_ids = self.env["contract.contract"].search(
-            contract_to_invoice_domain + [("contract_type", "=", self.contract_type)]
-        )
-        self.contract_to_invoice_count = len(self.contract_to_invoice_ids)
+            ].search_count(wizard._get_contract_to_invoice_domain())
+
+    @api.depends("invoice_date", "contract_type")
+    def _compute_contract_to_invoice_ids(self):
+        for wizard in self:
+            wizard.contract_to_invoice_ids = self.env["contract.contract"].search(
+                wizard._get_contract_to_invoice_domain()
+            )
 
     def action_show_contract_to_invoice(self):
         self.ensure_one()
@@ -50,13 +70,100 @@ class ContractManuallyCreateInvoice(models.TransientModel):
             "type": "ir.actions.act_window",
             "name": _("Contracts to invoice"),
             "res_model": "contract.contract",
-            "domain": [("id", "in", self.contract_to_invoice_ids.ids)],
+            "domain": self._get_contract_to_invoice_domain(),
             "view_mode": "tree,form",
             "context": self.env.context,
         }
 
+    def action_simulate(self):
+        self.ensure_one()
+        date_to = self.simulation_date_to or self.invoice_date
+        contracts = self.env["contract.contract"].search(
+            self.env["contract.contract"]._get_contracts_to_invoice_domain(date_to)
+            + [
+                ("contract_type", "=", self.contract_type),
+                ("generation_type", "=", "invoice"),
+            ],
+            order="id",
+        )
+        self.simulation_line_ids.unlink()
+        simulation_model = self.env["contract.manually.create.invoice.simulation"]
+        vals_list = []
+        vals = {}
+        # The invoices are simulated contract after contract, so the totals of
+        # a contract are complete as soon as the next contract shows up
+        for invoice in contracts._simulate_recurring_invoices(
+            date_to, date_from=self.invoice_date
+        ):
+            if vals.get("contract_id") != invoice["contract_id"]:
+                if len(vals_list) >= 1000:
+                    simulation_model.create(vals_list)
+                    vals_list = []
+                vals = {
+                    "wizard_id": self.id,
+                    "contract_id": invoice["contract_id"],
+                    "partner_id": invoice["partner_id"],
+                    "currency_id": invoice["currency_id"],
+                    "invoice_count": 0,
+                    "amount_untaxed": 0.0,
+                    "amount_tax": 0.0,
+                    "amount_total": 0.0,
+                }
+                vals_list.append(vals)
+            vals["invoice_count"] += 1
+            for amount in ("amount_untaxed", "amount_tax", "amount_total"):
+                vals[amount] += invoice[amount]
+        simulation_model.create(vals_list)
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": self._name,
+            "res_id": self.id,
+            "view_mode": "form",
+            "target": "new",
+            "context": self.env.context,
+        }
+
+    def action_show_simulation(self):
+        self.ensure_one()
+        return {
+            "type": "ir.actions.act_window",
+            "name": _("Simulated Invoices"),
+            "res_model": "contract.manually.create.invoice.simulation",
+            "domain": [("wizard_id", "=", self.id)],
+            "view_mode": "tree,pivot",
+            "context": dict(self.env.context, group_by=["partner_id"]),
+        }
+
+    def _use_invoicing_job(self):
+        """Whether the contracts are too many for being invoiced during the
+        request, and must be invoiced by a background job."""
+        self.ensure_one()
+        batch_size = self.env["contract.contract"]._get_cron_batch_size()
+        return bool(batch_size) and self.contract_to_invoice_count > batch_size
+
+    def create_invoicing_job(self):
+        self.ensure_one()
+        job = self.env["contract.invoicing.job"].create(
+            {
+                "invoice_date": self.invoice_date,
+                "contract_type": self.contract_type,
+                "company_ids": [(6, 0, self.env.companies.ids)],
+                "total_count": self.contract_to_invoice_count,
+            }
+        )
+        job._dispatch()
+        return {
+            "type": "ir.actions.act_window",
+            "name": _("Contract Invoicing Job"),
+            "res_model": "contract.invoicing.job",
+            "res_id": job.id,
+            "view_mode": "form",
+        }
+
     def create_invoice(self):
         self.ensure_one()
+        if self._use_invoicing_job():
+            return self.create_invoicing_job()
         invoices = self.env["account.move"]
         for contract in self.contract_to_invoice_ids:
             try:
@@ -85,3 +192,23 @@ class ContractManuallyCreateInvoice(models.TransientModel):
             "view_mode": "tree,form",
             "context": self.env.context,
         }
+
+
+class ContractManuallyCreateInvoiceSimulation(models.TransientModel):
+
+    _name = "contract.manually.create.invoice.simulation"
+    _description = "Contract Manually Create Invoice Simulation"
+    _order = "partner_id, contract_id"
+
+    wizard_id = fields.Many2one(
+        comodel_name="contract.manually.create.invoice",
+        required=True,
+        ondelete="cascade",
+    )
+    contract_id = fields.Many2one(comodel_name="contract.contract", readonly=True)
+    partner_id = fields.Many2one(comodel_name="res.partner", readonly=True)
+    currency_id = fields.Many2one(comodel_name="res.currency", readonly=True)
+    invoice_count = fields.Integer(readonly=True)
+    amount_untaxed = fields.Monetary(string="Untaxed Amount", readonly=True)
+    amount_tax = fields.Monetary(string="Tax", readonly=True)
+    amount_total = fields.Monetary(string="Total", readonly=True)
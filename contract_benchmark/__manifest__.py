@@ -0,0 +1,15 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+{
+    "name": "Contract Benchmark",
+    "summary": "Measure the contract and subscription crons on synthetic data",
+    "version": "14.0.1.0.0",
+    "license": "AGPL-3",
+    "author": "Sygel, Odoo Community Association (OCA)",
+    "website": "https://github.com/OCA/contract",
+    "depends": ["contract", "subscription_oca"],
+    "data": [
+        "security/ir.model.access.csv",
+        "wizards/contract_benchmark.xml",
+    ],
+}
@@ -0,0 +1,56 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import json
+
+from odoo.tests import common
+
+
+class TestContractBenchmark(common.SavepointCase):
+    def test_run_benchmark(self):
+        report = self.env["contract.benchmark"].run_benchmark(
+            contract_count=8, line_count=2, subscription_count=2
+        )
+        phases = {phase["name"]: phase for phase in report["phases"]}
+        self.assertEqual(
+            set(phases),
+            {
+                "generate_contracts",
+                "cron_recurring_create_invoice",
+                "cron_renew_contract_line",
+                "generate_subscriptions",
+                "cron_subscription_management",
+            },
+        )
+        self.assertEqual(phases["generate_contracts"]["records"], 8)
+        self.assertEqual(phases["cron_recurring_create_invoice"]["records"], 8)
+        self.assertEqual(phases["cron_renew_contract_line"]["records"], 4)
+        for phase in phases.values():
+            self.assertGreater(phase["queries"], 0)
+            self.assertGreaterEqual(phase["duration"], 0)
+        # The report is machine-readable
+        self.assertEqual(json.loads(json.dumps(report)), report)
+        # Nothing is kept from a dry run
+        self.assertFalse(
+            self.env["contract.contract"].search(
+                [("name", "=like", "Benchmark contract %")]
+            )
+        )
+
+    def test_run_benchmark_no_dry_run(self):
+        report = self.env["contract.benchmark"].run_benchmark(
+            contract_count=2, line_count=1, dry_run=False
+        )
+        self.assertFalse(report["dry_run"])
+        self.assertEqual(
+            self.env["contract.contract"].search_count(
+                [("name", "=like", "Benchmark contract %")]
+            ),
+            2,
+        )
+
+    def test_action_run(self):
+        wizard = self.env["contract.benchmark"].create(
+            {"contract_count": 2, "line_count": 1}
+        )
+        wizard.action_run()
+        self.assertEqual(json.loads(wizard.result)["parameters"]["contract_count"], 2)
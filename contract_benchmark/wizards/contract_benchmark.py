@@ -0,0 +1,327 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import json
+import logging
+import time
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import api, fields, models, release
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+RECURRING_RULE_TYPES = [
+    "monthly",
+    "monthlylastday",
+    "quarterly",
+    "semesterly",
+    "yearly",
+]
+
+
+class ContractBenchmark(models.TransientModel):
+    _name = "contract.benchmark"
+    _description = "Contract Benchmark"
+
+    contract_count = fields.Integer(default=100, required=True)
+    line_count = fields.Integer(string="Lines per Contract", default=5, required=True)
+    company_count = fields.Integer(
+        default=1,
+        required=True,
+        help="Number of companies (having a sale journal) the contracts are "
+        "spread over.",
+    )
+    subscription_count = fields.Integer(default=0)
+    dry_run = fields.Boolean(
+        default=True,
+        help="Roll the benchmark back once measured, without letting the crons "
+        "commit. Otherwise, the generated records are kept and the crons commit "
+        "their batches, for all the due records of the database.",
+    )
+    result = fields.Text(readonly=True)
+
+    def action_run(self):
+        self.ensure_one()
+        report = self.run_benchmark(
+            contract_count=self.contract_count,
+            line_count=self.line_count,
+            company_count=self.company_count,
+            subscription_count=self.subscription_count,
+            dry_run=self.dry_run,
+        )
+        self.result = json.dumps(report, indent=2)
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": self._name,
+            "res_id": self.id,
+            "view_mode": "form",
+            "target": "new",
+        }
+
+    @api.model
+    def run_benchmark(
+        self,
+        contract_count=100,
+        line_count=5,
+        company_count=1,
+        subscription_count=0,
+        dry_run=True,
+    ):
+        """Generate a synthetic dataset and run the crons on it.
+
+        :param dry_run: roll everything back once measured. The crons run
+          with the ``contract_cron_no_commit`` context key: they neither
+          commit nor open other cursors, and their mails are only queued.
+        :return: JSON serializable dictionary with the parameters and the
+          measures of each phase
+        """
+        args = (contract_count, line_count, company_count, subscription_count)
+        if not dry_run:
+            return self._run_benchmark(*args, dry_run=False)
+        self.env["base"].flush()
+        self.env.cr.execute("SAVEPOINT contract_benchmark")
+        try:
+            return self.with_context(
+                contract_cron_no_commit=True, mail_notify_force_send=False
+            )._run_benchmark(*args, dry_run=True)
+        finally:
+            self.env.cr.execute("ROLLBACK TO SAVEPOINT contract_benchmark")
+            self.env.clear()
+
+    @api.model
+    def _run_benchmark(
+        self, contract_count, line_count, company_count, subscription_count, dry_run
+    ):
+        companies = self._get_benchmark_companies(company_count)
+        report = {
+            "odoo_version": release.version,
+            "database": self.env.cr.dbname,
+            "date": fields.Datetime.to_string(fields.Datetime.now()),
+            "dry_run": dry_run,
+            "parameters": {
+                "contract_count": contract_count,
+                "line_count": line_count,
+                "company_count": len(companies),
+                "subscription_count": subscription_count,
+            },
+            "phases": [],
+        }
+        contracts = self._measure(
+            report,
+            "generate_contracts",
+            lambda: self._generate_contracts(contract_count, line_count, companies),
+        )
+        invoice_model = self.env["account.move"]
+        self._measure(
+            report,
+            "cron_recurring_create_invoice",
+            self.env["contract.contract"].cron_recurring_create_invoice,
+            counter=lambda: invoice_model.search_count(
+                [("contract_id", "in", contracts.ids)]
+            ),
+        )
+        line_model = self.env["contract.line"]
+        self._measure(
+            report,
+            "cron_renew_contract_line",
+            line_model.cron_renew_contract_line,
+            counter=lambda: line_model.search_count(
+                [
+                    ("contract_id", "in", contracts.ids),
+                    ("is_auto_renew", "=", True),
+                    ("termination_notice_date", ">", fields.Date.today()),
+                ]
+            ),
+        )
+        if subscription_count:
+            subscriptions = self._measure(
+                report,
+                "generate_subscriptions",
+                lambda: self._generate_subscriptions(subscription_count),
+            )
+            self._measure(
+                report,
+                "cron_subscription_management",
+                self.env["sale.subscription"].cron_subscription_management,
+                counter=lambda: invoice_model.search_count(
+                    [("subscription_id", "in", subscriptions.ids)]
+                ),
+            )
+        _logger.info("Contract benchmark: %s", json.dumps(report))
+        return report
+
+    @api.model
+    def _get_max_rss(self):
+        """Peak resident memory of the process so far, in bytes, 0 where it
+        isn't available.
+        """
+        if resource is None:
+            return 0
+        # Kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    @api.model
+    def _measure(self, report, name, func, counter=None):
+        """Run ``func`` and append its measures to the phases of ``report``.
+
+        The peak memory is the growth of the peak resident memory of the
+        process during ``func``, so it doesn't slow down the timing as
+        tracing the allocations would.
+
+        :param counter: function counting the records handled by ``func``,
+          called before and after it. By default, the records handled are the
+          ones returned by ``func``.
+        :return: the result of ``func``
+        """
+        self.env["base"].flush()
+        count_before = counter() if counter else 0
+        queries_before = self.env.cr.sql_log_count
+        max_rss_before = self._get_max_rss()
+        start = time.perf_counter()
+        result = func()
+        self.env["base"].flush()
+        duration = time.perf_counter() - start
+        peak_memory = self._get_max_rss() - max_rss_before
+        queries = self.env.cr.sql_log_count - queries_before
+        if counter:
+            records = counter() - count_before
+        else:
+            records = len(result) if isinstance(result, models.BaseModel) else 0
+        report["phases"].append(
+            {
+                "name": name,
+                "duration": round(duration, 6),
+                "queries": queries,
+                "peak_memory": peak_memory,
+                "records": records,
+            }
+        )
+        return result
+
+    @api.model
+    def _get_benchmark_companies(self, company_count):
+        companies = (
+            self.env["account.journal"]
+            .search([("type", "=", "sale")])
+            .mapped("company_id")
+        )
+        return companies[: max(company_count, 1)]
+
+    @api.model
+    def _get_benchmark_product(self):
+        return self.env["product.product"].create(
+            {
+                "name": "Benchmark service",
+                "type": "service",
+                "list_price": 100.0,
+                "taxes_id": [(5, 0, 0)],
+                "supplier_taxes_id": [(5, 0, 0)],
+            }
+        )
+
+    @api.model
+    def _get_benchmark_partners(self, count):
+        return self.env["res.partner"].create(
+            [{"name": "Benchmark partner %s" % index} for index in range(count)]
+        )
+
+    @api.model
+    def _prepare_benchmark_contract(self, index, line_count, company, partner, product):
+        """Values of the index-th contract: the recurrence is alternately
+        defined on the lines or on the contract, and one contract out of four
+        has lines to renew.
+        """
+        today = fields.Date.context_today(self)
+        recurrence_vals = {
+            "recurring_rule_type": RECURRING_RULE_TYPES[
+                index % len(RECURRING_RULE_TYPES)
+            ],
+            "recurring_interval": 1,
+            "recurring_invoicing_type": "pre-paid",
+            "date_start": today,
+        }
+        renew_vals = {}
+        if index % 4 == 3:
+            recurrence_vals["date_start"] = today - relativedelta(years=1)
+            renew_vals = {
+                "date_end": today,
+                "is_auto_renew": True,
+                "auto_renew_interval": 1,
+                "auto_renew_rule_type": "yearly",
+            }
+        line_recurrence = bool(index % 2)
+        if line_recurrence:
+            contract_vals, line_vals = {}, dict(recurrence_vals, **renew_vals)
+        else:
+            contract_vals, line_vals = recurrence_vals, renew_vals
+        return dict(
+            contract_vals,
+            name="Benchmark contract %s" % index,
+            partner_id=partner.id,
+            company_id=company.id,
+            line_recurrence=line_recurrence,
+            contract_line_ids=[
+                (
+                    0,
+                    0,
+                    dict(
+                        line_vals,
+                        product_id=product.id,
+                        name="Services from #START# to #END#",
+                        quantity=1 + line_index % 3,
+                        uom_id=product.uom_id.id,
+                        price_unit=10.0 * (1 + line_index),
+                    ),
+                )
+                for line_index in range(line_count)
+            ],
+        )
+
+    @api.model
+    def _generate_contracts(self, contract_count, line_count, companies):
+        product = self._get_benchmark_product()
+        partners = self._get_benchmark_partners(max(contract_count // 10, 1))
+        return self.env["contract.contract"].create(
+            [
+                self._prepare_benchmark_contract(
+                    index,
+                    line_count,
+                    companies[index % len(companies)],
+                    partners[index % len(partners)],
+                    product,
+                )
+                for index in range(contract_count)
+            ]
+        )
+
+    @api.model
+    def _generate_subscriptions(self, subscription_count):
+        today = fields.Date.context_today(self)
+        product = self._get_benchmark_product()
+        partners = self._get_benchmark_partners(max(subscription_count // 10, 1))
+        template = self.env["sale.subscription.template"].create(
+            {"name": "Benchmark template", "recurring_rule_boundary": "unlimited"}
+        )
+        return self.env["sale.subscription"].create(
+            [
+                {
+                    "partner_id": partners[index % len(partners)].id,
+                    "pricelist_id": partners[
+                        index % len(partners)
+                    ].property_product_pricelist.id,
+                    "template_id": template.id,
+                    "in_progress": True,
+                    "date_start": today - relativedelta(months=1),
+                    "recurring_next_date": today,
+                    "sale_subscription_line_ids": [
+                        (0, 0, {"product_id": product.id, "product_uom_qty": 1})
+                    ],
+                }
+                for index in range(subscription_count)
+            ]
+        )
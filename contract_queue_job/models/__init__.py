@@ -1,2 +1,3 @@
 from . import contract_contract
 from . import contract_line
+from . import contract_invoicing_job
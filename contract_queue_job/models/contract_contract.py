@@ -9,6 +9,12 @@ class ContractContract(models.Model):
 
     _inherit = "contract.contract"
 
+    def _job_prepare_context_before_enqueue_keys(self):
+        # Keep the catch-up mode of the recurring cron in the delayed jobs
+        return super()._job_prepare_context_before_enqueue_keys() + (
+            "contract_catch_up",
+        )
+
     def _recurring_create_invoice(self, date_ref=False):
         as_job = (
             self.env["ir.config_parameter"]
@@ -0,0 +1,20 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo import models
+
+
+class ContractInvoicingJob(models.Model):
+
+    _inherit = "contract.invoicing.job"
+
+    def _dispatch(self):
+        """Process the chunks of the jobs in chained queue jobs instead of
+        the cron."""
+        self.write({"dispatched_by_cron": False})
+        for job in self:
+            job.with_delay()._process_chunk_job()
+
+    def _process_chunk_job(self):
+        self.ensure_one()
+        if self._process_chunk():
+            self.with_delay()._process_chunk_job()
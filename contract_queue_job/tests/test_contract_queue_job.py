@@ -72,3 +72,41 @@ class TestContractQueueJob(TestContractBase, JobMixin):
         job_counter = self.job_counter()
         contracts._recurring_create_invoice()
         self.assertEqual(job_counter.count_created(), 0)
+
+    def test_contract_invoicing_job(self):
+        self.env["ir.config_parameter"].sudo().set_param("contract.queue.job", False)
+        contracts = self.contract2 | self.contract3
+        wizard = self.env["contract.manually.create.invoice"].create(
+            {"invoice_date": self.today, "contract_type": "purchase"}
+        )
+        job_counter = self.job_counter()
+        action = wizard.create_invoicing_job()
+        invoicing_job = self.env["contract.invoicing.job"].browse(action["res_id"])
+        self.assertFalse(invoicing_job.dispatched_by_cron)
+        self.assertEqual(job_counter.count_created(), 1)
+        self.perform_jobs(job_counter)
+        self.assertEqual(len(self._get_related_invoices(contracts)), 2)
+        # The next chunk finds nothing left to invoice
+        self.assertEqual(job_counter.count_created(), 2)
+        self.perform_jobs(job_counter)
+        self.assertEqual(invoicing_job.state, "done")
+
+    def test_contract_queue_job_catch_up(self):
+        line = self.contract2.contract_line_ids
+        line.write(
+            {
+                "date_start": "2018-01-01",
+                "recurring_invoicing_type": "post-paid",
+                "date_end": "2018-03-15",
+            }
+        )
+        self.contract2.company_id.contract_catch_up_mode = "period"
+        job_counter = self.job_counter()
+        self.env["contract.contract"].cron_recurring_create_invoice()
+        # The cron goes through the jobs of this module in catch-up mode too
+        self.assertFalse(self._get_related_invoices(self.contract2))
+        self.assertTrue(job_counter.count_created())
+        self.perform_jobs(job_counter)
+        invoices = self._get_related_invoices(self.contract2)
+        self.assertEqual(len(invoices), 3)
+        self.assertEqual(set(invoices.mapped("invoice_date")), {self.today})
@@ -91,14 +91,16 @@ class ContractContract(models.Model):
         :return: list of dictionaries (invoices values)
         """
         sales_values = []
+        date_refs = self._get_date_refs(date_ref)
+        lines_by_contract = self._get_lines_to_invoice_by_contract(date_refs)
+        invoiced_line_ids = []
         for contract in self:
-            if not date_ref:
-                date_ref = contract.recurring_next_date
-            if not date_ref:
-                # this use case is possible when recurring_create_invoice is
-                # called for a finished contract
+            if contract.id not in date_refs:
                 continue
-            contract_lines = contract._get_lines_to_invoice(date_ref)
+            date_ref = date_refs[contract.id]
+            contract_lines = self.env["contract.line"].browse(
+                lines_by_contract[contract.id]
+            )
             if not contract_lines:
                 continue
             sale_values = contract._prepare_sale(date_ref)
@@ -110,7 +112,10 @@ class ContractContract(models.Model):
                 if invoice_line_values:
                     sale_values["order_line"].append((0, 0, invoice_line_values))
             sales_values.append(sale_values)
-            contract_lines._update_recurring_next_date()
+            invoiced_line_ids += contract_lines.ids
+        # Update the invoiced lines of all the contracts at once
+        invoiced_lines = self.env["contract.line"].browse(invoiced_line_ids)
+        invoiced_lines._update_recurring_next_date()
         return sales_values
 
     def _recurring_create_sale(self, date_ref=False):
@@ -108,6 +108,14 @@ class TestContractSale(ContractSaleCommon, SavepointCase):
             len(order_lines),
         )
 
+    def test_manually_create_invoice_simulation(self):
+        # Contracts generating sale orders are not simulated as invoices
+        wizard = self.env["contract.manually.create.invoice"].create(
+            {"invoice_date": to_date("2020-01-15")}
+        )
+        wizard.action_simulate()
+        self.assertNotIn(self.contract, wizard.simulation_line_ids.contract_id)
+
     def test_contract_sale_analytic(self):
         orders = self.env["sale.order"].browse()
         orders |= self.contract.recurring_create_sale()
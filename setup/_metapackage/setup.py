@@ -21,6 +21,7 @@ setuptools.setup(
         'odoo14-addon-agreement_stock',
         'odoo14-addon-agreement_tier_validation',
         'odoo14-addon-contract',
+        'odoo14-addon-contract_benchmark',
         'odoo14-addon-contract_delivery_zone',
         'odoo14-addon-contract_invoice_start_end_dates',
         'odoo14-addon-contract_mandate',
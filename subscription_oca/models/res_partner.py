@@ -2,6 +2,8 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 from odoo import fields, models
 
+from .utils import count_by
+
 
 class Partner(models.Model):
     _inherit = "res.partner"
@@ -17,8 +19,9 @@ class Partner(models.Model):
     )
 
     def _compute_subscription_count(self):
+        count_dict = count_by(self.env["sale.subscription"], "partner_id", self.ids)
         for record in self:
-            record.subscription_count = len(record.subscription_ids)
+            record.subscription_count = count_dict.get(record._origin.id, 0)
 
     def action_view_subscription_ids(self):
         return {
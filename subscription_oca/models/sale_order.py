@@ -7,6 +7,8 @@ from dateutil.relativedelta import relativedelta
 
 from odoo import api, fields, models
 
+from .utils import count_by
+
 
 class SaleOrder(models.Model):
     _inherit = "sale.order"
@@ -23,8 +25,9 @@ class SaleOrder(models.Model):
 
     @api.depends("subscription_ids")
     def _compute_subscriptions_count(self):
+        count_dict = count_by(self.env["sale.subscription"], "sale_order_id", self.ids)
         for record in self:
-            record.subscriptions_count = len(record.subscription_ids)
+            record.subscriptions_count = count_dict.get(record._origin.id, 0)
 
     def action_view_subscriptions(self):
         return {
@@ -1,13 +1,18 @@
 # Copyright 2023 Domatix - Carlos Martínez
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import base64
 import logging
+import time
+from collections import defaultdict
 from datetime import date, datetime
 
 from dateutil.relativedelta import relativedelta
 
-from odoo import _, api, fields, models
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import AccessError, ValidationError
 
+from .utils import count_by
+
 logger = logging.getLogger(__name__)
 
 
@@ -142,26 +147,72 @@ class SaleSubscription(models.Model):
     crm_team_id = fields.Many2one(comodel_name="crm.team", string="Sale team")
     to_renew = fields.Boolean(default=False, string="To renew")
 
+    def init(self):
+        # Indexes of the searches of cron_subscription_management
+        for name, columns in (
+            ("in_progress_recurring_next_date", ["in_progress", "recurring_next_date"]),
+            ("in_progress_date", ["in_progress", "date"]),
+            ("in_progress_date_start", ["in_progress", "date_start"]),
+        ):
+            tools.create_index(
+                self._cr, "sale_subscription_%s_index" % name, self._table, columns
+            )
+
+    @api.model
+    def _get_subscriptions_to_invoice_domain(self, today):
+        return [
+            ("in_progress", "=", True),
+            ("recurring_next_date", "=", today),
+            ("sale_subscription_line_ids", "!=", False),
+        ]
+
+    @api.model
+    def _get_subscriptions_to_close_domain(self, today):
+        return [
+            ("in_progress", "=", True),
+            ("recurring_rule_boundary", "=", False),
+            ("date", "=", today),
+        ]
+
+    @api.model
+    def _get_subscriptions_to_start_domain(self, today):
+        return [
+            ("in_progress", "=", False),
+            ("date_start", "=", today),
+        ]
+
+    @api.model
     def cron_subscription_management(self):
         today = date.today()
-        for subscription in self.search([]):
-            if subscription.in_progress:
-                if (
-                    subscription.recurring_next_date == today
-                    and subscription.sale_subscription_line_ids
-                ):
-                    try:
-                        subscription.generate_invoice()
-                    except Exception:
-                        logger.exception("Error on subscription invoice generate")
-                if not subscription.recurring_rule_boundary:
-                    if subscription.date == today:
-                        subscription.action_close_subscription()
-
-            else:
-                if subscription.date_start == today:
-                    subscription.action_start_subscription()
-                    subscription.generate_invoice()
+        # All the due subscriptions are selected before acting on any of them,
+        # so a subscription is handled once per run whatever its changes
+        to_invoice = self.search(self._get_subscriptions_to_invoice_domain(today))
+        to_close = self.search(self._get_subscriptions_to_close_domain(today))
+        to_start = self.search(self._get_subscriptions_to_start_domain(today))
+        invoice_by_subscription = {}
+        try:
+            with self.env.cr.savepoint():
+                invoice_by_subscription = to_invoice._generate_invoices()
+        except Exception:
+            logger.exception(
+                "Error on subscriptions invoice generate, generating them one by one"
+            )
+            # Invoice the subscriptions one by one for skipping the failing ones
+            for subscription in to_invoice:
+                try:
+                    with self.env.cr.savepoint():
+                        invoice_by_subscription.update(
+                            subscription._generate_invoices()
+                        )
+                except Exception:
+                    logger.exception("Error on subscription invoice generate")
+        # The invoices are sent once they are all generated, so that no mail is
+        # queued for a generation rolled back above
+        self._send_invoices(invoice_by_subscription)
+        for subscription in to_close:
+            subscription.action_close_subscription()
+        to_start.action_start_subscription()
+        to_start.generate_invoice()
 
     @api.constrains("template_id")
     def _check_template_id(self):
@@ -223,15 +274,27 @@ class SaleSubscription(models.Model):
         else:
             self.calculate_recurring_next_date(today)
 
-    def calculate_recurring_next_date(self, start_date):
+    def _get_recurring_next_date(self, start_date):
+        self.ensure_one()
         if self.account_invoice_ids_count == 0:
-            self.recurring_next_date = date.today()
-        else:
-            type_interval = self.template_id.recurring_rule_type
-            interval = int(self.template_id.recurring_interval)
-            self.recurring_next_date = start_date + relativedelta(
-                **{type_interval: interval}
-            )
+            return date.today()
+        type_interval = self.template_id.recurring_rule_type
+        interval = int(self.template_id.recurring_interval)
+        return start_date + relativedelta(**{type_interval: interval})
+
+    def calculate_recurring_next_date(self, start_date):
+        self.recurring_next_date = self._get_recurring_next_date(start_date)
+
+    def _update_recurring_next_date(self):
+        """Move the subscriptions in self to their next invoice date, with one
+        write per date."""
+        subscription_ids = defaultdict(list)
+        for record in self:
+            subscription_ids[
+                record._get_recurring_next_date(record.recurring_next_date)
+            ].append(record.id)
+        for recurring_next_date, ids in subscription_ids.items():
+            self.browse(ids).write({"recurring_next_date": recurring_next_date})
 
     @api.onchange("partner_id")
     def onchange_partner_id(self):
@@ -298,14 +361,8 @@ class SaleSubscription(models.Model):
             values["journal_id"] = self.journal_id.id
         return values
 
-    def create_invoice(self):
+    def _prepare_invoice_values(self):
         self.ensure_one()
-        if not self.env["account.move"].check_access_rights("create", False):
-            try:
-                self.check_access_rights("write")
-                self.check_access_rule("write")
-            except AccessError:
-                return self.env["account.move"]
         line_ids = []
         start_date = self.recurring_next_date or self.date_start
         end_date = self._get_next_period_date_end(start_date, self.date)
@@ -313,22 +370,29 @@ class SaleSubscription(models.Model):
             line_values = line._prepare_account_move_line(start_date, end_date)
             line_ids.append((0, 0, line_values))
         invoice_values = self._prepare_account_move(line_ids)
-        invoice_id = (
-            self.env["account.move"]
-            .sudo()
-            .with_context(default_move_type="out_invoice", journal_type="sale")
-            .create(invoice_values)
-        )
-        self.write({"invoice_ids": [(4, invoice_id.id)]})
-        return invoice_id
+        invoice_values["subscription_id"] = self.id
+        return invoice_values
 
-    def create_sale_order(self):
-        if not self.env["sale.order"].check_access_rights("create", False):
+    def create_invoice(self):
+        """Create the invoices of the subscriptions in self at once.
+
+        :return: the invoices, in the order of the subscriptions
+        """
+        if not self.env["account.move"].check_access_rights("create", False):
             try:
                 self.check_access_rights("write")
                 self.check_access_rule("write")
             except AccessError:
-                return self.env["sale.order"]
+                return self.env["account.move"]
+        return (
+            self.env["account.move"]
+            .sudo()
+            .with_context(default_move_type="out_invoice", journal_type="sale")
+            .create([record._prepare_invoice_values() for record in self])
+        )
+
+    def _prepare_sale_order_values(self):
+        self.ensure_one()
         line_ids = []
         start_date = self.recurring_next_date or self.date_start
         end_date = self._get_next_period_date_end(start_date, self.date)
@@ -336,65 +400,247 @@ class SaleSubscription(models.Model):
             line_values = line._prepare_sale_order_line(start_date, end_date)
             line_ids.append((0, 0, line_values))
         values = self._prepare_sale_order(line_ids)
-        order_id = self.env["sale.order"].sudo().create(values)
-        self.write({"sale_order_ids": [(4, order_id.id)]})
-        return order_id
+        values["order_subscription_id"] = self.id
+        return values
 
-    def generate_invoice(self):
-        invoice_number = ""
+    def create_sale_order(self):
+        """Create the sale orders of the subscriptions in self at once.
+
+        :return: the orders, in the order of the subscriptions
+        """
+        if not self.env["sale.order"].check_access_rights("create", False):
+            try:
+                self.check_access_rights("write")
+                self.check_access_rule("write")
+            except AccessError:
+                return self.env["sale.order"]
+        return (
+            self.env["sale.order"]
+            .sudo()
+            .create([record._prepare_sale_order_values() for record in self])
+        )
+
+    def _get_invoice_message(self, invoice):
         msg_static = _("Created invoice with reference")
-        if self.template_id.invoicing_mode in ["draft", "invoice", "invoice_send"]:
-            invoice = self.create_invoice()
-            if self.template_id.invoicing_mode != "draft":
-                invoice.action_post()
-                if self.template_id.invoicing_mode == "invoice_send":
-                    self.send_invoice(invoice)
-                invoice_number = invoice.name
-                message_body = (
-                    "<b>%s</b> <a href=# data-oe-model=account.move data-oe-id=%d>%s</a>"
-                    % (msg_static, invoice.id, invoice_number)
-                )
+        if invoice and invoice.name:
+            return (
+                "<b>%s</b> <a href=# data-oe-model=account.move data-oe-id=%d>%s</a>"
+                % (msg_static, invoice.id, invoice.name)
+            )
+        return "<b>%s</b> %s" % (msg_static, _("To validate"))
 
-        elif self.template_id.invoicing_mode in ["sale_draft"]:
-            self.create_sale_order()
+    def _generate_invoices_from_sale_orders(self):
+        """Generate the documents of the subscriptions in self invoiced through
+        sale orders.
 
-        elif self.template_id.invoicing_mode in ["sale_confirmed"]:
-            order_id = self.create_sale_order()
-            order_id.action_confirm()
+        The orders are created, confirmed and invoiced all at once, with one
+        invoice per order.
 
-        elif self.template_id.invoicing_mode in [
-            "sale_and_invoice",
-            "sale_and_invoice_draft",
-            "sale_and_invoice_send",
-        ]:
-            order_id = self.create_sale_order()
-            order_id.action_done()
-            new_invoice = order_id._create_invoices()
-            self.write({"invoice_ids": [(4, new_invoice.id)]})
-            if self.template_id.invoicing_mode == "sale_and_invoice":
-                new_invoice.action_post()
-            new_invoice.invoice_origin = order_id.name + ", " + self.name
-            invoice_number = new_invoice.name
-            message_body = (
-                "<b>%s</b> <a href=# data-oe-model=account.move data-oe-id=%d>%s</a>"
-                % (msg_static, new_invoice.id, invoice_number)
+        :return: dictionary subscription -> created invoice
+        """
+        orders = self.create_sale_order() if self else self.env["sale.order"]
+
+        def invoicing_mode(order):
+            return order.order_subscription_id.template_id.invoicing_mode
+
+        orders.filtered(
+            lambda o: invoicing_mode(o) == "sale_confirmed"
+        ).action_confirm()
+        orders = orders.filtered(
+            lambda o: invoicing_mode(o)
+            in ["sale_and_invoice", "sale_and_invoice_draft", "sale_and_invoice_send"]
+        )
+        if not orders:
+            return {}
+        orders.action_done()
+        invoices = orders._create_invoices(grouped=True)
+        invoice_by_subscription = {}
+        for invoice in invoices:
+            order = invoice.line_ids.sale_line_ids.order_id[:1]
+            subscription = order.order_subscription_id
+            invoice.write(
+                {
+                    "subscription_id": subscription.id,
+                    "invoice_origin": order.name + ", " + subscription.name,
+                }
             )
-            if self.template_id.invoicing_mode == "sale_and_invoice_send":
-                self.send_invoice(new_invoice)
-        if not invoice_number:
-            invoice_number = _("To validate")
-            message_body = "<b>%s</b> %s" % (msg_static, invoice_number)
-        self.calculate_recurring_next_date(self.recurring_next_date)
-        self.message_post(body=message_body)
+            invoice_by_subscription[subscription] = invoice
+        invoices.filtered(
+            lambda m: m.subscription_id.template_id.invoicing_mode == "sale_and_invoice"
+        ).action_post()
+        return invoice_by_subscription
+
+    def _generate_invoices(self):
+        """Generate the documents of the subscriptions in self according to the
+        invoicing mode of their template, without sending the invoices.
+
+        The invoices of the subscriptions invoiced directly, and the orders of
+        the ones invoiced through sale orders, are created and posted all at
+        once.
+
+        :return: dictionary subscription -> created invoice
+        """
+        direct = self.filtered(
+            lambda s: s.template_id.invoicing_mode
+            in ["draft", "invoice", "invoice_send"]
+        )
+        invoices = direct.create_invoice() if direct else self.env["account.move"]
+        invoice_by_subscription = {
+            invoice.subscription_id: invoice for invoice in invoices
+        }
+        invoices.filtered(
+            lambda m: m.subscription_id.template_id.invoicing_mode != "draft"
+        ).action_post()
+        invoice_by_subscription.update(
+            (self - direct)._generate_invoices_from_sale_orders()
+        )
+        for subscription in self:
+            invoice = invoice_by_subscription.get(subscription)
+            if invoice and subscription in direct and invoice.state == "draft":
+                # Draft invoices are still to validate
+                invoice = None
+            subscription.message_post(body=subscription._get_invoice_message(invoice))
+        self._update_recurring_next_date()
+        return invoice_by_subscription
+
+    def _send_invoices(self, invoice_by_subscription):
+        """Send the invoices of the subscriptions whose invoicing mode sends
+        them.
+
+        :param invoice_by_subscription: dict subscription -> created invoice
+        """
+        return self._enqueue_invoice_mails(
+            {
+                subscription: invoice
+                for subscription, invoice in invoice_by_subscription.items()
+                if invoice
+                and subscription.template_id.invoicing_mode
+                in ["invoice_send", "sale_and_invoice_send"]
+            }
+        )
+
+    def generate_invoice(self):
+        """Generate the documents of the subscriptions in self according to the
+        invoicing mode of their template, and send the invoices.
+        """
+        self._send_invoices(self._generate_invoices())
 
     def send_invoice(self, invoice):
-        mail_template = self.template_id.invoice_mail_template_id
-        invoice.with_context(force_send=True).message_post_with_template(
-            mail_template.id,
-            composition_mode="comment",
+        self.ensure_one()
+        self._enqueue_invoice_mails({self: invoice})
+
+    @api.model
+    def _get_invoice_mail_fields(self):
+        return [
+            "subject",
+            "body_html",
+            "email_from",
+            "email_to",
+            "partner_to",
+            "email_cc",
+            "reply_to",
+        ]
+
+    @api.model
+    def _render_invoice_mails(self, mail_template, invoices):
+        """Render ``mail_template`` for all the ``invoices`` at once, the
+        template classifying them by the language of their partner.
+
+        :return: dictionary invoice id -> rendered values, empty if the
+          rendering of the batch fails
+        """
+        try:
+            with self.env.cr.savepoint():
+                return mail_template.generate_email(
+                    invoices.ids, self._get_invoice_mail_fields()
+                )
+        except Exception:
+            logger.exception(
+                "Error on rendering the invoice mails of template %s, "
+                "rendering them one by one",
+                mail_template.name,
+            )
+            return {}
+
+    def _post_invoice_mail(self, invoice, values):
+        """Post on ``invoice`` the mail rendered in ``values``, which is
+        queued and sent by the mail scheduler.
+        """
+        invoice.with_context(mail_notify_force_send=False).message_post(
+            body=values.get("body", ""),
+            subject=values.get("subject"),
+            email_from=values.get("email_from"),
+            reply_to=values.get("reply_to"),
+            partner_ids=values.get("partner_ids", []),
+            attachments=[
+                (name, base64.b64decode(content))
+                for name, content in values.get("attachments", [])
+            ],
+            attachment_ids=values.get("attachment_ids", []),
+            mail_server_id=values.get("mail_server_id"),
+            mail_auto_delete=values.get("auto_delete", True),
+            message_type="comment",
+            subtype_xmlid="mail.mt_comment",
             email_layout_xmlid="mail.mail_notification_paynow",
         )
 
+    @api.model
+    def _enqueue_invoice_mails(self, invoice_by_subscription):
+        """Post the invoice mail of the template of each subscription on its
+        invoice.
+
+        Each template is rendered once for all its invoices, in the language
+        of their partner, and the mails are queued and sent by the mail
+        scheduler instead of within the current transaction. Each mail is
+        posted in a savepoint of its own, so a failing invoice is logged and
+        skipped without preventing the others from being sent.
+
+        :param invoice_by_subscription: dict subscription -> invoice to send
+        :return: dictionary with the metrics of the run
+        """
+        start = time.perf_counter()
+        invoices_by_template = defaultdict(lambda: self.env["account.move"])
+        for subscription, invoice in invoice_by_subscription.items():
+            mail_template = subscription.template_id.invoice_mail_template_id
+            if mail_template:
+                invoices_by_template[mail_template] |= invoice
+        error_count = 0
+        for mail_template, invoices in invoices_by_template.items():
+            values_by_invoice = self._render_invoice_mails(mail_template, invoices)
+            for invoice in invoices:
+                try:
+                    with self.env.cr.savepoint():
+                        values = values_by_invoice.get(invoice.id)
+                        if values is None:
+                            values = mail_template.generate_email(
+                                invoice.id, self._get_invoice_mail_fields()
+                            )
+                        self._post_invoice_mail(invoice, values)
+                except Exception:
+                    error_count += 1
+                    logger.exception(
+                        "Error on sending the mail of invoice %s [id: %s]",
+                        invoice.name,
+                        invoice.id,
+                    )
+        metrics = {
+            "invoice_count": len(invoice_by_subscription),
+            "template_count": len(invoices_by_template),
+            "error_count": error_count,
+            "duration": time.perf_counter() - start,
+        }
+        if metrics["invoice_count"]:
+            logger.info(
+                "Subscription invoice mails: %d invoices of %d templates queued "
+                "in %.2fs (%.1f invoices/s), %d errors",
+                metrics["invoice_count"],
+                metrics["template_count"],
+                metrics["duration"],
+                metrics["invoice_count"] / (metrics["duration"] or 1),
+                metrics["error_count"],
+            )
+        return metrics
+
     def manual_invoice(self):
         invoice_id = self.create_invoice()
         self.calculate_recurring_next_date(self.recurring_next_date)
@@ -453,10 +699,39 @@ class SaleSubscription(models.Model):
 
     @api.depends("invoice_ids", "sale_order_ids.invoice_ids")
     def _compute_account_invoice_ids_count(self):
-        for record in self:
-            record.account_invoice_ids_count = len(self.invoice_ids) + len(
-                self.sale_order_ids.invoice_ids
+        count_dict = {}
+        if self.ids:
+            # Invoices of the subscriptions and of their sale orders, which may
+            # be the same ones
+            self.env["account.move"].flush(["subscription_id", "move_type"])
+            self.env["account.move.line"].flush(["move_id"])
+            self.env["sale.order.line"].flush(["order_id", "invoice_lines"])
+            self.env["sale.order"].flush(["order_subscription_id"])
+            self.env.cr.execute(
+                """
+                SELECT subscription_id, COUNT(DISTINCT move_id)
+                FROM (
+                    SELECT subscription_id, id AS move_id
+                    FROM account_move
+                    WHERE subscription_id IN %(ids)s
+                    UNION ALL
+                    SELECT so.order_subscription_id, aml.move_id
+                    FROM sale_order so
+                    JOIN sale_order_line sol ON sol.order_id = so.id
+                    JOIN sale_order_line_invoice_rel rel
+                        ON rel.order_line_id = sol.id
+                    JOIN account_move_line aml ON aml.id = rel.invoice_line_id
+                    JOIN account_move am ON am.id = aml.move_id
+                    WHERE so.order_subscription_id IN %(ids)s
+                        AND am.move_type IN ('out_invoice', 'out_refund')
+                ) AS subscription_move
+                GROUP BY subscription_id
+                """,
+                {"ids": tuple(self.ids)},
             )
+            count_dict = dict(self.env.cr.fetchall())
+        for record in self:
+            record.account_invoice_ids_count = count_dict.get(record._origin.id, 0)
 
     def action_view_account_invoice_ids(self):
         return {
@@ -476,17 +751,9 @@ class SaleSubscription(models.Model):
         }
 
     def _compute_sale_order_ids_count(self):
-        data = self.env["sale.order"].read_group(
-            domain=[("order_subscription_id", "in", self.ids)],
-            fields=["order_subscription_id"],
-            groupby=["order_subscription_id"],
-        )
-        count_dict = {
-            item["order_subscription_id"][0]: item["order_subscription_id_count"]
-            for item in data
-        }
+        count_dict = count_by(self.env["sale.order"], "order_subscription_id", self.ids)
         for record in self:
-            record.sale_order_ids_count = count_dict.get(record.id, 0)
+            record.sale_order_ids_count = count_dict.get(record._origin.id, 0)
 
     def action_view_sale_order_ids(self):
         active_ids = self.sale_order_ids.ids
@@ -4,6 +4,8 @@ from dateutil.relativedelta import relativedelta
 
 from odoo import api, fields, models
 
+from .utils import count_by
+
 
 class SaleSubscriptionTemplate(models.Model):
     _name = "sale.subscription.template"
@@ -73,16 +75,9 @@ class SaleSubscriptionTemplate(models.Model):
     )
 
     def _compute_subscription_count(self):
-        data = self.env["sale.subscription"].read_group(
-            domain=[("template_id", "in", self.ids)],
-            fields=["template_id"],
-            groupby=["template_id"],
-        )
-        count_dict = {
-            item["template_id"][0]: item["template_id_count"] for item in data
-        }
+        count_dict = count_by(self.env["sale.subscription"], "template_id", self.ids)
         for record in self:
-            record.subscription_count = count_dict.get(record.id, 0)
+            record.subscription_count = count_dict.get(record._origin.id, 0)
 
     def action_view_subscription_ids(self):
         return {
@@ -99,8 +94,11 @@ class SaleSubscriptionTemplate(models.Model):
 
     @api.depends("product_ids")
     def _compute_product_ids_count(self):
+        count_dict = count_by(
+            self.env["product.template"], "subscription_template_id", self.ids
+        )
         for record in self:
-            record.product_ids_count = len(self.product_ids)
+            record.product_ids_count = count_dict.get(record._origin.id, 0)
 
     def action_view_product_ids(self):
         return {
@@ -0,0 +1,18 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+
+def count_by(model, field_name, ids, domain=None):
+    """Count the records of ``model`` by value of the many2one ``field_name``
+    in one query.
+
+    :param ids: ids of the values of ``field_name`` to count
+    :return: dictionary id -> count. The ids of the records being edited in
+      an onchange are their origin ids, so read it with ``record._origin.id``.
+    """
+    data = model.read_group(
+        domain=[(field_name, "in", ids)] + (domain or []),
+        fields=[field_name],
+        groupby=[field_name],
+        lazy=False,
+    )
+    return {item[field_name][0]: item["__count"] for item in data}
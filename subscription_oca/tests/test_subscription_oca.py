@@ -2,6 +2,7 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
 import uuid
+from unittest.mock import patch
 
 from dateutil.relativedelta import relativedelta
 
@@ -408,6 +409,215 @@ class TestSubscriptionOCA(SavepointCase):
         self.assertEqual(self.sub2.recurring_total, 66.2)
         self.assertEqual(self.sub2.amount_total, 69)
 
+    def test_subscription_oca_sub_cron_due_selection(self):
+        today = fields.Date.today()
+        sub_later = self.create_sub(
+            {
+                "date_start": today - relativedelta(days=10),
+                "recurring_next_date": today + relativedelta(days=1),
+                "in_progress": True,
+            }
+        )
+        self.create_sub_line(sub_later)
+        sub_start = self.create_sub({"date_start": today, "in_progress": False})
+        self.create_sub_line(sub_start)
+        sub_closed = self.create_sub(
+            {"date_start": today - relativedelta(days=10), "in_progress": False}
+        )
+        subscription_model = self.env["sale.subscription"]
+        to_invoice = subscription_model.search(
+            subscription_model._get_subscriptions_to_invoice_domain(today)
+        )
+        self.assertIn(self.sub_sale_draft, to_invoice)
+        self.assertNotIn(sub_later, to_invoice)
+        to_start = subscription_model.search(
+            subscription_model._get_subscriptions_to_start_domain(today)
+        )
+        self.assertIn(sub_start, to_start)
+        self.assertNotIn(sub_closed, to_start)
+        subscription_model.cron_subscription_management()
+        self.assertTrue(sub_start.in_progress)
+        self.assertTrue(self.sub_sale_draft.sale_order_ids)
+        self.assertFalse(sub_later.invoice_ids)
+        self.assertFalse(sub_closed.in_progress)
+
+    def test_subscription_oca_generate_invoice_batch(self):
+        today = fields.Date.today()
+        tmpl_draft = self.create_sub_template({"invoicing_mode": "draft"})
+        tmpl_invoice = self.create_sub_template({"invoicing_mode": "invoice"})
+        subscriptions = self.env["sale.subscription"]
+        for template in (tmpl_draft, tmpl_invoice, tmpl_invoice):
+            subscription = self.create_sub(
+                {
+                    "template_id": template.id,
+                    "date_start": today,
+                    "recurring_next_date": today,
+                    "in_progress": True,
+                }
+            )
+            self.create_sub_line(subscription)
+            subscriptions |= subscription
+        move_model = type(self.env["account.move"])
+        with patch.object(
+            move_model, "create", autospec=True, side_effect=move_model.create
+        ) as create:
+            subscriptions.generate_invoice()
+        self.assertEqual(create.call_count, 1)
+        invoices = subscriptions.mapped("invoice_ids")
+        self.assertEqual(invoices.subscription_id, subscriptions)
+        self.assertEqual(
+            invoices.filtered(lambda m: m.state == "posted").subscription_id,
+            subscriptions[1:],
+        )
+        self.assertEqual(
+            set(subscriptions.mapped("recurring_next_date")),
+            {today + relativedelta(months=1)},
+        )
+
+    def test_subscription_oca_generate_invoice_sale_order_batch(self):
+        today = fields.Date.today()
+        tmpl_sale_and_invoice = self.create_sub_template(
+            {"invoicing_mode": "sale_and_invoice"}
+        )
+        subscriptions = self.env["sale.subscription"]
+        for template in (
+            self.tmpl_sale_confirmed,
+            tmpl_sale_and_invoice,
+            tmpl_sale_and_invoice,
+        ):
+            subscription = self.create_sub(
+                {
+                    "template_id": template.id,
+                    "date_start": today,
+                    "recurring_next_date": today,
+                    "in_progress": True,
+                }
+            )
+            self.create_sub_line(subscription)
+            subscriptions |= subscription
+        order_model = type(self.env["sale.order"])
+        move_model = type(self.env["account.move"])
+        with patch.object(
+            order_model, "create", autospec=True, side_effect=order_model.create
+        ) as order_create, patch.object(
+            move_model, "create", autospec=True, side_effect=move_model.create
+        ) as move_create:
+            subscriptions.generate_invoice()
+        self.assertEqual(order_create.call_count, 1)
+        self.assertEqual(move_create.call_count, 1)
+        self.assertEqual(subscriptions[0].sale_order_ids.state, "sale")
+        self.assertFalse(subscriptions[0].invoice_ids)
+        for subscription in subscriptions[1:]:
+            order = subscription.sale_order_ids
+            self.assertEqual(len(order), 1)
+            self.assertEqual(subscription.invoice_ids, order.invoice_ids)
+            self.assertEqual(subscription.invoice_ids.state, "posted")
+            self.assertEqual(
+                subscription.invoice_ids.invoice_origin,
+                "%s, %s" % (order.name, subscription.name),
+            )
+
+    def test_subscription_oca_invoice_mails_queued(self):
+        today = fields.Date.today()
+        tmpl_invoice_send = self.create_sub_template(
+            {
+                "invoicing_mode": "invoice_send",
+                "invoice_mail_template_id": self.env.ref(
+                    "account.email_template_edi_invoice"
+                ).id,
+            }
+        )
+        subscriptions = self.env["sale.subscription"]
+        for partner in self.partner | self.partner_2:
+            subscription = self.create_sub(
+                {
+                    "partner_id": partner.id,
+                    "template_id": tmpl_invoice_send.id,
+                    "date_start": today,
+                    "recurring_next_date": today,
+                    "in_progress": True,
+                }
+            )
+            self.create_sub_line(subscription)
+            subscriptions |= subscription
+        template_model = type(self.env["mail.template"])
+        with patch.object(
+            template_model,
+            "generate_email",
+            autospec=True,
+            side_effect=template_model.generate_email,
+        ) as generate_email:
+            subscriptions.generate_invoice()
+        # The template is rendered once for all the invoices
+        self.assertEqual(generate_email.call_count, 1)
+        invoices = subscriptions.mapped("invoice_ids")
+        self.assertEqual(len(invoices), 2)
+        mails = self.env["mail.mail"].search(
+            [("model", "=", "account.move"), ("res_id", "in", invoices.ids)]
+        )
+        self.assertEqual(len(mails), 2)
+        self.assertEqual(set(mails.mapped("state")), {"outgoing"})
+        # Each mail is rendered for its own invoice
+        for invoice in invoices:
+            mail = mails.filtered(lambda m, inv=invoice: m.res_id == inv.id)
+            other_invoice = invoices - invoice
+            self.assertEqual(mail.recipient_ids, invoice.partner_id)
+            self.assertIn(invoice.name, mail.subject)
+            self.assertNotIn(other_invoice.name, mail.subject)
+            self.assertIn(invoice.name, mail.body_html)
+            self.assertNotIn(other_invoice.name, mail.body_html)
+        metrics = subscriptions._enqueue_invoice_mails(
+            {subscription: subscription.invoice_ids for subscription in subscriptions}
+        )
+        self.assertEqual(metrics["invoice_count"], 2)
+        self.assertEqual(metrics["template_count"], 1)
+        self.assertEqual(metrics["error_count"], 0)
+
+    def test_subscription_oca_invoice_mails_error(self):
+        today = fields.Date.today()
+        tmpl_invoice_send = self.create_sub_template(
+            {
+                "invoicing_mode": "invoice_send",
+                "invoice_mail_template_id": self.env.ref(
+                    "account.email_template_edi_invoice"
+                ).id,
+            }
+        )
+        subscriptions = self.env["sale.subscription"]
+        for partner in self.partner | self.partner_2:
+            subscription = self.create_sub(
+                {
+                    "partner_id": partner.id,
+                    "template_id": tmpl_invoice_send.id,
+                    "date_start": today,
+                    "recurring_next_date": today,
+                    "in_progress": True,
+                }
+            )
+            self.create_sub_line(subscription)
+            subscriptions |= subscription
+        invoice_by_subscription = subscriptions._generate_invoices()
+        invoice_error = invoice_by_subscription[subscriptions[0]]
+        invoice_ok = invoice_by_subscription[subscriptions[1]]
+        subscription_model = type(self.env["sale.subscription"])
+        post_invoice_mail = subscription_model._post_invoice_mail
+
+        def _post_invoice_mail(subscription, invoice, values):
+            if invoice == invoice_error:
+                raise exceptions.UserError("Failure")
+            return post_invoice_mail(subscription, invoice, values)
+
+        with patch.object(subscription_model, "_post_invoice_mail", _post_invoice_mail):
+            metrics = subscriptions._send_invoices(invoice_by_subscription)
+        self.assertEqual(metrics["error_count"], 1)
+        mails = self.env["mail.mail"].search(
+            [
+                ("model", "=", "account.move"),
+                ("res_id", "in", (invoice_error | invoice_ok).ids),
+            ]
+        )
+        self.assertEqual(mails.mapped("res_id"), invoice_ok.ids)
+
     def test_subscription_oca_sub1_workflow(self):
         res = self._collect_all_sub_test_results(self.sub1)
         self.assertTrue(res[0])
@@ -595,6 +805,42 @@ class TestSubscriptionOCA(SavepointCase):
         self.sub_sale_and_invoice_send.generate_invoice()
         self.assertEqual(len(self.sub_sale_and_invoice_send.invoice_ids), 1)
 
+    def test_subscription_oca_counts(self):
+        subscription = self.sub_sale_and_invoice_send
+        subscription.generate_invoice()
+        subscriptions = subscription | self.sub1
+        subscriptions.invalidate_cache()
+        # The invoice of the sale order is counted once
+        self.assertEqual(subscriptions.mapped("account_invoice_ids_count"), [1, 0])
+        self.assertEqual(subscriptions.mapped("sale_order_ids_count"), [1, 0])
+        self.product_1.product_tmpl_id.subscription_template_id = self.tmpl1
+        templates = self.tmpl1 | self.tmpl2
+        self.assertEqual(
+            templates.mapped("product_ids_count"),
+            [len(self.tmpl1.product_ids), len(self.tmpl2.product_ids)],
+        )
+        self.assertNotEqual(*templates.mapped("product_ids_count"))
+
+    def test_subscription_oca_onchange_invoiced(self):
+        subscription = self.sub_sale_and_invoice_send
+        subscription.generate_invoice()
+        recurring_next_date = subscription.recurring_next_date
+        # The onchanges run on a new record having the subscription as origin
+        record = subscription.new(origin=subscription)
+        self.assertEqual(record.account_invoice_ids_count, 1)
+        self.assertEqual(record.sale_order_ids_count, 1)
+        record._onchange_template_id()
+        template = subscription.template_id
+        self.assertEqual(
+            record.recurring_next_date,
+            recurring_next_date
+            + relativedelta(
+                **{template.recurring_rule_type: template.recurring_interval}
+            ),
+        )
+        partner = self.partner.new(origin=self.partner)
+        self.assertEqual(partner.subscription_count, self.partner.subscription_count)
+
     def test_subscription_oca_sub_stage(self):
         # sale.subscription.stage
         self.stage._check_lot_product()  # should not raise